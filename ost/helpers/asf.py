@@ -10,8 +10,7 @@ from retry import retry
 
 from godale import Executor
 
-from ost.helpers import utils as h
-from ost.helpers.utils import TqdmUpTo
+from ost.helpers import scene_index, download
 from ost import Sentinel1Scene as S1Scene
 
 logger = logging.getLogger(__name__)
@@ -108,77 +107,11 @@ def s1_download(argument_list, uname, pword):
     url = argument_list[0]
     filename = argument_list[1]
 
-    password_manager = urlreq.HTTPPasswordMgrWithDefaultRealm()
-    password_manager.add_password(
-        None, "https://urs.earthdata.nasa.gov", uname, pword
+    # the session keeps the cookies of the Earthdata login
+    session = download.pooled_session(
+        ('asf', uname), lambda: SessionWithHeaderRedirection(uname, pword)
     )
-
-    cookie_jar = CookieJar()
-
-    opener = urlreq.build_opener(
-        urlreq.HTTPBasicAuthHandler(password_manager),
-        urlreq.HTTPCookieProcessor(cookie_jar)
-    )
-    urlreq.install_opener(opener)
-
-    logger.debug('INFO: Downloading scene to: {}'.format(filename))
-    # submit the request using the session
-    try:
-        response = urlreq.urlopen(url=url)
-        # raise an exception in case of http errors
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
-            logger.debug(
-                'Product %s missing from the archive, continuing.',
-                filename.split('/')[-1]
-            )
-            return filename.split('/')[-1]
-        else:
-            raise e
-    except urllib.error.URLError as e:
-        # Not an HTTP-specific error (e.g. connection refused)
-        # ...
-        raise e
-
-    # get download size
-    total_length = int(response.headers.get('content-length', 0))
-
-    # check if file is partially downloaded
-    if os.path.exists(filename):
-        first_byte = os.path.getsize(filename)
-    else:
-        first_byte = 0
-    if first_byte == total_length:
-        first_byte = total_length
-    elif first_byte > 0 and first_byte < total_length:
-        os.remove(filename)
-    zip_test = 1
-    while zip_test is not None and zip_test <= 10:
-        while first_byte < total_length:
-            with TqdmUpTo(unit='B', unit_scale=True, miniters=1,
-                          desc=url.split('/')[-1]) as t:
-                filename, headers = urlreq.urlretrieve(
-                    url, filename=filename, reporthook=t.update_to
-                )
-            # updated fileSize
-            first_byte = os.path.getsize(filename)
-        logger.debug('INFO: Checking the zip archive of {} for inconsistency'
-                     .format(filename))
-        zip_test = h.check_zipfile(filename)
-        # if it did not pass the test, remove the file
-        # in the while loop it will be downlaoded again
-        if zip_test is not None:
-            logger.debug('INFO: {} did not pass the zip test. \
-                  Re-downloading the full scene.'.format(filename))
-            if os.path.exists(filename):
-                os.remove(filename)
-                first_byte = 0
-        # otherwise we change the status to True
-        else:
-            logger.debug('INFO: {} passed the zip test.'.format(filename))
-            with open(str('{}.downloaded'.format(filename)), 'w') as file:
-                file.write('successfully downloaded \n')
-    return str('{}.downloaded'.format(filename))
+    return download.download_product(url, filename, session)
 
 
 def asf_batch_download(
@@ -204,6 +137,7 @@ def asf_batch_download(
         downloaded_string = task.result()
         if not downloaded_string.endswith('downloaded'):
             missing_scenes.append(downloaded_string)
+    scene_index.invalidate()
 
     downloaded_scenes = glob.glob(
         opj(download_dir, 'SAR', '*', '20*', '*', '*',
@@ -224,12 +158,11 @@ def _prepare_scenes_to_dl(inventory_df, download_dir):
     download_list = []
     for scene_id in scenes:
         scene = S1Scene(scene_id)
-        filepath = scene._download_path(download_dir, True)
-
-        if os.path.exists('{}.downloaded'.format(filepath)):
+        if scene.get_path(download_dir, data_mount=None):
             logger.debug('INFO: {} is already downloaded.'
                          .format(scene.scene_id))
         else:
+            filepath = scene._download_path(download_dir, True)
             download_list.append([scene.asf_url(), filepath])
     return download_list
 
@@ -1,10 +1,14 @@
 import os
 import logging
-import geopandas as gpd
 
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from godale import Executor
 from shapely.geometry import box
 
 from ost.helpers import scihub, vector as vec
+from ost.helpers.metadata import MetadataStore
 
 logger = logging.getLogger(__name__)
 
@@ -83,19 +87,98 @@ def get_bursts_pairs(master_annotation, slave_annotation, out_poly=None):
     return bursts_dict
 
 
+def _scene_bursts(scene, download_dir, data_mount, uname, pword):
+    '''Burst database of a single scene, None if not available'''
+    scene_id, filepath = scene
+    from ost.s1_core.s1scene import Sentinel1Scene as S1Scene
+    scene = S1Scene(scene_id)
+
+    # scenes parsed before are neither opened nor checked online again
+    gdf = MetadataStore().get_bursts(scene_id)
+    if gdf is not None:
+        return gdf
+
+    logger.debug('INFO: Getting burst info from {}.'.format(scene.scene_id))
+    if not filepath:
+        logger.debug('INFO: Retrieving burst info from scihub'
+                     '(need to download xml files)')
+        opener = scihub.connect(uname=uname, pword=pword)
+        if scene.scihub_online_status(opener) is False:
+            logger.debug('INFO: Product needs to be online'
+                         'to create a burst database.')
+            logger.debug('INFO: Download the product first and '
+                         'do the burst list from the local data.')
+            return None
+        return scene._scihub_annotation_get(uname, pword)
+    elif filepath[-4:] == '.zip':
+        return scene._zip_annotation_get(download_dir, data_mount)
+    elif filepath[-5:] == '.SAFE':
+        return scene._safe_annotation_get(download_dir, data_mount)
+    return None
+
+
+def cluster_anx_time(gdf, tolerance=1):
+    '''Snaps AnxTime values of the same burst to a common value
+
+    Within every track and swath, the sorted AnxTime values are split
+    into clusters wherever two neighbouring values differ by more than
+    the tolerance. All values of a cluster are replaced by its most
+    frequent value (the smallest of equally frequent ones).
+
+    Args:
+        gdf: burst GeoDataFrame with Track, SwathID and AnxTime columns
+        tolerance: maximum difference of neighbouring values
+                   within a cluster
+
+    Returns:
+        the AnxTime values of all rows, as a Series
+    '''
+    anx_time = gdf.AnxTime.astype('int64')
+    snapped = anx_time.copy()
+    for _, index in gdf.groupby(['Track', 'SwathID']).groups.items():
+        counts = anx_time.loc[index].value_counts().sort_index()
+        values = counts.index.values
+        # a new cluster starts at every gap larger than the tolerance
+        clusters = np.concatenate(
+            [[0], np.cumsum(np.diff(values) > tolerance)]
+        )
+        mapping = {}
+        for cluster in np.unique(clusters):
+            members = clusters == cluster
+            # the most frequent value, the smallest of equally frequent ones
+            representative = values[members][
+                np.argmax(counts.values[members])
+            ]
+            mapping.update(dict.fromkeys(values[members], representative))
+        snapped.loc[index] = anx_time.loc[index].map(mapping)
+
+    return snapped
+
+
 def burst_inventory(inventory_df,
                     outfile,
                     download_dir=os.getenv('HOME'),
                     data_mount='/eodata',
-                    uname=None, pword=None
+                    uname=None, pword=None,
+                    max_workers=None
                     ):
     '''Creates a Burst GeoDataFrame from an OST inventory file
 
+    The annotations of the scenes are read concurrently by max_workers
+    threads, and the AnxTime values of the same bursts are snapped to
+    a common value (see cluster_anx_time).
+
     Args:
+        inventory_df: OST inventory GeoDataFrame of SLC scenes
+        outfile: file of the burst inventory
+        download_dir: directory of the downloaded scenes
+        data_mount: mount point of a data repository (e.g. /eodata)
+        uname: scihub user name, for scenes that are not downloaded
+        pword: scihub password
+        max_workers: number of threads (default: one per CPU)
 
     Returns:
-
-
+        the burst GeoDataFrame
     '''
     # create column names for empty data frame
     from ost.s1_core.s1scene import Sentinel1Scene as S1Scene
@@ -104,56 +187,48 @@ def burst_inventory(inventory_df,
 
     # crs for empty dataframe
     crs = {'init': 'epsg:4326', 'no_defs': True}
-    # create empty dataframe
-    gdf_full = gpd.GeoDataFrame(columns=column_names, crs=crs)
-    # uname, pword = scihub.askScihubCreds()
-
-    for scene_id in inventory_df.identifier:
-        # read into S1Scene class
-        scene = S1Scene(scene_id)
-
-        logger.debug('INFO: Getting burst info from {}.'.format(scene.scene_id))
-
-        # get orbit direction
-        orbit_direction = inventory_df[
-            inventory_df.identifier == scene_id].orbitdirection.values[0]
-
-        filepath = scene.get_path(download_dir, data_mount)
-        if not filepath:
-            logger.debug('INFO: Retrieving burst info from scihub'
-                         '(need to download xml files)')
-            if not uname and not pword:
-                uname, pword = scihub.ask_credentials()
-
-            opener = scihub.connect(uname=uname, pword=pword)
-            if scene.scihub_online_status(opener) is False:
-                logger.debug('INFO: Product needs to be online'
-                             'to create a burst database.')
-                logger.debug('INFO: Download the product first and '
-                             'do the burst list from the local data.')
-            else:
-                single_gdf = scene._scihub_annotation_get(uname, pword)
-        elif filepath[-4:] == '.zip':
-            single_gdf = scene._zip_annotation_get(download_dir, data_mount)
-        elif filepath[-5:] == '.SAFE':
-            single_gdf = scene._safe_annotation_get(download_dir, data_mount)
-
-        # add orbit direction
-        single_gdf['Direction'] = orbit_direction
-        # append
-        gdf_full = gdf_full.append(single_gdf)
-
-    gdf_full = gdf_full.reset_index(drop=True)
-    for i in gdf_full['AnxTime'].unique():
-
-        # get similar burst times
-        idx = gdf_full.index[(gdf_full.AnxTime >= i - 1) &
-                             (gdf_full.AnxTime <= i + 1) &
-                             (gdf_full.AnxTime != i)].unique().values
-
-        # reset all to first value
-        for j in idx:
-            gdf_full.at[j, 'AnxTime'] = i
+
+    # orbit direction and local path of all scenes
+    directions = dict(zip(inventory_df.identifier,
+                          inventory_df.orbitdirection))
+    scenes = [
+        (scene_id, S1Scene(scene_id).get_path(download_dir, data_mount))
+        for scene_id in inventory_df.identifier
+    ]
+
+    # credentials are asked for once, before the threads start
+    if not all(filepath for _, filepath in scenes):
+        if not uname and not pword:
+            uname, pword = scihub.ask_credentials()
+
+    bursts = {}
+    executor = Executor(executor='concurrent_threads',
+                        max_workers=max_workers or os.cpu_count())
+    for task in executor.as_completed(
+            func=_scene_bursts,
+            iterable=scenes,
+            fargs=(download_dir, data_mount, uname, pword)
+    ):
+        single_gdf = task.result()
+        if single_gdf is not None and len(single_gdf):
+            bursts[single_gdf.SceneID.iloc[0]] = single_gdf
+
+    # in the order of the inventory, concatenated at once
+    gdfs = []
+    for scene_id, _ in scenes:
+        if scene_id in bursts:
+            # add orbit direction
+            gdfs.append(bursts[scene_id].assign(
+                Direction=directions[scene_id]
+            ))
+    if not gdfs:
+        raise RuntimeError('No burst information found for the inventory.')
+
+    gdf_full = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True))
+    gdf_full = gdf_full[column_names]
+    if gdf_full.crs is None:
+        gdf_full.crs = crs
+    gdf_full['AnxTime'] = cluster_anx_time(gdf_full)
 
     # create the acrual burst id
     gdf_full['bid'] = gdf_full.Direction.str[0] + \
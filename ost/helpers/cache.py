@@ -0,0 +1,281 @@
+'''
+Persistent cache for intermediate products of the GPT processing chain.
+
+Every cached processing step is identified by a key, built from the step
+name, a fingerprint of its input product and the processing parameters
+of the step. Outputs of successful steps are stored as BEAM-DIMAP in the
+cache directory and copied back on the next call with the same key,
+so that e.g. a re-run with another resolution does not need to import
+and calibrate the same scene again.
+
+The fingerprint of a product created or restored by the cache is stored
+next to it (inside the .data folder), so that keys chain through the
+processing steps. Products without such a key are fingerprinted by their
+.dim content and the size and modification time of their data files,
+while original scenes (zip or SAFE) are fingerprinted by their name and
+size.
+
+The cache is size-bounded. Once CACHE_MAX_DISK_USAGE (MB) is exceeded,
+the least recently used entries are removed. With a maximum disk usage
+of 0 (the default) caching is switched off.
+'''
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+import inspect
+import logging
+import functools
+from uuid import uuid4
+
+from ost.settings import CACHE_DIR, CACHE_MAX_DISK_USAGE
+
+logger = logging.getLogger(__name__)
+
+KEY_FILE = 'ost_cache.key'
+ENTRY_NAME = 'product'
+
+
+def _dimap_prefix(path):
+    path = str(path)
+    return path[:-4] if path.endswith('.dim') else path
+
+
+def _rename_dimap(dim_file, old_name, new_name):
+    # the .dim file references the data files relative to its own name
+    with open(dim_file, 'r') as file:
+        content = file.read()
+    content = content.replace(
+        '{}.data/'.format(old_name), '{}.data/'.format(new_name)
+    )
+    with open(dim_file, 'w') as file:
+        file.write(content)
+
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+
+def product_fingerprint(product):
+    '''Returns a fingerprint of an input product
+
+    Args:
+        product: path to an original Sentinel-1 scene (zip or SAFE)
+                 or to a BEAM-DIMAP product (with or without .dim)
+
+    Returns:
+        fingerprint as hex string
+    '''
+    product = str(product)
+    prefix = _dimap_prefix(product)
+
+    if os.path.isfile('{}.dim'.format(prefix)):
+        key_file = os.path.join('{}.data'.format(prefix), KEY_FILE)
+        if os.path.isfile(key_file):
+            with open(key_file, 'r') as file:
+                return file.read().strip()
+
+        # no key from the cache, so we need to be pessimistic
+        sha = hashlib.sha1()
+        with open('{}.dim'.format(prefix), 'rb') as file:
+            sha.update(file.read())
+        data_files = glob.glob(os.path.join('{}.data'.format(prefix), '*'))
+        for file in sorted(data_files):
+            stat = os.stat(file)
+            sha.update('{}{}{}'.format(
+                os.path.basename(file), stat.st_size, stat.st_mtime
+            ).encode())
+        return sha.hexdigest()
+
+    # original scene, name and size are unique enough
+    if os.path.isdir(product):
+        size = _dir_size(product)
+    else:
+        size = os.path.getsize(product)
+    return hashlib.sha1(
+        '{}{}'.format(os.path.basename(product.rstrip('/')), size).encode()
+    ).hexdigest()
+
+
+def update_fingerprint(dimap_prefix, step):
+    '''Changes the fingerprint of a product modified in place
+
+    Needs to be called whenever a product is manipulated outside of a
+    cached step (e.g. by the GRD border noise removal), so that the
+    following steps do not pick up results of the unmodified product.
+    '''
+    if not ProductCache().enabled:
+        return None
+
+    prefix = _dimap_prefix(dimap_prefix)
+    fingerprint = product_fingerprint(prefix)
+    key = hashlib.sha1('{}{}'.format(fingerprint, step).encode()).hexdigest()
+    with open(os.path.join('{}.data'.format(prefix), KEY_FILE), 'w') as file:
+        file.write(key)
+    return key
+
+
+class ProductCache():
+    '''Size-bounded LRU store of BEAM-DIMAP products'''
+
+    def __init__(self, cache_dir=None, max_disk_usage=None):
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.max_disk_usage = (
+            CACHE_MAX_DISK_USAGE if max_disk_usage is None else max_disk_usage
+        )
+
+    @property
+    def enabled(self):
+        return self.max_disk_usage > 0
+
+    @staticmethod
+    def key(step, infile, params=None):
+        '''Creates the cache key of a processing step'''
+        params = json.dumps(params or {}, sort_keys=True, default=str)
+        return hashlib.sha1('{}{}{}'.format(
+            step, product_fingerprint(infile), params
+        ).encode()).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def fetch(self, key, outfile):
+        '''Copies a cached product to outfile
+
+        Returns:
+            True if the product was in the cache, False otherwise
+        '''
+        entry = self._entry(key)
+        if not os.path.isfile(os.path.join(entry, '{}.dim'.format(ENTRY_NAME))):
+            return False
+
+        out_prefix = _dimap_prefix(outfile)
+        out_name = os.path.basename(out_prefix)
+        try:
+            if os.path.exists('{}.data'.format(out_prefix)):
+                shutil.rmtree('{}.data'.format(out_prefix))
+            shutil.copytree(
+                os.path.join(entry, '{}.data'.format(ENTRY_NAME)),
+                '{}.data'.format(out_prefix)
+            )
+            shutil.copy(
+                os.path.join(entry, '{}.dim'.format(ENTRY_NAME)),
+                '{}.dim'.format(out_prefix)
+            )
+        except (OSError, shutil.Error) as e:
+            # e.g. evicted by another process in the meantime
+            logger.debug('Could not restore %s from cache: %s', key, e)
+            return False
+
+        _rename_dimap('{}.dim'.format(out_prefix), ENTRY_NAME, out_name)
+        # mark as recently used
+        os.utime(entry)
+        logger.debug('Restored %s from cache entry %s', out_name, key)
+        return True
+
+    def store(self, key, outfile):
+        '''Adds the product at outfile to the cache'''
+        out_prefix = _dimap_prefix(outfile)
+        out_name = os.path.basename(out_prefix)
+
+        # the key travels with the product, so it can be used further on
+        with open(
+                os.path.join('{}.data'.format(out_prefix), KEY_FILE), 'w'
+        ) as file:
+            file.write(key)
+
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+
+        # write to a temporary entry first, so that concurrent
+        # processes never see incomplete products
+        temp_entry = os.path.join(self.cache_dir, '.{}'.format(uuid4().hex))
+        try:
+            os.makedirs(temp_entry)
+            shutil.copytree(
+                '{}.data'.format(out_prefix),
+                os.path.join(temp_entry, '{}.data'.format(ENTRY_NAME))
+            )
+            shutil.copy(
+                '{}.dim'.format(out_prefix),
+                os.path.join(temp_entry, '{}.dim'.format(ENTRY_NAME))
+            )
+            _rename_dimap(
+                os.path.join(temp_entry, '{}.dim'.format(ENTRY_NAME)),
+                out_name, ENTRY_NAME
+            )
+            os.rename(temp_entry, entry)
+        except OSError as e:
+            logger.debug('Could not cache %s: %s', out_name, e)
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            return
+
+        logger.debug('Cached %s as entry %s', out_name, key)
+        self.evict()
+
+    def evict(self):
+        '''Removes least recently used entries beyond the size limit'''
+        entries = []
+        for entry in glob.glob(os.path.join(self.cache_dir, '*')):
+            try:
+                entries.append(
+                    (os.path.getmtime(entry), _dir_size(entry), entry)
+                )
+            except OSError:
+                continue
+
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_disk_usage * 1048576
+        for _, size, entry in sorted(entries):
+            if total_size <= max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+            logger.debug('Evicted cache entry %s', os.path.basename(entry))
+
+
+def cached_step(step):
+    '''Decorator to cache the output of a GPT processing step
+
+    The decorated function needs to take the input product, the output
+    prefix and the logfile as its first three arguments and to return
+    0 on success. All further arguments are considered processing
+    parameters and become part of the cache key.
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = ProductCache()
+            if not cache.enabled:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.values())
+            infile, outfile = arguments[0], arguments[1]
+
+            try:
+                key = cache.key(step, infile, arguments[3:])
+            except OSError as e:
+                logger.debug('No cache key for %s: %s', infile, e)
+                return func(*args, **kwargs)
+
+            if cache.fetch(key, outfile):
+                return 0
+
+            return_code = func(*args, **kwargs)
+            if return_code == 0:
+                cache.store(key, outfile)
+            return return_code
+
+        return wrapper
+    return decorator
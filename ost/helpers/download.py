@@ -0,0 +1,468 @@
+'''
+Resumable downloads of Sentinel-1 products over pooled HTTP sessions.
+
+A product is downloaded into a .part file next to its final location.
+Transient errors (lost connections, timeouts, server errors) do not
+discard the bytes already written, instead the download continues from
+the end of the .part file with a Range request. Only once the product is
+complete, the .part file is renamed to its final name, so that a file
+of that name is always a complete download.
+
+Large products are split into DOWNLOAD_SEGMENTS byte ranges, which are
+fetched concurrently into the preallocated .part file, as the throughput
+of a single connection is limited. The progress of the segments is kept
+next to the .part file, so that an interrupted segmented download
+continues as well.
+
+The HTTP sessions (and thereby their connection pools and cookies, e.g.
+of the Earthdata login) are shared by all downloads from the same
+provider with the same credentials. The concurrent connections to a
+host are limited over all downloads of the process (see
+DOWNLOAD_HOST_CONNECTIONS), e.g. to the 10 connections ASF allows.
+'''
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+from godale import Executor
+from requests.adapters import HTTPAdapter
+from tqdm.auto import tqdm
+
+from ost.errors import OSTAuthenticationError
+from ost.helpers import utils as h
+from ost.settings import DOWNLOAD_SEGMENTS, DOWNLOAD_HOST_CONNECTIONS, \
+    DOWNLOAD_MAX_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+# bytes read from the stream at once
+CHUNK_SIZE = 1048576
+
+# connections kept open per host within a session
+POOL_SIZE = 10
+
+# attempts to continue an interrupted download, and to download a
+# product again that did not pass the zip test
+RETRIES = 10
+ZIP_RETRIES = 3
+
+# seconds to wait for the server to connect and to send data
+TIMEOUT = (30, 120)
+
+# minimum size of the segments of a segmented download, and the bytes
+# after which the progress of a segment is saved
+SEGMENT_MIN_SIZE = 33554432
+CHECKPOINT_SIZE = 8388608
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_HOST_SLOTS = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+
+def part_file(filename):
+    return '{}.part'.format(filename)
+
+
+def segments_file(filename):
+    return '{}.part.segments'.format(filename)
+
+
+def host_slots(url):
+    '''Semaphore limiting the concurrent connections to the host of a url
+
+    The limit is taken from DOWNLOAD_HOST_CONNECTIONS, and is
+    DOWNLOAD_MAX_CONNECTIONS for hosts not listed there.
+    '''
+    host = urlparse(url).hostname
+    with _HOST_SLOTS_LOCK:
+        if host not in _HOST_SLOTS:
+            limit = int(DOWNLOAD_HOST_CONNECTIONS.get(
+                host, DOWNLOAD_MAX_CONNECTIONS
+            ))
+            _HOST_SLOTS[host] = threading.BoundedSemaphore(max(limit, 1))
+        return _HOST_SLOTS[host]
+
+
+def pooled_session(key, factory=requests.Session, auth=None,
+                   pool_size=POOL_SIZE):
+    '''HTTP session shared by all downloads with the same key
+
+    Args:
+        key: key of the session, e.g. the provider and the user name
+        factory: callable creating the session if there is none yet
+        auth: credentials of the session, e.g. (user name, password)
+        pool_size: number of connections kept open per host
+
+    Returns:
+        requests.Session
+    '''
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            session = factory()
+            if auth:
+                session.auth = auth
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SESSIONS[key] = session
+        return _SESSIONS[key]
+
+
+def _transient(error):
+    # server errors and broken connections are worth another attempt
+    if isinstance(error, requests.HTTPError):
+        return error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def _range_total(response):
+    '''Size of the complete file from the Content-Range header, if any
+
+    Partial content has the range of its bytes in the header, responses
+    to unsatisfiable ranges (416) an asterisk instead.
+    '''
+    match = re.match(r'bytes (?:\d+-\d+|\*)/(\d+)',
+                     response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+
+def _total_length(response, offset):
+    '''Size of the complete file from the headers of a response'''
+    total = _range_total(response)
+    if total is not None:
+        return total
+    length = response.headers.get('Content-Length')
+    return offset + int(length) if length is not None else None
+
+
+class _SegmentedDownload():
+    '''Concurrent download of the byte ranges of a file into a .part file
+
+    The segments are lists of the next byte to fetch and the end of the
+    range (exclusive), and are saved as JSON in the segments file.
+    '''
+
+    def __init__(self, url, filename, session, segments, retries,
+                 chunk_size, progress):
+        self.url = url
+        self.filename = filename
+        self.part = part_file(filename)
+        self.session = session
+        self.segments = segments
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.total = None
+        self._ranges = None
+        self._pbar = None
+        self._lock = threading.Lock()
+
+    def _probe(self):
+        '''Size of the file, None if the server does not support ranges'''
+        attempt = 0
+        while True:
+            try:
+                with host_slots(self.url), self.session.get(
+                        self.url, headers={'Range': 'bytes=0-0'},
+                        stream=True, timeout=TIMEOUT
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        return None
+                    return _total_length(response, 0)
+            except Exception as e:
+                if not _transient(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.debug('Range request to %s failed (%s), retrying '
+                             '(attempt %s of %s).', self.url, e, attempt,
+                             self.retries)
+                time.sleep(min(2 ** attempt, 60))
+
+    def _load(self):
+        try:
+            with open(segments_file(self.filename), 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if state.get('total') != self.total or \
+                not os.path.isfile(self.part):
+            return None
+        return state['segments']
+
+    def _save(self):
+        temp_file = '{}.tmp'.format(segments_file(self.filename))
+        with open(temp_file, 'w') as file:
+            json.dump({'total': self.total, 'segments': self._ranges}, file)
+        os.replace(temp_file, segments_file(self.filename))
+
+    def _plan(self, offset):
+        '''Splits the bytes from offset to the end into segments'''
+        size = self.total - offset
+        count = max(1, min(self.segments, -(-size // SEGMENT_MIN_SIZE)))
+        bounds = [offset + size * i // count for i in range(count + 1)]
+        return [[start, end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _preallocate(self):
+        with open(self.part, 'r+b' if os.path.isfile(self.part) else 'wb') \
+                as file:
+            file.truncate(self.total)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(file.fileno(), 0, self.total)
+                except OSError:
+                    # e.g. not supported by the file system
+                    pass
+
+    def _checkpoint(self, segment, position):
+        with self._lock:
+            segment[0] = position
+            self._save()
+
+    def _fetch(self, segment):
+        attempt = 0
+        while segment[0] < segment[1]:
+            position = segment[0]
+            try:
+                with host_slots(self.url), self.session.get(
+                        self.url, stream=True, timeout=TIMEOUT,
+                        headers={'Range': 'bytes={}-{}'.format(
+                            position, segment[1] - 1
+                        )}
+                ) as response, open(self.part, 'r+b') as file:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise requests.ConnectionError(
+                            'No partial content for {}.'.format(self.url)
+                        )
+                    file.seek(position)
+                    try:
+                        for chunk in response.iter_content(self.chunk_size):
+                            chunk = chunk[:segment[1] - position]
+                            file.write(chunk)
+                            position += len(chunk)
+                            self._pbar.update(len(chunk))
+                            if position >= segment[1]:
+                                break
+                            if position - segment[0] >= CHECKPOINT_SIZE:
+                                file.flush()
+                                self._checkpoint(segment, position)
+                    finally:
+                        file.flush()
+                        self._checkpoint(segment, position)
+
+                if segment[0] < segment[1]:
+                    raise requests.ConnectionError(
+                        'Connection closed {} bytes before the end of the '
+                        'segment.'.format(segment[1] - segment[0])
+                    )
+            except Exception as e:
+                if not _transient(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.debug('Segment %s of %s interrupted (%s), continuing '
+                             '(attempt %s of %s).', segment, self.url, e,
+                             attempt, self.retries)
+                time.sleep(min(2 ** attempt, 60))
+
+    def run(self):
+        '''Downloads the segments
+
+        Returns:
+            True if the .part file is complete, False if the server does
+            not support ranges or the file is too small for segments
+        '''
+        self.total = self._probe()
+        resumed = os.path.isfile(segments_file(self.filename))
+        if self.total is None:
+            if resumed:
+                os.remove(segments_file(self.filename))
+                os.remove(self.part)
+            return False
+
+        self._ranges = self._load()
+        if self._ranges is None:
+            # a .part file without segments is the start of the file
+            offset = 0
+            if os.path.isfile(self.part) and not resumed:
+                offset = os.path.getsize(self.part)
+            if offset >= self.total:
+                if offset == self.total:
+                    return True
+                offset = 0
+                os.remove(self.part)
+
+            self._ranges = self._plan(offset)
+            if len(self._ranges) == 1:
+                return False
+            self._preallocate()
+            self._save()
+
+        remaining = [segment for segment in self._ranges
+                     if segment[0] < segment[1]]
+        logger.debug('Downloading %s in %s segments.', self.filename,
+                     len(remaining))
+        done = self.total - sum(end - start for start, end in remaining)
+        with tqdm(total=self.total, initial=done, unit='B', unit_scale=True,
+                  disable=not self.progress,
+                  desc=os.path.basename(self.filename)) as self._pbar:
+            executor = Executor(executor='concurrent_threads',
+                                max_workers=len(remaining))
+            for task in executor.as_completed(
+                    func=self._fetch,
+                    iterable=remaining,
+                    fargs=()
+            ):
+                task.result()
+
+        os.remove(segments_file(self.filename))
+        return True
+
+
+def download(url, filename, session=None, retries=RETRIES,
+             chunk_size=CHUNK_SIZE, progress=True, segments=None):
+    '''Downloads a file, continuing the download of an earlier attempt
+
+    Args:
+        url: url of the file
+        filename: path of the downloaded file
+        session: requests.Session of the provider (default: a shared
+                 session without authentication)
+        retries: attempts to continue after transient errors
+        chunk_size: bytes read from the stream at once
+        progress: show a progress bar
+        segments: number of byte ranges fetched concurrently (default:
+                  DOWNLOAD_SEGMENTS), for servers supporting ranges and
+                  files of at least two segments of SEGMENT_MIN_SIZE
+
+    Returns:
+        filename
+
+    Raises:
+        requests.HTTPError for errors of the request (e.g. 404), except
+        for server errors, which are retried
+    '''
+    session = session or pooled_session('default')
+    segments = DOWNLOAD_SEGMENTS if segments is None else segments
+    part = part_file(filename)
+    if os.path.isfile(filename) and not os.path.isfile(part):
+        # files of that name are complete
+        logger.debug('INFO: {} already downloaded.'.format(filename))
+        return filename
+
+    # an interrupted segmented download is continued as such
+    if segments > 1 or os.path.isfile(segments_file(filename)):
+        if _SegmentedDownload(url, filename, session, segments, retries,
+                              chunk_size, progress).run():
+            os.replace(part, filename)
+            logger.debug('Downloaded %s.', filename)
+            return filename
+
+    attempt = 0
+    while True:
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        try:
+            with host_slots(url), session.get(
+                    url, headers=headers, stream=True, timeout=TIMEOUT
+            ) as response:
+                if response.status_code == 416:
+                    # nothing left to download, or a file of another size
+                    total = _range_total(response)
+                    if total is not None and total == offset:
+                        break
+                    os.remove(part)
+                    continue
+
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # the server ignores ranges, so start from scratch
+                    logger.debug('No range support for %s, restarting.',
+                                 url)
+                    offset = 0
+                total = _total_length(response, offset)
+
+                with open(part, 'ab' if offset else 'wb') as file, tqdm(
+                        total=total, initial=offset, unit='B',
+                        unit_scale=True, disable=not progress,
+                        desc=os.path.basename(filename)
+                ) as pbar:
+                    for chunk in response.iter_content(chunk_size):
+                        file.write(chunk)
+                        pbar.update(len(chunk))
+
+            size = os.path.getsize(part)
+            if total is None or size >= total:
+                break
+            raise requests.ConnectionError(
+                'Connection closed after {} of {} bytes.'.format(size, total)
+            )
+        except Exception as e:
+            if not _transient(e) or attempt >= retries:
+                raise
+            error = e
+
+        attempt += 1
+        logger.debug('Download of %s interrupted (%s), continuing '
+                     '(attempt %s of %s).', url, error, attempt, retries)
+        time.sleep(min(2 ** attempt, 60))
+
+    os.replace(part, filename)
+    logger.debug('Downloaded %s.', filename)
+    return filename
+
+
+def download_product(url, filename, session=None):
+    '''Downloads a zipped Sentinel-1 product and checks its integrity
+
+    A product that does not pass the zip test is downloaded again. A
+    successful download is marked by a .downloaded file next to it.
+
+    Args:
+        url: url of the product
+        filename: path of the downloaded zip file
+        session: requests.Session of the provider
+
+    Returns:
+        path of the .downloaded file, or the file name of the product
+        if it is missing from the archive or corrupt
+    '''
+    for attempt in range(ZIP_RETRIES):
+        logger.debug('INFO: Downloading scene to: {}'.format(filename))
+        try:
+            download(url, filename, session)
+        except requests.HTTPError as e:
+            if e.response.status_code == 401:
+                raise OSTAuthenticationError(
+                    ' ERROR: Username/Password are incorrect.'
+                )
+            if e.response.status_code == 404:
+                logger.debug(
+                    'Product %s missing from the archive, continuing.',
+                    os.path.basename(filename)
+                )
+                return os.path.basename(filename)
+            raise
+
+        logger.debug('INFO: Checking the zip archive of {} for inconsistency'
+                     .format(filename))
+        if h.check_zipfile(filename) is None:
+            logger.debug('INFO: {} passed the zip test.'.format(filename))
+            with open('{}.downloaded'.format(filename), 'w') as file:
+                file.write('successfully downloaded \n')
+            return '{}.downloaded'.format(filename)
+
+        logger.debug('INFO: {} did not pass the zip test. '
+                     'Re-downloading the full scene.'.format(filename))
+        os.remove(filename)
+
+    return os.path.basename(filename)
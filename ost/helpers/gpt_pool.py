@@ -0,0 +1,261 @@
+'''
+Pool of long-lived worker processes for SNAP processing jobs.
+
+Starting gpt means starting a JVM, which takes several seconds for every
+single processing step. For batches of thousands of small jobs (e.g.
+bursts), this start-up time dominates the processing time.
+
+The workers of a GPTPool stay alive for the whole batch and take the jobs
+(e.g. the processing of a single burst) from the pool's queue. Within a
+worker, all gpt calls going through ost.helpers.utils.run_command are
+executed by a JVM embedded via SNAP's Python bridge (esa_snappy), which
+is started with the first job and re-used for all further jobs. Without
+the Python bridge, the workers fall back to gpt subprocesses.
+
+Each worker gets its share of the CPU cores (as gpt's -q / SNAP's
+parallelism) and of the memory budget (as maximum Java heap), so that
+the workers of the pool do not compete for resources.
+'''
+
+import os
+import re
+import shlex
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ost.helpers.graph import Graph
+from ost.helpers.scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# resources of the current process, if it is a pool worker
+_WORKER = {}
+
+# SNAP's Java classes of the worker's embedded JVM
+_JVM = {}
+
+# gpt options that take a value
+_VALUE_OPTIONS = ['-q', '-c', '-t', '-f', '-p']
+
+
+def worker_resources(max_workers, ram_budget=None):
+    '''Number of threads and memory in MB of each worker of a pool
+
+    Args:
+        max_workers (int): number of workers of the pool
+        ram_budget (int): memory in MB for all workers
+                          (default: the memory of the scheduler)
+
+    Returns:
+        tuple of threads and memory per worker
+    '''
+    scheduler = get_scheduler()
+    ram_budget = ram_budget or scheduler.memory
+    threads = max(1, scheduler.cores // max_workers)
+    memory = max(1024, ram_budget // max_workers)
+    return threads, memory
+
+
+def _init_worker(threads, memory):
+    _WORKER.update(threads=threads, memory=memory)
+
+    # picked up by every JVM started from this process, i.e. by the
+    # embedded one as well as by gpt subprocesses
+    os.environ['_JAVA_OPTIONS'] = (
+        '-Xmx{}M -Dsnap.parallelism={} -Dsnap.jai.tileCacheSize={}'.format(
+            memory, threads, int(memory * 0.7)
+        )
+    )
+
+
+def in_worker():
+    '''True if the current process is a worker of a GPTPool'''
+    return bool(_WORKER)
+
+
+def is_gpt_command(command):
+    try:
+        executable = shlex.split(command)[0]
+    except (ValueError, IndexError):
+        return False
+    return os.path.basename(executable).lower() in ['gpt', 'gpt.exe']
+
+
+def worker_command(command):
+    '''Adapts a gpt command to the resources of the current worker'''
+    if not in_worker():
+        return command
+
+    return re.sub(
+        r'(\s-q\s+)\d+', r'\g<1>{}'.format(_WORKER['threads']), command
+    )
+
+
+def _jvm():
+    if not _JVM:
+        try:
+            from esa_snappy import jpy
+            _JVM.update(
+                GraphIO=jpy.get_type('org.esa.snap.core.gpf.graph.GraphIO'),
+                GraphProcessor=jpy.get_type(
+                    'org.esa.snap.core.gpf.graph.GraphProcessor'
+                ),
+                ProgressMonitor=jpy.get_type('com.bc.ceres.core.ProgressMonitor'),
+                FileReader=jpy.get_type('java.io.FileReader'),
+                HashMap=jpy.get_type('java.util.HashMap'),
+                JAI=jpy.get_type('javax.media.jai.JAI')
+            )
+            logger.debug('Started embedded JVM of GPT pool worker %s',
+                         os.getpid())
+        except (ImportError, RuntimeError) as e:
+            logger.debug('No embedded JVM (%s), using gpt subprocesses.', e)
+            _JVM['GraphIO'] = None
+
+    return _JVM if _JVM['GraphIO'] is not None else None
+
+
+def _parse_gpt_args(args):
+    '''Splits the arguments of a gpt call
+
+    Returns:
+        graph file or operator name, parameters (-P), target (-t)
+        and source products (-S and positional arguments)
+    '''
+    graph, parameters, target, sources = args[1], {}, None, []
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg in _VALUE_OPTIONS:
+            if arg == '-t':
+                target = args[i + 1]
+            i += 2
+            continue
+        if arg.startswith('-P'):
+            key, _, value = arg[2:].partition('=')
+            parameters[key] = value
+        elif arg.startswith('-S'):
+            sources.append(arg[2:].partition('=')[2])
+        elif not arg.startswith('-'):
+            sources.append(arg)
+        i += 1
+
+    return graph, parameters, target, sources
+
+
+def _operator_graph(operator, parameters, target, sources):
+    '''Graph of a single operator call of gpt'''
+    graph = Graph()
+    reads = [graph.add_read(source) for source in sources]
+    node = graph.add_node(operator, sources=reads, parameters=parameters)
+
+    target = target or 'target.dim'
+    if not target.endswith('.dim'):
+        target = '{}.dim'.format(target)
+    graph.add_write(node, target)
+    return graph
+
+
+def run_gpt(command, logfile):
+    '''Runs a gpt command within the embedded JVM of a pool worker
+
+    Returns:
+        the return code, or None if there is no embedded JVM
+    '''
+    jvm = _jvm()
+    if jvm is None:
+        return None
+
+    graph_file, parameters, target, sources = _parse_gpt_args(
+        shlex.split(command)
+    )
+
+    temp_graph = None
+    if not graph_file.endswith('.xml'):
+        # single operator calls are executed as graph as well
+        temp_graph = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+        temp_graph.close()
+        _operator_graph(graph_file, parameters, target, sources).write(
+            temp_graph.name
+        )
+        graph_file, parameters = temp_graph.name, {}
+
+    variables = jvm['HashMap']()
+    for key, value in parameters.items():
+        variables.put(key, value)
+
+    try:
+        graph = jvm['GraphIO'].read(jvm['FileReader'](graph_file), variables)
+        jvm['GraphProcessor']().executeGraph(graph, jvm['ProgressMonitor'].NULL)
+        return_code = 0
+    except RuntimeError as e:
+        with open(str(logfile), 'w') as file:
+            file.write('{}\n'.format(e))
+        return_code = 1
+    finally:
+        # release the tiles of this job
+        jvm['JAI'].getDefaultInstance().getTileCache().flush()
+        if temp_graph:
+            os.remove(temp_graph.name)
+
+    return return_code
+
+
+class GPTPool():
+    '''A pool of long-lived worker processes for SNAP processing jobs
+
+    Usage:
+        with GPTPool(max_workers=4) as pool:
+            for task in pool.as_completed(func, iterable, fargs):
+                task.result()
+    '''
+
+    def __init__(self, max_workers=None, ram_budget=None):
+        max_workers = max_workers or get_scheduler().max_jobs('default')
+        self.max_workers = max_workers
+        self.threads, self.memory = worker_resources(max_workers, ram_budget)
+        self.executor = None
+
+    def __enter__(self):
+        logger.debug(
+            'Starting GPT pool of %s workers with %s threads and %s MB each',
+            self.max_workers, self.threads, self.memory
+        )
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.threads, self.memory)
+        )
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown(wait=True)
+        self.executor = None
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def as_completed(
+            self, func, iterable, fargs=None, job_type=None, retries=0
+    ):
+        '''Submits func(item, *fargs) for all items of the iterable
+
+        With a job_type, the jobs are admitted by the resource scheduler,
+        i.e. only as long as their resources are free, and failed jobs
+        are resubmitted up to retries times.
+
+        Yields:
+            the futures of the jobs as they complete
+        '''
+        if job_type is not None:
+            yield from get_scheduler().as_completed(
+                self.submit, func, iterable, fargs, job_type, retries
+            )
+            return
+
+        futures = [
+            self.executor.submit(func, item, *(fargs or ()))
+            for item in iterable
+        ]
+        for future in as_completed(futures):
+            yield future
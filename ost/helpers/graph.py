@@ -0,0 +1,159 @@
+'''
+Composition of SNAP processing graphs.
+
+Instead of executing every processing step as a separate gpt call, with
+a BEAM-DIMAP product written and read again between two calls, the steps
+can be chained into one graph that gpt executes at once, keeping the
+intermediate products in memory.
+
+The Graph class builds such graphs from single operators as well as from
+the existing graph files of OST. The nodes of a graph file are copied
+with their parameters filled in, while its Read and Write nodes are
+replaced by the node the template is chained to.
+'''
+
+import logging
+from string import Template
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+PARAMETERS_CLASS = 'com.bc.ceres.binding.dom.XppDomElement'
+
+
+def _source_tags(sources):
+    # SNAP numbers additional source products by suffix
+    return [
+        'sourceProduct' if i == 0 else 'sourceProduct.{}'.format(i)
+        for i in range(len(sources))
+    ]
+
+
+class Graph():
+    '''A SNAP graph to be executed by gpt'''
+
+    def __init__(self):
+        self.root = ET.Element('graph', id='Graph')
+        ET.SubElement(self.root, 'version').text = '1.0'
+        self.node_ids = []
+
+    def _unique_id(self, node_id):
+        # same naming as SNAP's graph builder for repeated operators
+        unique_id, i = node_id, 2
+        while unique_id in self.node_ids:
+            unique_id = '{}({})'.format(node_id, i)
+            i += 1
+        self.node_ids.append(unique_id)
+        return unique_id
+
+    def add_node(self, operator, sources=None, parameters=None, node_id=None):
+        '''Adds a single operator to the graph
+
+        Args:
+            operator (str): name of the SNAP operator (e.g. Speckle-Filter)
+            sources: node id or list of node ids of the source products
+            parameters (dict): parameters of the operator, booleans
+                               are converted to true/false and None
+                               creates an empty parameter
+            node_id (str): id of the node (default: operator name)
+
+        Returns:
+            the id of the new node
+        '''
+        if isinstance(sources, str):
+            sources = [sources]
+        sources = sources or []
+
+        node_id = self._unique_id(node_id or operator)
+        node = ET.SubElement(self.root, 'node', id=node_id)
+        ET.SubElement(node, 'operator').text = operator
+
+        sources_element = ET.SubElement(node, 'sources')
+        for tag, source in zip(_source_tags(sources), sources):
+            ET.SubElement(sources_element, tag, refid=source)
+
+        parameters_element = ET.SubElement(
+            node, 'parameters', {'class': PARAMETERS_CLASS}
+        )
+        for key, value in (parameters or {}).items():
+            element = ET.SubElement(parameters_element, key)
+            if isinstance(value, bool):
+                element.text = str(value).lower()
+            elif value is not None:
+                element.text = str(value)
+
+        return node_id
+
+    def add_read(self, infile, node_id='Read'):
+        '''Adds a Read node for infile and returns its id'''
+        return self.add_node(
+            'Read', parameters={'file': infile}, node_id=node_id
+        )
+
+    def add_write(self, source, outfile, format_name='BEAM-DIMAP'):
+        '''Adds a Write node of the source node to outfile'''
+        return self.add_node(
+            'Write', sources=source,
+            parameters={'file': outfile, 'formatName': format_name}
+        )
+
+    def add_template(self, graph_file, source, parameters=None):
+        '''Chains the nodes of an OST graph file to the source node
+
+        The ${...} placeholders of the graph file are replaced by the
+        given parameters, its Read node by the source node and its Write
+        node is dropped.
+
+        Args:
+            graph_file: path to the graph file
+            source (str): id of the node the template's Read node
+                          is replaced with
+            parameters (dict): values of the ${...} placeholders
+
+        Returns:
+            the id of the node that was written by the template
+        '''
+        with open(str(graph_file), 'r') as file:
+            content = Template(file.read()).safe_substitute({
+                key: escape(str(value))
+                for key, value in (parameters or {}).items()
+            })
+
+        nodes = ET.fromstring(content).findall('node')
+        operators = {
+            node.get('id'): node.findtext('operator') for node in nodes
+        }
+        reads = [key for key, op in operators.items() if op == 'Read']
+        writes = [key for key, op in operators.items() if op == 'Write']
+        if len(reads) != 1 or len(writes) != 1:
+            raise ValueError(
+                'Graph template {} needs exactly one Read and one Write '
+                'node.'.format(graph_file)
+            )
+
+        # new ids first, since nodes can refer to nodes defined later on
+        id_map = {reads[0]: source}
+        for node_id, operator in operators.items():
+            if operator not in ['Read', 'Write']:
+                id_map[node_id] = self._unique_id(node_id)
+
+        for node in nodes:
+            if node.findtext('operator') in ['Read', 'Write']:
+                continue
+            node.set('id', id_map[node.get('id')])
+            for source_element in list(node.find('sources')):
+                source_element.set('refid', id_map[source_element.get('refid')])
+            self.root.append(node)
+
+        write_node = [node for node in nodes if node.get('id') == writes[0]][0]
+        return id_map[list(write_node.find('sources'))[0].get('refid')]
+
+    def to_string(self):
+        return ET.tostring(self.root, encoding='unicode')
+
+    def write(self, graph_file):
+        '''Writes the graph as xml file to be passed to gpt'''
+        logger.debug('Writing SNAP graph with nodes %s', self.node_ids)
+        ET.ElementTree(self.root).write(str(graph_file))
+        return graph_file
@@ -0,0 +1,222 @@
+'''
+Persistent store of scene metadata parsed from Sentinel-1 products.
+
+Reading the burst geometries of a scene means opening the (multi-GB) zip
+archive or downloading the annotation files and parsing all of them,
+just for a few kilobytes of information. The same holds for the
+footprint of the manifest, that gives the center latitude of a scene.
+Once parsed, the bursts (geometry, swath and AnxTime) and the footprint
+of a scene are kept in a SQLite database, keyed by the scene identifier,
+so that burst inventories and the processing of the same scenes read
+them from there.
+
+The content of a product does not change for a given scene identifier,
+so entries never expire. The database can be shared by concurrent
+threads and processes. The store is switched on by setting
+METADATA_STORE (see ost.settings); with the default empty path the
+metadata is parsed from the products every time.
+'''
+
+import os
+import sqlite3
+import logging
+import functools
+from contextlib import closing
+
+import numpy as np
+import geopandas as gpd
+from shapely import wkb, wkt
+
+from ost.settings import METADATA_STORE
+
+logger = logging.getLogger(__name__)
+
+# columns of the GeoDataFrames of the scenes, and the columns and types
+# of the burst table, with the dtypes of Sentinel1Scene._burst_database
+BURST_FIELDS = [
+    ('SceneID', 'scene_id', 'TEXT', object),
+    ('Track', 'track', 'INTEGER', np.int64),
+    ('Date', 'date', 'TEXT', object),
+    ('SwathID', 'swath', 'TEXT', object),
+    ('AnxTime', 'anx_time', 'INTEGER', np.int32),
+    ('BurstNr', 'burst_nr', 'INTEGER', np.int64)
+]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS burst_scenes (
+    scene_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS bursts (
+    {},
+    geometry BLOB
+);
+CREATE INDEX IF NOT EXISTS bursts_scene_id ON bursts (scene_id);
+CREATE TABLE IF NOT EXISTS footprints (
+    scene_id TEXT PRIMARY KEY,
+    footprint TEXT,
+    center_lat REAL
+);
+'''.format(',\n    '.join(
+    '{} {}'.format(field, sql_type) for _, field, sql_type, _ in BURST_FIELDS
+))
+
+
+class MetadataStore():
+    '''SQLite store of the bursts and footprints of scenes
+
+    Args:
+        path: path of the database file (default: METADATA_STORE),
+              the store is disabled for an empty path
+    '''
+
+    def __init__(self, path=None):
+        self.path = METADATA_STORE if path is None else path
+        self._initialised = False
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        if not self._initialised:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+        # a connection per call, so that threads never share one
+        connection = sqlite3.connect(self.path, timeout=60)
+        if not self._initialised:
+            connection.executescript(SCHEMA)
+            self._initialised = True
+        return connection
+
+    def get_bursts(self, scene_id):
+        '''Burst database of a scene
+
+        Returns:
+            GeoDataFrame (EPSG:4326) of the bursts of the scene,
+            None if the scene is not in the store
+        '''
+        if not self.enabled:
+            return None
+
+        columns = ', '.join(field for _, field, _, _ in BURST_FIELDS)
+        try:
+            with closing(self._connect()) as connection:
+                if connection.execute(
+                        'SELECT 1 FROM burst_scenes WHERE scene_id = ?',
+                        (scene_id,)
+                ).fetchone() is None:
+                    return None
+                rows = connection.execute(
+                    'SELECT {}, geometry FROM bursts WHERE scene_id = ? '
+                    'ORDER BY rowid'.format(columns), (scene_id,)
+                ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            logger.debug('Could not read the bursts of %s: %s', scene_id, e)
+            return None
+
+        data = {
+            name: np.array([row[i] for row in rows], dtype=dtype)
+            for i, (name, _, _, dtype) in enumerate(BURST_FIELDS)
+        }
+        data['geometry'] = [wkb.loads(row[-1]) for row in rows]
+        logger.debug('Read %s bursts of %s from the metadata store.',
+                     len(rows), scene_id)
+        return gpd.GeoDataFrame(data, crs='epsg:4326')
+
+    def put_bursts(self, scene_id, gdf):
+        '''Adds (or replaces) the burst database of a scene'''
+        if not self.enabled:
+            return
+
+        rows = [
+            tuple(
+                None if value is None else
+                int(value) if sql_type == 'INTEGER' else str(value)
+                for value, (_, _, sql_type, _) in zip(
+                    [getattr(burst, name) for name, _, _, _ in BURST_FIELDS],
+                    BURST_FIELDS
+                )
+            ) + (wkb.dumps(burst.geometry),)
+            for burst in gdf.itertuples()
+        ]
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    'DELETE FROM bursts WHERE scene_id = ?', (scene_id,)
+                )
+                connection.executemany(
+                    'INSERT INTO bursts VALUES ({})'.format(
+                        ', '.join('?' * (len(BURST_FIELDS) + 1))
+                    ), rows
+                )
+                connection.execute(
+                    'INSERT OR REPLACE INTO burst_scenes VALUES (?)',
+                    (scene_id,)
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.debug('Could not store the bursts of %s: %s', scene_id, e)
+            return
+        logger.debug('Stored %s bursts of %s in the metadata store.',
+                     len(rows), scene_id)
+
+    def get_footprint(self, scene_id):
+        '''Footprint of a scene's manifest
+
+        Returns:
+            tuple of the footprint (shapely Polygon in lon/lat) and the
+            center latitude, None if the scene is not in the store
+        '''
+        if not self.enabled:
+            return None
+
+        try:
+            with closing(self._connect()) as connection:
+                row = connection.execute(
+                    'SELECT footprint, center_lat FROM footprints '
+                    'WHERE scene_id = ?', (scene_id,)
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.debug('Could not read the footprint of %s: %s',
+                         scene_id, e)
+            return None
+
+        if row is None:
+            return None
+        return wkt.loads(row[0]), row[1]
+
+    def put_footprint(self, scene_id, footprint, center_lat):
+        '''Adds (or replaces) the footprint of a scene'''
+        if not self.enabled:
+            return
+
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO footprints VALUES (?, ?, ?)',
+                    (scene_id, footprint.wkt, float(center_lat))
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.debug('Could not store the footprint of %s: %s',
+                         scene_id, e)
+
+
+def stored_bursts(func):
+    '''Decorator to keep the burst database of a scene in the store
+
+    The decorated method of a Sentinel1Scene parses the burst database
+    of the scene. It is only called if the scene is not yet in the
+    metadata store, and its result is stored unless empty.
+    '''
+    @functools.wraps(func)
+    def wrapper(scene, *args, **kwargs):
+        store = MetadataStore()
+        gdf = store.get_bursts(scene.scene_id)
+        if gdf is not None:
+            return gdf
+
+        gdf = func(scene, *args, **kwargs)
+        if gdf is not None and len(gdf):
+            store.put_bursts(scene.scene_id, gdf)
+        return gdf
+
+    return wrapper
@@ -0,0 +1,241 @@
+'''
+Binary morphology for (large) masks in pure numpy.
+
+Instead of evaluating the structuring element pixel by pixel, every
+operation is expressed as a logical reduction over shifted views of a
+padded array, i.e. one vectorized operation per element of the
+structuring element. Rectangular all-ones structuring elements are
+decomposed into a row and a column line, so that the costs grow with
+their height plus width instead of their area.
+
+binary_morphology_raster applies the operations block-wise on raster
+files, with an overlap between the blocks that makes the result
+identical to processing the full image at once. Opening and closing are
+applied step by step there, since the pixels outside of the image need
+to be reset to False after each single erosion or dilation.
+'''
+
+import logging
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from ost.helpers import raster as ras
+from ost.settings import PROCESSING_RAM_BUDGET
+
+logger = logging.getLogger(__name__)
+
+
+def _get_structure(structure):
+    if structure is None:
+        return np.ones((3, 3), dtype=bool)
+
+    structure = np.asarray(structure).astype(bool)
+    if structure.ndim != 2:
+        raise ValueError('Structuring element needs to be 2-dimensional.')
+    if not structure.any():
+        raise ValueError('Structuring element has no True elements.')
+    return structure
+
+
+def _reduce_shifted(array, structure, reduce_func, reflect=False):
+    '''Reduces the shifted copies of a 2D boolean array
+
+    The origin of the structuring element is its center (as in scipy),
+    the image is padded with False.
+    '''
+    rows, cols = array.shape
+    height, width = structure.shape
+    o_y, o_x = height // 2, width // 2
+
+    # dilation uses the reflected structuring element
+    if reflect:
+        structure = structure[::-1, ::-1]
+        o_y, o_x = height - 1 - o_y, width - 1 - o_x
+
+    padded = np.pad(
+        array,
+        ((o_y, height - 1 - o_y), (o_x, width - 1 - o_x)),
+        mode='constant', constant_values=False
+    )
+
+    out = None
+    for d_y, d_x in zip(*np.nonzero(structure)):
+        shifted = padded[d_y:d_y + rows, d_x:d_x + cols]
+        if out is None:
+            out = shifted.copy()
+        else:
+            reduce_func(out, shifted, out=out)
+    return out
+
+
+def _morph(array, structure, reduce_func, reflect):
+    # decompose a full rectangle into a row and a column line
+    if structure.all() and min(structure.shape) > 1:
+        height, width = structure.shape
+        array = _reduce_shifted(
+            array, np.ones((1, width), dtype=bool), reduce_func, reflect
+        )
+        return _reduce_shifted(
+            array, np.ones((height, 1), dtype=bool), reduce_func, reflect
+        )
+
+    return _reduce_shifted(array, structure, reduce_func, reflect)
+
+
+def _apply(array, structure, iterations, reduce_func, reflect):
+    array = np.asarray(array).astype(bool)
+    structure = _get_structure(structure)
+
+    # 3D arrays are treated as stack of 2D bands
+    if array.ndim == 3:
+        return np.stack([
+            _apply(band, structure, iterations, reduce_func, reflect)
+            for band in array
+        ])
+
+    for _ in range(iterations):
+        array = _morph(array, structure, reduce_func, reflect)
+    return array
+
+
+def binary_erosion(array, structure=None, iterations=1):
+    '''Binary erosion of a 2D (or 3D band stack) array
+
+    Args:
+        array: array to be eroded, non-zero elements are considered True
+        structure: 2D structuring element, non-zero elements are
+                   considered True (default: 3x3 square)
+        iterations: number of times the erosion is repeated
+
+    Returns:
+        boolean array of the same shape as the input
+    '''
+    return _apply(array, structure, iterations, np.logical_and, False)
+
+
+def binary_dilation(array, structure=None, iterations=1):
+    '''Binary dilation of a 2D (or 3D band stack) array
+
+    Args:
+        array: array to be dilated, non-zero elements are considered True
+        structure: 2D structuring element, non-zero elements are
+                   considered True (default: 3x3 square)
+        iterations: number of times the dilation is repeated
+
+    Returns:
+        boolean array of the same shape as the input
+    '''
+    return _apply(array, structure, iterations, np.logical_or, True)
+
+
+def binary_opening(array, structure=None, iterations=1):
+    '''Binary opening (erosion followed by dilation)'''
+    return binary_dilation(
+        binary_erosion(array, structure, iterations), structure, iterations
+    )
+
+
+def binary_closing(array, structure=None, iterations=1):
+    '''Binary closing (dilation followed by erosion)'''
+    return binary_erosion(
+        binary_dilation(array, structure, iterations), structure, iterations
+    )
+
+
+OPERATIONS = {
+    'erosion': binary_erosion,
+    'dilation': binary_dilation,
+    'opening': binary_opening,
+    'closing': binary_closing
+}
+
+# the single erosions and dilations of the operations, in their order
+STEPS = {
+    'erosion': [binary_erosion],
+    'dilation': [binary_dilation],
+    'opening': [binary_erosion, binary_dilation],
+    'closing': [binary_dilation, binary_erosion]
+}
+
+
+def binary_morphology_raster(
+        infile,
+        outfile,
+        operation='erosion',
+        structure=None,
+        iterations=1,
+        band=1,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Applies a binary morphological operation block-wise on a raster
+
+    The blocks are read with an overlap of the structuring element size
+    (times the number of iterations and steps of the operation), so
+    that the result is the same as for the full image in memory.
+
+    Args:
+        infile: input raster, non-zero values are considered True
+        outfile: output GeoTIFF of the resulting uint8 (0/1) mask
+        operation: one of erosion, dilation, opening or closing
+        structure: 2D structuring element (default: 3x3 square)
+        iterations: number of times the operation is repeated
+        band: band of the infile to use
+        ram_budget: memory budget in MB for a single block
+    '''
+    if operation not in OPERATIONS:
+        raise ValueError(
+            'Operation needs to be one of {}.'.format(list(OPERATIONS))
+        )
+    structure = _get_structure(structure)
+    steps = len(STEPS[operation]) * iterations
+    halo_y = (structure.shape[0] - 1) * steps
+    halo_x = (structure.shape[1] - 1) * steps
+
+    with rasterio.open(infile) as src:
+        meta = src.meta.copy()
+        meta.update(driver='GTiff', count=1, dtype='uint8', nodata=None)
+
+        with rasterio.open(outfile, 'w', **meta) as dst:
+            for window in ras.plan_windows(
+                    src, ram_budget=ram_budget, count=1, dtype='uint8'
+            ):
+                # the window including its overlap
+                row_start = max(window.row_off - halo_y, 0)
+                col_start = max(window.col_off - halo_x, 0)
+                row_stop = min(window.row_off + window.height + halo_y,
+                               src.height)
+                col_stop = min(window.col_off + window.width + halo_x,
+                               src.width)
+                array = src.read(band, window=Window(
+                    col_start, row_start,
+                    col_stop - col_start, row_stop - row_start
+                ))
+
+                # outside of the image, everything is False as for the
+                # full image, so we pad the missing overlap at the edges
+                pad = (
+                    (halo_y - (window.row_off - row_start),
+                     halo_y - (row_stop - window.row_off - window.height)),
+                    (halo_x - (window.col_off - col_start),
+                     halo_x - (col_stop - window.col_off - window.width))
+                )
+                outside = np.pad(
+                    np.zeros(array.shape, dtype=bool), pad,
+                    mode='constant', constant_values=True
+                )
+                array = np.pad(array != 0, pad, mode='constant')
+
+                # a dilation sets the padding to True, which the full
+                # image does not have, so it is reset after each step
+                for step in STEPS[operation]:
+                    for _ in range(iterations):
+                        array = step(array, structure)
+                        array[outside] = False
+
+                dst.write(
+                    array[halo_y:halo_y + window.height,
+                          halo_x:halo_x + window.width].astype('uint8'),
+                    window=window, indexes=1
+                )
@@ -4,11 +4,10 @@ import urllib
 import time
 import logging
 import requests
-import tqdm
 
 from godale import Executor
 
-from ost.helpers import utils as h
+from ost.helpers import scene_index, download
 from ost import Sentinel1Scene as S1Scene
 
 logger = logging.getLogger(__name__)
@@ -99,77 +98,8 @@ def s1_download(argument_list):
     uname = argument_list[2]
     pword = argument_list[3]
 
-    # get first response for file Size
-    response = requests.get(url, stream=True, auth=(uname, pword))
-
-    # get download size
-    total_length = int(response.headers.get('content-length', 0))
-
-    # define chunk_size
-    chunk_size = 1024
-
-    # check if file is partially downloaded
-    if os.path.exists(filename):
-
-        first_byte = os.path.getsize(filename)
-        if first_byte == total_length:
-            logger.debug('INFO: {} already downloaded.'.format(filename))
-        else:
-            logger.debug('INFO: Continue downloading scene to: {}'.format(
-                filename))
-
-    else:
-        logger.debug('INFO: Downloading scene to: {}'.format(filename))
-        first_byte = 0
-
-    if first_byte >= total_length:
-        return total_length
-
-    zip_test = 1
-    while zip_test is not None and zip_test <= 10:
-
-        while first_byte < total_length:
-            
-            # get byte offset for already downloaded file
-            header = {"Range": "bytes={}-{}".format(first_byte, total_length)}
-            response = requests.get(url, headers=header, stream=True,
-                                    auth=(uname, pword))
-    
-            # actual download
-            with open(filename, "ab") as file:
-    
-                if total_length is None:
-                    file.write(response.content)
-                else:
-                    pbar = tqdm.tqdm(total=total_length, initial=first_byte,
-                                     unit='B', unit_scale=True,
-                                     desc=' INFO: Downloading: ')
-                    for chunk in response.iter_content(chunk_size):
-                        if chunk:
-                            file.write(chunk)
-                            pbar.update(chunk_size)
-            pbar.close()
-            # updated fileSize
-            first_byte = os.path.getsize(filename)
-            
-        # zipFile check
-        logger.debug(
-            'INFO: Checking the zip archive of {} for inconsistency'.format(
-            filename)
-        )
-        zip_test = h.check_zipfile(filename)
-        # if it did not pass the test, remove the file
-        # in the while loop it will be downlaoded again
-        if zip_test is not None:
-            logger.debug('INFO: {} did not pass the zip test. \
-                  Re-downloading the full scene.'.format(filename))
-            os.remove(filename)
-            first_byte = 0
-        # otherwise we change the status to True
-        else:
-            logger.debug('INFO: {} passed the zip test.'.format(filename))
-            with open(str('{}.downloaded'.format(filename)), 'w') as file:
-                file.write('successfully downloaded \n')
+    session = download.pooled_session(('peps', uname), auth=(uname, pword))
+    return download.download_product(url, filename, session)
 
 
 def peps_batch_download(
@@ -193,7 +123,10 @@ def peps_batch_download(
             fargs=()
 
     ):
-        task.result()
+        downloaded_string = task.result()
+        if not downloaded_string.endswith('downloaded'):
+            missing_scenes.append(downloaded_string)
+    scene_index.invalidate()
 
     _check_downloaded_files(inventory_df,
                             download_dir
@@ -206,6 +139,13 @@ def _prepare_scenes_to_dl(inventory_df, download_dir, uname, pword):
         'INFO: Getting the storage status (online/onTape) of each scene.'
     )
     logger.debug('INFO: This may take a while.')
+    # downloaded scenes are neither checked nor ordered again
+    inventory_df = inventory_df[[
+        not S1Scene(product).get_path(download_dir, data_mount=None)
+        for product in inventory_df.identifier.tolist()
+    ]].copy()
+    if inventory_df.empty:
+        return []
     # this function does not just check,
     # but it already triggers the production of the S1 scene
     inventory_df['pepsStatus'], inventory_df['pepsUrl'] = (
@@ -248,13 +188,11 @@ def _prepare_scenes_to_dl(inventory_df, download_dir, uname, pword):
 
 def _check_downloaded_files(inventory_df, download_dir):
     # routine to check if the file has been downloaded
-    for index, row in (
-            inventory_df[inventory_df['pepsStatus'] == 'online'].iterrows()
-    ):
+    for index, row in inventory_df.iterrows():
         # get scene identifier
         scene_id = row.identifier
         # construct download path
         scene = S1Scene(scene_id)
         download_path = scene._download_path(download_dir)
-        if os.path.exists(download_path):
+        if os.path.exists('{}.downloaded'.format(download_path)):
             inventory_df.at[index, 'pepsStatus'] = 'downloaded'
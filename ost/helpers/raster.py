@@ -1,8 +1,12 @@
 import os
+import math
 from os.path import join as opj
 import numpy as np
 import glob
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 
 import gdal
@@ -11,10 +15,15 @@ import ogr
 import fiona
 import imageio
 import rasterio
-import rasterio.mask
-from rasterio.features import shapes
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.features import shapes, geometry_mask, geometry_window
+from rasterio.windows import Window
 
 from ost.helpers import utils as h
+from ost.settings import (
+    PROCESSING_RAM_BUDGET, OUTPUT_PROFILE, OUTPUT_PROFILES
+)
 
 logger = logging.getLogger(__name__)
 
@@ -158,6 +167,218 @@ def replace_value(
             raster.GetRasterBand(1).WriteArray(raster_array, x, y)
 
 
+def _align_to_block(size, block_size):
+    # round down to a multiple of the block size, if possible
+    if size >= block_size:
+        return size - size % block_size
+    return size
+
+
+def plan_windows(
+        src,
+        ram_budget=PROCESSING_RAM_BUDGET,
+        count=None,
+        dtype=None,
+        overhead=4
+):
+    """Split a raster into processing windows that fit into a RAM budget
+
+    Instead of inheriting the (often tiny) internal tiling of the input,
+    the window size is derived from the memory a block of all bands takes
+    up. Full-width strips are preferred, since they map to few and large
+    reads, and window edges are aligned to the internal blocks of the
+    input wherever possible.
+
+    :param src: opened rasterio dataset
+    :param ram_budget: memory budget for one window in MB
+    :param count: number of bands read per window (default: all)
+    :param dtype: datatype the bands are read as (default: of the 1st band)
+    :param overhead: factor for the temporary copies made while processing
+    :return: list of rasterio windows
+    """
+    count = count or src.count
+    itemsize = np.dtype(dtype or src.dtypes[0]).itemsize
+    # we calculate at least in float32
+    bytes_per_pixel = count * max(itemsize, 4) * overhead
+    pixels = max(int(ram_budget * 1048576 // bytes_per_pixel), 1)
+
+    block_rows, block_cols = src.block_shapes[0]
+    if pixels >= src.width:
+        # full-width strips
+        cols = src.width
+        rows = _align_to_block(pixels // src.width, block_rows)
+    else:
+        # square-ish tiles
+        cols = max(_align_to_block(int(math.sqrt(pixels)), block_cols), 1)
+        rows = max(_align_to_block(pixels // cols, block_rows), 1)
+    rows = min(rows, src.height)
+
+    return [
+        Window(col_off, row_off,
+               min(cols, src.width - col_off),
+               min(rows, src.height - row_off))
+        for row_off in range(0, src.height, rows)
+        for col_off in range(0, src.width, cols)
+    ]
+
+
+def open_raster(infile):
+    """Open a raster file or a datacube for reading
+
+    Datacubes (see ost.multitemporal.datacube) are opened as Datacube,
+    which reads like a rasterio dataset.
+
+    :param infile: raster file or Zarr store of a datacube
+    :return: opened dataset
+    """
+    if str(infile).rstrip('/').endswith('.zarr'):
+        # imported here, since the datacube builds upon this module
+        from ost.multitemporal.datacube import Datacube
+        return Datacube(infile)
+    return rasterio.open(infile)
+
+
+def process_blocks(
+        infile,
+        func,
+        windows=None,
+        fargs=None,
+        max_workers=1,
+        ram_budget=PROCESSING_RAM_BUDGET,
+        indexes=None
+):
+    """Apply a function on all blocks of a raster with a pool of threads
+
+    Every worker thread reads its windows through its own rasterio handle,
+    so reads and the numpy heavy lifting run concurrently. The results are
+    yielded in the order of the windows, which lets the caller write them
+    sequentially into its output files. Not more than two blocks per
+    worker are kept in memory at any time.
+
+    :param infile: input raster file (e.g. a vrt stack) or datacube
+    :param func: function taking the 3D block array (bands, rows, cols)
+                 as first argument
+    :param windows: list of rasterio windows, by default planned by
+                    plan_windows, so that all blocks in flight fit
+                    into ram_budget
+    :param fargs: additional positional arguments passed on to func
+    :param max_workers: number of worker threads
+    :param ram_budget: memory budget in MB for all blocks in flight
+    :param indexes: list of bands to read (default: all)
+    :return: generator of (window, result) tuples
+    """
+    fargs = fargs or []
+    max_workers = max_workers or os.cpu_count()
+    if windows is None:
+        with open_raster(infile) as src:
+            windows = plan_windows(
+                src, ram_budget=ram_budget / (2 * max_workers)
+            )
+
+    thread_data, handles = threading.local(), []
+    handles_lock = threading.Lock()
+
+    def _process_window(window):
+        # one handle per thread, since GDAL datasets are not thread-safe
+        if not hasattr(thread_data, 'src'):
+            thread_data.src = open_raster(infile)
+            with handles_lock:
+                handles.append(thread_data.src)
+        stack = thread_data.src.read(indexes, window=window)
+        return window, func(stack, *fargs)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for window in windows:
+                pending.append(executor.submit(_process_window, window))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        for src in handles:
+            src.close()
+
+
+def _output_profile(profile=None):
+    profile = profile or OUTPUT_PROFILE
+    if isinstance(profile, dict):
+        return profile
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(
+            'Output profile needs to be one of {}.'.format(
+                list(OUTPUT_PROFILES))
+        )
+    return OUTPUT_PROFILES[profile]
+
+
+def gtiff_profile(dtype='float32', width=None, height=None, profile=None):
+    """Creation options of a GeoTIFF according to the output profile
+
+    :param dtype: datatype of the GeoTIFF, used to choose the predictor
+    :param width: width of the GeoTIFF, to shrink the blocks of small ones
+    :param height: height of the GeoTIFF
+    :param profile: name of an output profile (see OUTPUT_PROFILES) or
+                    a profile dictionary (default: OUTPUT_PROFILE)
+    :return: dictionary of creation options
+    """
+    profile = _output_profile(profile)
+    options = {key: value for key, value in profile.items()
+               if key not in ['overviews', 'overview_resampling', 'cog']}
+
+    if options.get('predictor') == 'auto':
+        # floating point predictor for floats, horizontal one for integers
+        floating = np.issubdtype(np.dtype(dtype), np.floating)
+        options['predictor'] = 3 if floating else 2
+    if not options.get('compress'):
+        options.pop('predictor', None)
+
+    # blocks need to be multiples of 16, but not larger than the image
+    for size, key in [(width, 'blockxsize'), (height, 'blockysize')]:
+        while size and key in options and options[key] > max(size, 16):
+            options[key] //= 2
+        if key in options:
+            options[key] = max(16, options[key] - options[key] % 16)
+    return options
+
+
+def finalize_gtiff(outfile, profile=None, rewrite=False):
+    """Adds the overviews and the layout of the output profile to a GeoTIFF
+
+    :param outfile: GeoTIFF written with the options of gtiff_profile
+    :param profile: name of an output profile or a profile dictionary
+                    (default: OUTPUT_PROFILE)
+    :param rewrite: rewrite the file with the profile's creation options,
+                    e.g. if it has been written by another program
+    """
+    profile = _output_profile(profile)
+    overviews = profile.get('overviews')
+    if overviews:
+        resampling = profile.get('overview_resampling', 'average')
+        with rasterio.open(outfile, 'r+') as dst:
+            # no overviews smaller than a block
+            factors = [factor for factor in overviews
+                       if max(dst.width, dst.height) // factor
+                       >= profile.get('blockxsize', 256)]
+            if factors:
+                dst.build_overviews(factors, Resampling[resampling])
+                dst.update_tags(ns='rio_overview', resampling=resampling)
+
+    if rewrite or profile.get('cog'):
+        # the copy puts the overviews in front of the image data
+        with rasterio.open(outfile) as src:
+            options = gtiff_profile(
+                src.dtypes[0], src.width, src.height, profile
+            )
+        temp = '{}.part.tif'.format(outfile[:-4])
+        rasterio.shutil.copy(
+            outfile, temp, copy_src_overviews=bool(overviews), **options
+        )
+        os.replace(temp, outfile)
+    return outfile
+
+
 def polygonize_raster(
         infile,
         outfile,
@@ -206,16 +427,14 @@ def outline(
         meta = src.meta
         # update driver, datatype and reduced band count
         meta.update(driver='GTiff', dtype='uint8', count=1)
-        # we update the meta for more efficient looping due to
-        # hardcoded vrt blocksizes
-        meta.update(blockxsize=src.shape[1], blockysize=1)
 
         # create outfiles
         with rasterio.open(
                 '{}.tif'.format(outfile[:-4]), 'w', **meta
         ) as out_min:
-            # loop through blocks
-            for _, window in out_min.block_windows(1):
+            # loop through blocks, sized by memory instead of the
+            # hardcoded vrt blocksizes
+            for window in plan_windows(src):
                 # read array with all bands
                 stack = src.read(range(1, src.count + 1), window=window)
                 # get stats
@@ -321,6 +540,15 @@ def rescale_to_float(
     return float_array
 
 
+def read_features(vector):
+    """Geometries of a vector file (None, if there is no such file)"""
+    if not vector or not os.path.isfile(vector):
+        return None
+    with fiona.open(vector, 'r') as file:
+        return [feature['geometry'] for feature in file
+                if feature['geometry']]
+
+
 def to_gtiff_clip_by_extend(
         infile,
         outfile,
@@ -331,63 +559,97 @@ def to_gtiff_clip_by_extend(
         min_value=0.000001,
         max_value=1,
         no_data=0.0,
-        description=True
+        description=True,
+        ram_budget=PROCESSING_RAM_BUDGET
 ):
-    if os.path.isfile(vector):
-        # import shapefile geometries if clip flag ok
-        with fiona.open(vector, 'r') as file:
-            features = [feature['geometry']
-                        for feature in file
-                        if feature['geometry']
-                        ]
-        # import raster
-        with rasterio.open(infile) as src:
-            out_meta = src.meta.copy()
-            out_image, out_transform = rasterio.mask.mask(src, features, crop=True)
-            out_image = np.ma.masked_where(out_image == no_data, out_image)
-    else:
-        # import raster
-        with rasterio.open(infile) as src:
-            out_meta = src.meta.copy()
-            out_transform = src.transform
-            out_image = src.read()
-            out_image = np.ma.masked_where(out_image == no_data, out_image)
-
-    # unmask array
-    out_image = out_image.data
-
-    # if to decibel should be applied
-    if to_db:
-        out_image = convert_to_db(out_image)
-
-    if rescale:
-        # if we scale to another datatype (WIP: move it to another submodule)
-        if out_dtype != 'float32':
-            if out_dtype == 'uint8':
-                out_image = scale_to_int(out_image, min_value, max_value, 'uint8')
-            elif out_dtype == 'uint16':
-                out_image = scale_to_int(out_image, min_value, max_value, 'uint16')
-
-    out_meta.update({'driver': 'GTiff',
-                     'height': out_image.shape[1],
-                     'width': out_image.shape[2],
-                     'transform': out_transform,
-                     'nodata': no_data,
-                     'dtype': out_dtype,
-                     'tiled': True,
-                     'blockxsize': 128,
-                     'blockysize': 128
-                     })
-
-    with rasterio.open(outfile, 'w', **out_meta) as dest:
-        dest.write(out_image)
-        if description:
-            dest.update_tags(1,
-                             BAND_NAME='{}'.format(os.path.basename(infile)[:-4])
-                             )
-            dest.set_band_description(1,
-                                      '{}'.format(os.path.basename(infile)[:-4])
-                                      )
+    """Clip a raster to a vector extent and convert it to a GeoTIFF
+
+    The extent is rasterized once into a boolean mask of the clipped
+    area. The raster is then streamed block by block through the dB
+    conversion, the scaling to integers and the writing, so that never
+    more than one block is held in memory. Pixels outside of the
+    extent and no data pixels are written as no_data.
+
+    :param infile: input raster
+    :param outfile: output GeoTIFF
+    :param vector: vector file of the extent (no clipping, if missing)
+    :param to_db: convert the values to dB
+    :param out_dtype: output datatype (float32, uint16 or uint8)
+    :param rescale: scale the values to the range of integer datatypes
+    :param min_value: minimum value for the scaling
+    :param max_value: maximum value for the scaling
+    :param no_data: no data value of the in- and output
+    :param description: set the input file name as band description
+    :param ram_budget: memory budget in MB for a single block
+    """
+    features = read_features(vector)
+    with rasterio.open(infile) as src:
+        if features:
+            # the bounding window of the extent, as for a cropped mask
+            crop = geometry_window(src, features)
+            crop = Window(int(crop.col_off), int(crop.row_off),
+                          int(crop.width), int(crop.height))
+        else:
+            crop = Window(0, 0, src.width, src.height)
+        out_transform = src.window_transform(crop)
+
+        inside = None
+        if features:
+            inside = geometry_mask(
+                features, out_shape=(crop.height, crop.width),
+                transform=out_transform, invert=True
+            )
+
+        out_meta = src.meta.copy()
+        out_meta.update({'height': crop.height,
+                         'width': crop.width,
+                         'transform': out_transform,
+                         'nodata': no_data,
+                         'dtype': out_dtype
+                         })
+        out_meta.update(gtiff_profile(out_dtype, crop.width, crop.height))
+
+        with rasterio.open(outfile, 'w', **out_meta) as dest:
+            for window in plan_windows(
+                    dest, ram_budget=ram_budget, count=src.count,
+                    dtype=src.dtypes[0]
+            ):
+                out_image = src.read(window=Window(
+                    window.col_off + crop.col_off,
+                    window.row_off + crop.row_off,
+                    window.width, window.height
+                ))
+                valid = out_image != no_data
+                if inside is not None:
+                    valid &= inside[
+                        window.row_off:window.row_off + window.height,
+                        window.col_off:window.col_off + window.width
+                    ]
+
+                # if to decibel should be applied
+                if to_db:
+                    out_image = convert_to_db(out_image)
+
+                # if we scale to another datatype
+                if rescale and out_dtype in ['uint8', 'uint16']:
+                    out_image = scale_to_int(
+                        out_image, min_value, max_value, out_dtype
+                    )
+
+                dest.write(
+                    np.where(valid, out_image, no_data).astype(out_dtype),
+                    window=window
+                )
+
+            if description:
+                dest.update_tags(1,
+                                 BAND_NAME='{}'.format(os.path.basename(infile)[:-4])
+                                 )
+                dest.set_band_description(1,
+                                          '{}'.format(os.path.basename(infile)[:-4])
+                                          )
+
+    finalize_gtiff(outfile)
 
 
 def norm(band, percentile=False):
@@ -543,48 +805,27 @@ def create_rgb_jpeg(
     if plot:
         plt.imshow(arr)
 
-    
+
 def np_binary_erosion(
         input_array,
-        structure=np.ones((3, 3)).astype(np.bool)
+        structure=np.ones((3, 3)).astype(bool)
 ):
     '''NumPy binary erosion function
 
-    No error checking on input array (type)
-    No error checking on structure element (# of dimensions, shape, type, etc.)
+    Thin wrapper around ost.helpers.morphology.binary_erosion,
+    kept for backwards compatibility.
 
     Args:
-    input_array: Binary NumPy array to be eroded. Non-zero (True) elements
-        form the subset to be eroded
+    input_array: Binary NumPy array (2D or 3D with bands first) to be
+        eroded. Non-zero (True) elements form the subset to be eroded
     structure: Structuring element used for the erosion. Non-zero elements
         are considered True. If no structuring element is provided, an
         element is generated with a square connectivity equal to two
         (square, not cross).
     Returns:
-        binary_erosion: Erosion of the input by the stucturing element
+        binary_erosion: Erosion of the input by the stucturing element,
+        of the same shape as the input
     '''
-    bands, rows, cols = input_array.shape
-    input_shape = (rows, cols)
-
-    # Pad output array (binary_erosion) with extra cells around the edge
-    # so that structuring element will fit without wrapping.
-    # A 3x3 structure, will need 1 additional cell around the edge
-    # A 5x5 structure, will need 2 additional cells around the edge
-    pad_shape = (
-        input_shape[0] + structure.shape[0] - 1,
-        input_shape[1] + structure.shape[1] - 1
-    )
-    input_pad_array = np.zeros(pad_shape).astype(np.bool)
-    input_pad_array[1:rows+1, 1:cols+1] = input_array
-    binary_erosion = np.zeros(pad_shape).astype(np.bool)
-
-    # Cast structure element to boolean
-    struc_mask = structure.astype(np.bool)
-    # Iterate over each cell
-    for row in range(rows):
-        for col in range(cols):
-            # The value of the output pixel is the minimum value of all the
-            # pixels in the input pixel's neighborhood.
-            binary_erosion[row+1, col+1] = np.min(
-                input_pad_array[row:row+3, col:col+3][struc_mask])
-    return binary_erosion[1:rows+1, 1:cols+1]
\ No newline at end of file
+    # imported here, since the morphology module builds on this one
+    from ost.helpers.morphology import binary_erosion
+    return binary_erosion(input_array, structure)
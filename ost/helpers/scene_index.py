@@ -0,0 +1,320 @@
+'''
+Index of the locations of scenes in download directories and on DIAS
+mounts.
+
+Resolving the path of a scene by probing the possible locations costs
+several stat calls per scene, which adds up to minutes for the
+inventories of large download directories or network mounts. The index
+maps the scene identifiers found in the day directories of a location
+(e.g. SAR/SLC/2020/01/01) to their paths.
+
+A download directory is scanned as a whole, as it holds the scenes of a
+project only. The tree is cached on disk (in SCENE_INDEX_DIR) together
+with the modification times of its directories. A refresh stats the
+directories only and re-lists just those whose modification time
+changed, i.e. the ones where scenes (or their .downloaded markers) were
+added or removed. The index is refreshed once it is older than
+SCENE_INDEX_MAX_AGE seconds, and right away after downloads of the
+current process (see invalidate).
+
+The data mounts of the DIAS hold the whole archive, so those are indexed
+lazily instead, a day directory at a time, when the first scene of that
+day is looked up. The listings are kept in memory and checked for
+changes once older than SCENE_INDEX_MAX_AGE seconds as well, and the
+path of a scene found there is verified on every lookup, as its product
+directory can be completed after it was listed.
+
+The index is switched on by setting SCENE_INDEX_DIR (see
+ost.settings); with the default empty directory scene paths are probed
+directly.
+'''
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from uuid import uuid4
+
+from ost.settings import SCENE_INDEX_DIR, SCENE_INDEX_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# the scenes are found within the day directories, which are at this
+# depth below the base of a layout (e.g. product type/year/month/day)
+DAY_DEPTH = 4
+
+
+def _downloaded_scenes(day_dir, entries):
+    # downloads count as soon as their .downloaded marker is written
+    suffix = '.zip.downloaded'
+    return {
+        entry.name[:-len(suffix)]: os.path.join(day_dir, entry.name[:-11])
+        for entry in entries if entry.name.endswith(suffix)
+    }
+
+
+def _creodias_scenes(day_dir, entries):
+    return {
+        entry.name[:-5]: entry.path
+        for entry in entries if entry.name.endswith('.SAFE')
+    }
+
+
+def _creodias_check(path):
+    return os.path.isfile(os.path.join(path, 'manifest.safe'))
+
+
+def _onda_scenes(day_dir, entries):
+    return {
+        entry.name[:-4]: os.path.join(
+            entry.path, '{}.SAFE'.format(entry.name[:-4])
+        )
+        for entry in entries if entry.name.endswith('.zip')
+    }
+
+
+# base directory below the root, the scenes of a day directory, and the
+# check of the path of a scene on lookup for the lazily indexed layouts
+# of the data mounts
+LAYOUTS = {
+    'download': (('SAR',), _downloaded_scenes, None),
+    'creodias': (('Sentinel-1', 'SAR'), _creodias_scenes, _creodias_check),
+    'onda': (('S1', 'LEVEL-1'), _onda_scenes, os.path.isdir)
+}
+
+
+def _listing(path, cached_mtime=None):
+    '''Modification time and entries of a directory
+
+    Returns:
+        tuple of the modification time and the entries, which are None
+        if the directory did not change since cached_mtime, None if the
+        directory is missing
+    '''
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == cached_mtime:
+            return mtime, None
+        with os.scandir(path) as scan:
+            entries = list(scan)
+    except OSError:
+        return None
+    # with a coarse timestamp resolution, later changes within the same
+    # interval go unnoticed, so those are listed again
+    if time.time_ns() - mtime < 2e9:
+        mtime = -1
+    return mtime, entries
+
+
+class SceneIndex():
+    '''Index of the scenes below a download directory or data mount
+
+    Args:
+        root: download directory or data mount
+        layout: directory layout of the scenes (see LAYOUTS), the
+                layouts of the data mounts are indexed lazily
+        index_dir: directory of the cached index (default:
+                   SCENE_INDEX_DIR), not cached if empty
+        max_age: seconds after which the index is refreshed on lookups
+                 (default: SCENE_INDEX_MAX_AGE)
+    '''
+
+    def __init__(self, root, layout='download', index_dir=None,
+                 max_age=None):
+        if layout not in LAYOUTS:
+            raise ValueError('Unknown scene layout {}.'.format(layout))
+        self.root = os.path.abspath(str(root))
+        self.layout = layout
+        self.index_dir = SCENE_INDEX_DIR if index_dir is None else index_dir
+        self.max_age = SCENE_INDEX_MAX_AGE if max_age is None else max_age
+
+        self._tree = None
+        self._scenes = {}
+        self._refreshed = None
+        # listings of the day directories of lazy indices, as lists of
+        # the time of the last check, the modification time and scenes
+        self._days = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base(self):
+        return os.path.join(self.root, *LAYOUTS[self.layout][0])
+
+    @property
+    def lazy(self):
+        return LAYOUTS[self.layout][2] is not None
+
+    @property
+    def index_file(self):
+        # the day listings of lazy indices are kept in memory only
+        if not self.index_dir or self.lazy:
+            return None
+        key = hashlib.sha1(
+            '{}{}'.format(self.layout, self.root).encode()
+        ).hexdigest()
+        return os.path.join(self.index_dir, '{}.json'.format(key))
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r') as file:
+                return json.load(file)
+        except (TypeError, OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # written to a temporary file first, for concurrent processes
+        temp_file = '{}.{}'.format(self.index_file, uuid4().hex)
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(temp_file, 'w') as file:
+                json.dump(self._tree, file)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            logger.debug('Could not save the scene index of %s: %s',
+                         self.root, e)
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+
+    def _scan(self, path, depth, tree):
+        cached = self._tree.get(path)
+        listing = _listing(path, cached[0] if cached else None)
+        if listing is None:
+            return
+        mtime, entries = listing
+        if entries is None:
+            tree[path] = cached
+        elif depth == DAY_DEPTH:
+            tree[path] = [mtime, LAYOUTS[self.layout][1](path, entries)]
+        else:
+            tree[path] = [
+                mtime, sorted(entry.name for entry in entries
+                              if entry.is_dir())
+            ]
+
+        if depth < DAY_DEPTH:
+            for child in tree[path][1]:
+                self._scan(os.path.join(path, child), depth + 1, tree)
+
+    def _day_scenes(self, day_dir):
+        '''Scenes of a day directory of a lazy index'''
+        with self._lock:
+            cached = self._days.get(day_dir)
+            if cached and cached[0] is not None and (
+                    time.monotonic() - cached[0] <= self.max_age
+            ):
+                return cached[2]
+
+            listing = _listing(day_dir, cached[1] if cached else None)
+            if listing is None:
+                mtime, scenes = None, {}
+            elif listing[1] is None:
+                mtime, scenes = listing[0], cached[2]
+            else:
+                mtime = listing[0]
+                scenes = LAYOUTS[self.layout][1](day_dir, listing[1])
+            self._days[day_dir] = [time.monotonic(), mtime, scenes]
+            return scenes
+
+    def refresh(self):
+        '''Rescans the directories that changed since the last scan
+
+        Lazy indices rescan the day directories listed so far.
+
+        Returns:
+            the SceneIndex itself
+        '''
+        if self.lazy:
+            self.invalidate()
+            for day_dir in list(self._days):
+                self._day_scenes(day_dir)
+            return self
+
+        with self._lock:
+            if self._tree is None:
+                self._tree = self._load() if self.index_file else {}
+
+            tree = {}
+            self._scan(self.base, 0, tree)
+            changed = tree != self._tree
+            self._tree = tree
+
+            self._scenes = {}
+            for path, (_, content) in tree.items():
+                if isinstance(content, dict):
+                    self._scenes.update(content)
+            self._refreshed = time.monotonic()
+
+            if changed and self.index_file:
+                self._save()
+        logger.debug('Indexed %s scenes in %s.', len(self._scenes),
+                     self.base)
+        return self
+
+    def invalidate(self):
+        '''Forces a refresh on the next lookup'''
+        self._refreshed = None
+        with self._lock:
+            for day in self._days.values():
+                day[0] = None
+
+    def get(self, scene_id, day=None):
+        '''Path of a scene, None if it is not in the index
+
+        Args:
+            scene_id: identifier of the scene
+            day: directories of the day of the scene below the base of
+                 the layout, e.g. ('SLC', '2020', '01', '01'), required
+                 by lazy indices
+        '''
+        check = LAYOUTS[self.layout][2]
+        if check:
+            if day is None:
+                raise ValueError(
+                    'The {} scene index requires the day of the scene.'
+                    .format(self.layout)
+                )
+            path = self._day_scenes(
+                os.path.join(self.base, *day)).get(scene_id)
+            return path if path and check(path) else None
+
+        if self._refreshed is None or (
+                time.monotonic() - self._refreshed > self.max_age
+        ):
+            self.refresh()
+        return self._scenes.get(scene_id)
+
+    def __contains__(self, scene_id):
+        return self.get(scene_id) is not None
+
+    def __len__(self):
+        if self.lazy:
+            return sum(len(day[2]) for day in list(self._days.values()))
+        if self._refreshed is None:
+            self.refresh()
+        return len(self._scenes)
+
+
+_INDICES = {}
+_INDICES_LOCK = threading.Lock()
+
+
+def enabled():
+    return bool(SCENE_INDEX_DIR)
+
+
+def scene_index(root, layout='download'):
+    '''Shared SceneIndex of a download directory or data mount'''
+    key = (layout, os.path.abspath(str(root)))
+    with _INDICES_LOCK:
+        if key not in _INDICES:
+            _INDICES[key] = SceneIndex(root, layout)
+        return _INDICES[key]
+
+
+def invalidate():
+    '''Forces a refresh of all indices, e.g. after downloads'''
+    with _INDICES_LOCK:
+        for index in _INDICES.values():
+            index.invalidate()
@@ -0,0 +1,219 @@
+'''
+Resource-aware scheduling of processing jobs.
+
+Instead of a fixed number of workers (e.g. half of the CPUs), the
+ResourceScheduler derives the number of concurrent jobs from the
+resources a job of a given type needs (cores, memory and temporary disk
+space, see JOB_RESOURCES) and from the budgets of the machine.
+
+Jobs are only admitted as long as they fit into the free budgets, so
+that a batch can not oversubscribe the machine. Further jobs wait until
+running jobs finish (backpressure) and failed jobs can be retried.
+'''
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from ost.settings import (
+    GPT_RAM_BUDGET, SCHEDULER_CORES, SCHEDULER_DISK_BUDGET
+)
+
+logger = logging.getLogger(__name__)
+
+# minimum cores, memory (MB) and temporary disk space (MB) per job type
+JOB_RESOURCES = {
+    'grd_ard': {'cores': 4, 'memory': 8192, 'disk': 12000},
+    'burst_ard': {'cores': 2, 'memory': 4096, 'disk': 2000},
+    'stacking': {'cores': 4, 'memory': 8192, 'disk': 20000},
+    'mt_speckle': {'cores': 4, 'memory': 8192, 'disk': 20000},
+    'mosaic': {'cores': 1, 'memory': 4096, 'disk': 2000},
+    'default': {'cores': 1, 'memory': 2048, 'disk': 0}
+}
+
+
+def _physical_memory():
+    '''Total physical memory in MB'''
+    try:
+        return int(
+            os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1048576
+        )
+    except (ValueError, OSError, AttributeError):
+        return 8192
+
+
+def _free_disk(path):
+    '''Free disk space in MB'''
+    try:
+        return int(shutil.disk_usage(path).free / 1048576)
+    except OSError:
+        return 0
+
+
+class ResourceScheduler():
+    '''Admits jobs against budgets of cores, memory and temporary disk
+
+    Args:
+        cores (int): number of cores (default: SCHEDULER_CORES or all)
+        memory (int): memory in MB (default: GPT_RAM_BUDGET
+                      or 75% of the physical memory)
+        disk (int): temporary disk space in MB (default:
+                    SCHEDULER_DISK_BUDGET or 90% of the free space
+                    of the temp_dir)
+        temp_dir: directory of the temporary files
+        job_resources (dict): resources per job type
+                              (default: JOB_RESOURCES)
+    '''
+
+    def __init__(
+            self,
+            cores=None,
+            memory=None,
+            disk=None,
+            temp_dir=None,
+            job_resources=None
+    ):
+        self.cores = cores or SCHEDULER_CORES or os.cpu_count()
+        self.memory = (
+            memory or GPT_RAM_BUDGET or int(_physical_memory() * 0.75)
+        )
+        self.disk = disk or SCHEDULER_DISK_BUDGET or int(
+            _free_disk(temp_dir or tempfile.gettempdir()) * 0.9
+        )
+        self.job_resources = job_resources or JOB_RESOURCES
+
+        self._lock = threading.Lock()
+        self._used = {'cores': 0, 'memory': 0, 'disk': 0}
+        self._running = 0
+
+    def _needs(self, job_type):
+        return self.job_resources.get(job_type, self.job_resources['default'])
+
+    def max_jobs(self, job_type, max_workers=None):
+        '''Number of jobs of a type that fit into the budgets at once
+
+        Args:
+            job_type (str): key of the job resources
+            max_workers (int): an upper limit given by the user
+
+        Returns:
+            number of concurrent jobs (at least 1)
+        '''
+        needs = self._needs(job_type)
+        budgets = {'cores': self.cores, 'memory': self.memory,
+                   'disk': self.disk}
+        jobs = min(
+            budgets[key] // needs[key] for key in budgets if needs[key] > 0
+        )
+        if max_workers:
+            jobs = min(jobs, max_workers)
+        return max(1, int(jobs))
+
+    def gpt_threads(self, job_type, jobs=1):
+        '''Number of gpt threads (-q) for each of the concurrent jobs'''
+        return max(1, min(
+            self.cores, max(self._needs(job_type)['cores'], self.cores // jobs)
+        ))
+
+    def _fits(self, needs):
+        # a job always fits into an idle machine, even if too large
+        if self._running == 0:
+            return True
+        return (
+            self._used['cores'] + needs['cores'] <= self.cores
+            and self._used['memory'] + needs['memory'] <= self.memory
+            and self._used['disk'] + needs['disk'] <= self.disk
+        )
+
+    def try_acquire(self, job_type):
+        '''Reserves the resources of a job, if they are free
+
+        Returns:
+            True if the job has been admitted
+        '''
+        needs = self._needs(job_type)
+        with self._lock:
+            if not self._fits(needs):
+                return False
+            for key in self._used:
+                self._used[key] += needs[key]
+            self._running += 1
+            return True
+
+    def release(self, job_type):
+        '''Frees the resources of a finished job'''
+        needs = self._needs(job_type)
+        with self._lock:
+            for key in self._used:
+                self._used[key] -= needs[key]
+            self._running -= 1
+
+    def as_completed(
+            self,
+            submit,
+            func,
+            iterable,
+            fargs=None,
+            job_type='default',
+            retries=0
+    ):
+        '''Submits func(item, *fargs) as long as the resources allow
+
+        Args:
+            submit: submit function of an executor (e.g. GPTPool.submit)
+            func: function to be executed for every item
+            iterable: items to process
+            fargs: further arguments of func
+            job_type (str): key of the job resources
+            retries (int): number of times a failed job is resubmitted
+
+        Yields:
+            the futures of the jobs as they complete, failed jobs only
+            once they ran out of retries
+        '''
+        pending = deque((item, 0) for item in iterable)
+        running = {}
+        try:
+            while pending or running:
+
+                # admit as many jobs as fit into the free resources
+                while pending and self.try_acquire(job_type):
+                    item, attempt = pending.popleft()
+                    future = submit(func, item, *(fargs or ()))
+                    running[future] = (item, attempt)
+
+                if not running:
+                    # other users of the scheduler hold all resources
+                    threading.Event().wait(1)
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, attempt = running.pop(future)
+                    self.release(job_type)
+                    if future.exception() is not None and attempt < retries:
+                        logger.debug(
+                            'Resubmitting failed %s job (%s): %s',
+                            job_type, attempt + 1, future.exception()
+                        )
+                        pending.append((item, attempt + 1))
+                        continue
+                    yield future
+        finally:
+            # e.g. if the caller stops on a failed job
+            for _ in running:
+                self.release(job_type)
+
+
+_SCHEDULER = {}
+
+
+def get_scheduler():
+    '''The scheduler shared by all jobs of the current process'''
+    if 'default' not in _SCHEDULER:
+        _SCHEDULER['default'] = ResourceScheduler()
+    return _SCHEDULER['default']
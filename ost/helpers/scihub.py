@@ -6,15 +6,12 @@ import datetime
 from urllib import request, parse
 import requests
 import logging
-from http.cookiejar import CookieJar
-import urllib.request as urlreq
 from shapely.wkt import loads
 from retry import retry
 
 from godale import Executor
 
-from ost.helpers import utils as h
-from ost.helpers.utils import TqdmUpTo
+from ost.helpers import scene_index, download
 
 logger = logging.getLogger(__name__)
 
@@ -262,76 +259,8 @@ def s1_download(argument_list):
            'Products(\'{}\')/$value'.format(uuid)
            )
 
-    # get first response for file Size
-    response = requests.get(url, stream=True, auth=(uname, pword))
-
-    # check response
-    if response.status_code == 401:
-        raise ValueError(' ERROR: Username/Password are incorrect.')
-    elif response.status_code == 404:
-        logger.debug(
-            'Product %s missing from the archive, continuing.',
-            filename.split('/')[-1]
-        )
-        return filename.split('/')[-1]
-    elif response.status_code != 200:
-        logger.debug(
-            'ERROR: Something went wrong, will try again in 30 seconds.'
-        )
-        response.raise_for_status()
-
-    password_manager = urlreq.HTTPPasswordMgrWithDefaultRealm()
-    password_manager.add_password(
-        None, "https://scihub.copernicus.eu/apihub/", uname, pword
-    )
-
-    cookie_jar = CookieJar()
-    opener = urlreq.build_opener(
-        urlreq.HTTPBasicAuthHandler(password_manager),
-        urlreq.HTTPCookieProcessor(cookie_jar)
-    )
-    urlreq.install_opener(opener)
-    # get download size
-    total_length = int(response.headers.get('content-length', 0))
-
-    # check if file is partially downloaded
-    if os.path.exists(filename):
-        first_byte = os.path.getsize(filename)
-    else:
-        first_byte = 0
-    if first_byte >= total_length:
-        return str('{}.downloaded'.format(filename))
-
-    zip_test = 1
-    while zip_test is not None and zip_test <= 10:
-        logger.debug('INFO: Downloading scene to: {}'.format(filename))
-        with TqdmUpTo(unit='B', unit_scale=True, miniters=1,
-                      desc=url.split('/')[-1]) as t:
-            filename, headers = urlreq.urlretrieve(
-                url, filename=filename, reporthook=t.update_to
-            )
-
-        # zipFile check
-        logger.debug(
-            'INFO: Checking the zip archive of {} for inconsistency'.format(
-                filename
-            )
-        )
-        zip_test = h.check_zipfile(filename)
-
-        # if it did not pass the test, remove the file
-        # in the while loop it will be downlaoded again
-        if zip_test is not None:
-            logger.debug('INFO: {} did not pass the zip test. \
-                  Re-downloading the full scene.'.format(filename))
-            os.remove(filename)
-            first_byte = 0
-        # otherwise we change the status to True
-        else:
-            logger.debug('INFO: {} passed the zip test.'.format(filename))
-            with open(str('{}.downloaded'.format(filename)), 'w') as file:
-                file.write('successfully downloaded \n')
-    return str('{}.downloaded'.format(filename))
+    session = download.pooled_session(('scihub', uname), auth=(uname, pword))
+    return download.download_product(url, filename, session)
 
 
 def scihub_batch_download(
@@ -359,6 +288,7 @@ def scihub_batch_download(
         downloaded_string = task.result()
         if not downloaded_string.endswith('downloaded'):
             missing_scenes.append(downloaded_string)
+    scene_index.invalidate()
 
     downloaded_scenes = glob.glob(
         opj(download_dir, 'SAR', '*', '20*', '*', '*',
@@ -383,6 +313,11 @@ def _prepare_scenes_to_dl(inventory_df, download_dir, uname, pword):
     download_list = []
     for scene_id in scenes:
         scene = S1Scene(scene_id)
+        if scene.get_path(download_dir, data_mount=None):
+            logger.debug('INFO: {} is already downloaded.'
+                         .format(scene.scene_id)
+                         )
+            continue
         filepath = scene._download_path(download_dir, True)
         try:
             uuid = (inventory_df['uuid']
@@ -396,13 +331,8 @@ def _prepare_scenes_to_dl(inventory_df, download_dir, uname, pword):
                 pword=pword
             )
             )
-        if os.path.exists('{}.downloaded'.format(filepath)):
-            logger.debug('INFO: {} is already downloaded.'
-                         .format(scene.scene_id)
-                         )
-        else:
-            # Create list objects for download
-            download_list.append([uuid, filepath, uname, pword])
+        # Create list objects for download
+        download_list.append([uuid, filepath, uname, pword])
     return download_list
 
 
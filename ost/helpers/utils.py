@@ -15,7 +15,9 @@ from datetime import timedelta
 from pathlib import Path
 import zipfile
 
+from ost.helpers import gpt_pool, scene_index
 from ost.s1_to_ard.burst_to_ard import burst_to_ard
+from ost.settings import GPT_FUSED_GRAPH
 
 
 logger = logging.getLogger(__name__)
@@ -145,6 +147,16 @@ def run_command(command, logfile, elapsed=True, silent=False):
 
     '''
     currtime = time.time()
+
+    # workers of a GPT pool run gpt within their own JVM
+    if gpt_pool.in_worker() and gpt_pool.is_gpt_command(command):
+        return_code = gpt_pool.run_gpt(command, logfile)
+        if return_code is not None:
+            if elapsed:
+                timer(currtime)
+            return return_code
+        command = gpt_pool.worker_command(command)
+
     if silent:
         dev_null = open(os.devnull, 'w')
         stderr = subprocess.STDOUT
@@ -358,6 +370,7 @@ def _product_zip_to_processing_dir(
             )+'.downloaded', 'w'
     ) as zip_dl:
         zip_dl.write('1')
+    scene_index.invalidate()
 
 
 def execute_ard(
@@ -397,6 +410,7 @@ def execute_ard(
         to_db=ard_parameters['to_db'],
         ls_mask_create=False,
         dem=ard_parameters['dem'],
+        fused_graph=ard_parameters.get('fused_graph', GPT_FUSED_GRAPH)
     )
     if return_code != 0:
         raise RuntimeError(
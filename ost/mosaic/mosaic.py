@@ -1,76 +1,547 @@
+'''
+Mosaicking of overlapping rasters (e.g. of neighbouring tracks).
+
+Besides the mosaicking with OTB's otbcli_Mosaic, a native engine
+mosaics the rasters window by window within a memory budget:
+
+- the output grid is the union of the footprints of all inputs (cut to
+  the AOI, if given), on the pixel grid of the first input
+- overlaps are blended by distance weighted feathering, i.e. every
+  input is weighted by the distance of a pixel to its no data border
+  (capped at feather pixels)
+- optionally, the inputs are harmonised beforehand by a gain (or
+  offset) per input and band, that minimises the differences of the
+  inputs within their overlaps (as OTB's band harmonisation)
+- pixels outside of the AOI are masked during the write, so that no
+  second pass over the mosaic is needed
+'''
+
 import os
+import math
+import shutil
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from os.path import join as opj
-import numpy as np
 from tempfile import TemporaryDirectory
+
+import numpy as np
 import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioError
+from rasterio.features import bounds as feature_bounds, geometry_mask
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds, transform_geom
+from rasterio.windows import Window, from_bounds
+from scipy import ndimage
 
-from ost.helpers import vector as vec, utils as h
+from ost.helpers import vector as vec, raster as ras, utils as h
+from ost.helpers.scheduler import get_scheduler
+from ost.settings import MOSAIC_NATIVE, PROCESSING_RAM_BUDGET
 
 logger = logging.getLogger(__name__)
 
+# width of the feathering of overlaps in pixels
+FEATHER_DISTANCE = 50
 
-def mosaic(
-        filelist,
+# maximum size of the overview grid for the harmonisation in pixels
+HARMONISATION_SIZE = 1024
+
+
+def _snap(value, decimals=6):
+    # avoid an extra row or column due to floating point noise
+    return round(value, decimals)
+
+
+def mosaic_grid(sources, features=None):
+    '''Grid of the union of the footprints of rasters
+
+    The grid has the CRS and resolution of the first raster and is
+    aligned to its pixels.
+
+    Args:
+        sources: opened rasterio datasets
+        features: geometries (in the CRS of the first raster), to which
+                  the grid is cropped
+
+    Returns:
+        crs, transform, width and height of the grid
+    '''
+    ref = sources[0]
+    crs, ref_transform = ref.crs, ref.transform
+    footprints = [
+        src.bounds if src.crs == crs else transform_bounds(
+            src.crs, crs, *src.bounds
+        )
+        for src in sources
+    ]
+    left = min(footprint[0] for footprint in footprints)
+    bottom = min(footprint[1] for footprint in footprints)
+    right = max(footprint[2] for footprint in footprints)
+    top = max(footprint[3] for footprint in footprints)
+
+    if features:
+        aoi = [feature_bounds(feature) for feature in features]
+        left = max(left, min(box[0] for box in aoi))
+        bottom = max(bottom, min(box[1] for box in aoi))
+        right = min(right, max(box[2] for box in aoi))
+        top = min(top, max(box[3] for box in aoi))
+        if left >= right or bottom >= top:
+            raise ValueError('The AOI does not overlap the rasters.')
+
+    # rows and columns on the pixel grid of the first raster
+    col_start = math.floor(_snap((left - ref_transform.c) / ref_transform.a))
+    col_stop = math.ceil(_snap((right - ref_transform.c) / ref_transform.a))
+    row_start = math.floor(_snap((top - ref_transform.f) / ref_transform.e))
+    row_stop = math.ceil(_snap((bottom - ref_transform.f) / ref_transform.e))
+
+    transform = ref_transform * Affine.translation(col_start, row_start)
+    return crs, transform, col_stop - col_start, row_stop - row_start
+
+
+def _footprint_window(dataset, crs, transform, width, height):
+    '''Window of a raster's footprint within a grid (None if outside)'''
+    footprint = dataset.bounds if dataset.crs == crs else transform_bounds(
+        dataset.crs, crs, *dataset.bounds
+    )
+    window = from_bounds(*footprint, transform=transform)
+    col_start = max(math.floor(_snap(window.col_off)), 0)
+    row_start = max(math.floor(_snap(window.row_off)), 0)
+    col_stop = min(math.ceil(_snap(window.col_off + window.width)), width)
+    row_stop = min(math.ceil(_snap(window.row_off + window.height)), height)
+    if col_start >= col_stop or row_start >= row_stop:
+        return None
+    return Window(col_start, row_start, col_stop - col_start,
+                  row_stop - row_start)
+
+
+def _intersects(window, other):
+    return (
+        other is not None
+        and window.col_off < other.col_off + other.width
+        and other.col_off < window.col_off + window.width
+        and window.row_off < other.row_off + other.height
+        and other.row_off < window.row_off + window.height
+    )
+
+
+def _valid(block, no_data):
+    # a pixel is valid, if any of its bands is
+    valid = np.isfinite(block)
+    if no_data is not None:
+        valid &= block != no_data
+    return valid.any(axis=0)
+
+
+def _read_with_halo(src, window, halo, no_data):
+    '''Reads a window with an overlap of halo pixels on each side
+
+    Returns:
+        the block (bands, rows, cols), which is NaN outside of the
+        grid, and the mask of its valid pixels, which continues the
+        edge of the grid
+    '''
+    row_start = max(window.row_off - halo, 0)
+    col_start = max(window.col_off - halo, 0)
+    row_stop = min(window.row_off + window.height + halo, src.height)
+    col_stop = min(window.col_off + window.width + halo, src.width)
+    block = src.read(window=Window(
+        col_start, row_start, col_stop - col_start, row_stop - row_start
+    )).astype('float32')
+
+    pad = (
+        (halo - (window.row_off - row_start),
+         halo - (row_stop - window.row_off - window.height)),
+        (halo - (window.col_off - col_start),
+         halo - (col_stop - window.col_off - window.width))
+    )
+    valid = np.pad(_valid(block, no_data), pad, mode='edge')
+    block = np.pad(block, ((0, 0),) + pad, mode='constant',
+                   constant_values=np.nan)
+    return block, valid
+
+
+def feather_weights(valid, feather=FEATHER_DISTANCE):
+    '''Distance of valid pixels to the closest invalid one, capped
+
+    Args:
+        valid: mask of the valid pixels of a block, including an
+               overlap of at least feather pixels
+        feather: maximum distance in pixels
+
+    Returns:
+        float array of the weights, 0 for invalid pixels
+    '''
+    if valid.all():
+        return np.full(valid.shape, float(feather))
+    return np.minimum(ndimage.distance_transform_edt(valid), feather)
+
+
+def _overview(src, shape, no_data):
+    # all bands of a raster on a coarse version of the grid
+    block = src.read(out_shape=(src.count,) + shape,
+                     resampling=Resampling.average).astype('float64')
+    valid = np.isfinite(block)
+    if no_data is not None:
+        valid &= block != no_data
+    return np.where(valid, block, np.nan)
+
+
+def _components(pairs, size):
+    # connected groups of inputs, linked by their overlaps
+    parent = list(range(size))
+
+    def _root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        parent[_root(i)] = _root(j)
+
+    groups = {}
+    for i in range(size):
+        groups.setdefault(_root(i), []).append(i)
+    return list(groups.values())
+
+
+def harmonisation_coefficients(means, counts, model='gain'):
+    '''Gains (or offsets) of inputs, that align them within overlaps
+
+    Minimises the weighted squared differences of the inputs' means
+    within their overlaps. The gains of every group of overlapping
+    inputs average to 1 (the offsets to 0), so that the group keeps
+    its overall level.
+
+    Args:
+        means: array (inputs, inputs) of the mean of input i within the
+               overlap with input j
+        counts: array (inputs, inputs) of the number of pixels of the
+                overlaps
+        model: gain (multiplicative) or offset (additive)
+
+    Returns:
+        array of the coefficient of every input
+    '''
+    size = len(means)
+    identity = 1.0 if model == 'gain' else 0.0
+    coefficients = np.full(size, identity)
+    pairs = [(i, j) for i in range(size) for j in range(i + 1, size)
+             if counts[i, j] > 0]
+
+    for group in _components(pairs, size):
+        if len(group) < 2:
+            continue
+        index = {input_: k for k, input_ in enumerate(group)}
+        rows, rhs = [], []
+        for i, j in pairs:
+            if i not in index:
+                continue
+            weight = math.sqrt(counts[i, j] / counts.max())
+            row = np.zeros(len(group))
+            if model == 'gain':
+                row[index[i]] = weight * means[i, j]
+                row[index[j]] = -weight * means[j, i]
+                rhs.append(0)
+            else:
+                row[index[i]], row[index[j]] = weight, -weight
+                rhs.append(weight * (means[j, i] - means[i, j]))
+            rows.append(row)
+
+        # the level of the group is kept
+        scale = 1e3 * max(np.abs(np.array(rows)).max(), 1)
+        rows.append(np.full(len(group), scale))
+        rhs.append(scale * identity * len(group))
+
+        solution = np.linalg.lstsq(np.array(rows), np.array(rhs),
+                                   rcond=None)[0]
+        coefficients[group] = solution
+
+    return coefficients
+
+
+def harmonise(sources, footprints, no_data, ram_budget=PROCESSING_RAM_BUDGET):
+    '''Harmonisation coefficients of rasters on a common grid
+
+    The means within the overlaps are taken from a coarse overview of
+    the grid. Gains are estimated for positive data (e.g. backscatter
+    in power), offsets otherwise (e.g. in dB).
+
+    Args:
+        sources: opened rasters on a common grid (e.g. WarpedVRTs)
+        footprints: windows of the rasters within the grid
+        no_data: no data value of the rasters
+        ram_budget: memory budget in MB for the overviews of all rasters
+
+    Returns:
+        list of the models (gain or offset) and coefficients
+        (inputs, bands) per band
+    '''
+    src = sources[0]
+    pixels = ram_budget * 1048576 / (len(sources) * src.count * 8 * 2)
+    factor = max(
+        max(src.width, src.height) / HARMONISATION_SIZE,
+        math.sqrt(src.width * src.height / pixels), 1
+    )
+    shape = (max(int(src.height / factor), 1),
+             max(int(src.width / factor), 1))
+    overviews = [_overview(source, shape, no_data) for source in sources]
+
+    size = len(sources)
+    models, coefficients = [], np.ones((size, src.count))
+    for band in range(src.count):
+        means, counts = np.zeros((size, size)), np.zeros((size, size))
+        for i in range(size):
+            for j in range(i + 1, size):
+                if not _intersects(footprints[i], footprints[j]):
+                    continue
+                overlap = (np.isfinite(overviews[i][band])
+                           & np.isfinite(overviews[j][band]))
+                counts[i, j] = counts[j, i] = overlap.sum()
+                if counts[i, j]:
+                    means[i, j] = overviews[i][band][overlap].mean()
+                    means[j, i] = overviews[j][band][overlap].mean()
+
+        model = 'gain' if (means[counts > 0] > 0).all() else 'offset'
+        models.append(model)
+        coefficients[:, band] = harmonisation_coefficients(
+            means, counts, model
+        )
+        logger.debug('Harmonisation %ss of band %s: %s', model, band + 1,
+                     coefficients[:, band])
+
+    return models, coefficients
+
+
+def mosaic_native(
+        infiles,
         outfile,
-        cut_to_aoi=False
+        features=None,
+        features_crs='EPSG:4326',
+        harmonize=True,
+        feather=FEATHER_DISTANCE,
+        no_data=None,
+        ram_budget=PROCESSING_RAM_BUDGET
 ):
+    '''Mosaics rasters window by window, without OTB
+
+    All inputs are warped (bilinear) onto the grid of the mosaic. Every
+    window of the mosaic is read from the inputs, that overlap it, with
+    an overlap of feather pixels, so that the feathering is the same as
+    for the full images.
+
+    Args:
+        infiles: rasters to mosaic, with the same number of bands
+        outfile: output GeoTIFF
+        features: geometries of the AOI, to which the mosaic is cut
+        features_crs: CRS of the features
+        harmonize: harmonise the levels of the inputs in their overlaps
+        feather: width of the feathering in pixels
+        no_data: no data value of the in- and output (default: of the
+                 first input, or 0)
+        ram_budget: memory budget in MB for a single window of all
+                    overlapping inputs
+    '''
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(rasterio.open(infile))
+                    for infile in infiles]
+        ref = datasets[0]
+        if no_data is None:
+            no_data = ref.nodata if ref.nodata is not None else 0
+        if features:
+            features = [transform_geom(features_crs, ref.crs, feature)
+                        for feature in features]
+
+        crs, transform, width, height = mosaic_grid(datasets, features)
+        sources = [
+            stack.enter_context(WarpedVRT(
+                dataset, crs=crs, transform=transform, width=width,
+                height=height, resampling=Resampling.bilinear,
+                src_nodata=dataset.nodata if dataset.nodata is not None
+                else no_data, nodata=no_data
+            ))
+            for dataset in datasets
+        ]
+        footprints = [
+            _footprint_window(dataset, crs, transform, width, height)
+            for dataset in datasets
+        ]
+
+        models = None
+        if harmonize and len(sources) > 1:
+            models, coefficients = harmonise(
+                sources, footprints, no_data, ram_budget
+            )
+
+        dtype = ref.dtypes[0]
+        meta = ref.meta.copy()
+        meta.update({'driver': 'GTiff', 'crs': crs, 'transform': transform,
+                     'width': width, 'height': height, 'nodata': no_data})
+        meta.update(ras.gtiff_profile(dtype, width, height))
+        dst = stack.enter_context(rasterio.open(outfile, 'w', **meta))
+
+        # the most inputs that overlap at a time
+        overlapping = max(
+            sum(_intersects(footprint, other) for other in footprints)
+            for footprint in footprints if footprint is not None
+        ) if any(footprints) else 1
+        windows = ras.plan_windows(
+            dst, ram_budget=ram_budget, count=overlapping * ref.count,
+            dtype='float32', overhead=6
+        )
+        logger.debug('Mosaicking %s rasters in %s windows to %s',
+                     len(infiles), len(windows), outfile)
+
+        for window in windows:
+            halo_window = Window(
+                window.col_off - feather, window.row_off - feather,
+                window.width + 2 * feather, window.height + 2 * feather
+            )
+            inputs = [i for i, footprint in enumerate(footprints)
+                      if _intersects(halo_window, footprint)]
+
+            total = np.zeros((ref.count, window.height, window.width))
+            weights = np.zeros((window.height, window.width))
+            core = (slice(feather, feather + window.height),
+                    slice(feather, feather + window.width))
+            for i in inputs:
+                block, valid = _read_with_halo(
+                    sources[i], window, feather, no_data
+                )
+                if len(inputs) > 1:
+                    weight = feather_weights(valid, feather)[core]
+                else:
+                    weight = valid[core].astype('float64')
+                block = block[(slice(None),) + core]
+                if models:
+                    for band, model in enumerate(models):
+                        if model == 'gain':
+                            block[band] *= coefficients[i, band]
+                        else:
+                            block[band] += coefficients[i, band]
+                block = np.where(np.isfinite(block), block, 0)
+                total += block * weight
+                weights += weight
+
+            valid = weights > 0
+            if features:
+                valid &= geometry_mask(
+                    features, out_shape=valid.shape, invert=True,
+                    transform=dst.window_transform(window)
+                )
+            mosaic = np.divide(total, weights, out=np.zeros(total.shape),
+                               where=valid)
+            if np.issubdtype(np.dtype(dtype), np.integer):
+                info = np.iinfo(dtype)
+                mosaic = np.clip(np.rint(mosaic), info.min, info.max)
+            dst.write(
+                np.where(valid, mosaic, no_data).astype(dtype),
+                window=window
+            )
+
+        dst.update_tags(**ref.tags())
+        for band in range(1, ref.count + 1):
+            dst.update_tags(band, **ref.tags(band))
+            if ref.descriptions[band - 1]:
+                dst.set_band_description(band, ref.descriptions[band - 1])
 
-    check_file = opj(
+    ras.finalize_gtiff(outfile)
+
+
+def processed_file(outfile):
+    '''Checkpoint of a successfully mosaicked layer'''
+    return opj(
         os.path.dirname(outfile), '.{}.processed'.format(os.path.basename(outfile)[:-4])
     )
 
+
+def mosaic(
+        filelist,
+        outfile,
+        cut_to_aoi=False,
+        native=None,
+        harmonize=True,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Mosaics rasters natively or with OTB and checks the output
+
+    Args:
+        filelist: list (or space separated string) of the rasters
+        outfile: output GeoTIFF
+        cut_to_aoi: AOI as WKT (EPSG:4326), to which the mosaic is cut
+        native: use the native engine (see mosaic_native) instead of
+                otbcli_Mosaic (default: MOSAIC_NATIVE, and always if
+                OTB is not installed)
+        harmonize: harmonise the levels of the rasters in the overlaps
+        ram_budget: memory budget in MB of the native engine
+    '''
+    check_file = processed_file(outfile)
+
     logfile = opj(
         os.path.dirname(outfile), '{}.errLog'.format(os.path.basename(outfile)[:-4])
     )
 
-    with rasterio.open(filelist.split(' ')[0]) as src:
-        dtype = src.meta['dtype']
-        dtype = 'float' if dtype == 'float32' else dtype
-    with TemporaryDirectory() as temp_dir:
-        if cut_to_aoi:
-            tempfile = opj(temp_dir, os.path.basename(outfile))
-        else:
-            tempfile = outfile
-
-        cmd = ('otbcli_Mosaic -ram 4096'
-               ' -progress 1'
-               ' -comp.feather large'
-               ' -harmo.method band'
-               ' -harmo.cost rmse'
-               ' -temp_dir {}'
-               ' -il {}'
-               ' -out {} {}'.format(temp_dir, filelist,
-                                    tempfile, dtype)
-               )
-
-        return_code = h.run_command(cmd, logfile)
-        if return_code != 0:
-            if os.path.isfile(tempfile):
-                os.remove(tempfile)
+    if isinstance(filelist, str):
+        filelist = filelist.split()
 
-            return
+    native = MOSAIC_NATIVE if native is None else native
+    if not native and shutil.which('otbcli_Mosaic') is None:
+        logger.debug('otbcli_Mosaic not found, using the native mosaicking.')
+        native = True
 
+    features = None
     if cut_to_aoi:
         # get aoi ina way rasterio wants it
         features = vec.gdf_to_json_geometry(vec.wkt_to_gdf(cut_to_aoi))
 
-        # import raster and mask
-        with rasterio.open(tempfile) as src:
-            out_image, out_transform = rasterio.mask.mask(src, features, crop=True)
-            out_meta = src.meta.copy()
-            ndv = src.nodata
-            out_image = np.ma.masked_where(out_image == ndv, out_image)
+    if native:
+        try:
+            mosaic_native(filelist, outfile, features, harmonize=harmonize,
+                          ram_budget=ram_budget)
+        except (RasterioError, ValueError) as e:
+            with open(str(logfile), 'w') as file:
+                file.write('{}\n'.format(e))
+            if os.path.isfile(outfile):
+                os.remove(outfile)
+            return
+    else:
+        with rasterio.open(filelist[0]) as src:
+            dtype = src.meta['dtype']
+            dtype = 'float' if dtype == 'float32' else dtype
+        with TemporaryDirectory() as temp_dir:
+            if cut_to_aoi:
+                tempfile = opj(temp_dir, os.path.basename(outfile))
+            else:
+                tempfile = outfile
+
+            cmd = ('otbcli_Mosaic -ram 4096'
+                   ' -progress 1'
+                   ' -comp.feather large'
+                   ' {}'
+                   ' -temp_dir {}'
+                   ' -il {}'
+                   ' -out {} {}'.format(
+                       '-harmo.method band -harmo.cost rmse'
+                       if harmonize else '',
+                       temp_dir, ' '.join(filelist), tempfile, dtype
+                   ))
 
-        out_meta.update({'driver': 'GTiff', 'height': out_image.shape[1],
-                         'width': out_image.shape[2], 'transform': out_transform,
-                         'tiled': True, 'blockxsize': 128, 'blockysize': 128})
+            return_code = h.run_command(cmd, logfile)
+            if return_code != 0:
+                if os.path.isfile(tempfile):
+                    os.remove(tempfile)
 
-        with rasterio.open(outfile, 'w', **out_meta) as dest:
-            dest.write(out_image.data)
+                return
 
-        # remove intermediate file
-        os.remove(tempfile)
+            if cut_to_aoi:
+                # the AOI is cut window by window, with the output profile
+                mosaic_native([tempfile], outfile, features,
+                              harmonize=False, ram_budget=ram_budget)
+            else:
+                # compression, overviews and layout of the output profile
+                ras.finalize_gtiff(outfile, rewrite=True)
 
     # check
     return_code = h.check_out_tiff(outfile)
@@ -82,3 +553,61 @@ def mosaic(
     if return_code == 0:
         with open(str(check_file), 'w') as file:
             file.write('passed all tests \n')
+
+
+def _mosaic_layer(layer, cut_to_aoi, harmonize, ram_budget):
+    filelist, outfile = layer
+    logger.debug('INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
+    mosaic(filelist, outfile, cut_to_aoi, harmonize=harmonize,
+           ram_budget=ram_budget)
+    return outfile
+
+
+def mosaic_layers(
+        layers,
+        cut_to_aoi=False,
+        harmonize=True,
+        max_workers=None,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Mosaics independent layers (e.g. dates or metrics) in parallel
+
+    The layers are admitted by the resource scheduler as mosaic jobs,
+    i.e. only as many run at once as fit into its memory budget, and
+    share the ram_budget of the native engine. Layers with a
+    .processed checkpoint are skipped.
+
+    Args:
+        layers: list of tuples of the rasters and the output file of
+                every layer
+        cut_to_aoi: AOI as WKT (EPSG:4326), to which the layers are cut
+        harmonize: harmonise the levels of the rasters in the overlaps
+        max_workers: maximum number of processes
+        ram_budget: memory budget in MB of all concurrent layers
+
+    Returns:
+        list of the successfully mosaicked output files, in the order
+        of the layers
+    '''
+    todo = []
+    for filelist, outfile in layers:
+        if os.path.isfile(processed_file(outfile)):
+            logger.debug('INFO: Mosaic layer {} already'
+                         ' processed.'.format(os.path.basename(outfile)))
+        else:
+            todo.append((filelist, outfile))
+
+    if todo:
+        scheduler = get_scheduler()
+        max_workers = min(scheduler.max_jobs('mosaic', max_workers),
+                          len(todo))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for task in scheduler.as_completed(
+                    executor.submit, _mosaic_layer, todo,
+                    fargs=(cut_to_aoi, harmonize, ram_budget / max_workers),
+                    job_type='mosaic'
+            ):
+                task.result()
+
+    return [outfile for _, outfile in layers
+            if os.path.isfile(processed_file(outfile))]
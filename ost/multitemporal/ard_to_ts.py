@@ -7,9 +7,15 @@ import logging
 from tempfile import TemporaryDirectory
 
 import gdal
+from godale import Executor
 
 from ost.helpers import raster as ras, utils as h
+from ost.helpers.scheduler import get_scheduler
 from ost.config.speckle_config import DEFAULT_MT_SPECKLE_DICT
+from ost.multitemporal import mt_speckle, datacube
+from ost.settings import (
+    MT_SPECKLE_NATIVE, PROCESSING_RAM_BUDGET, TIMESERIES_DATACUBE
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,19 +35,21 @@ def create_stack(
 
     # get gpt file
     gpt_file = h.gpt_path()
+    # gpt threads according to the resources of the job
+    threads = get_scheduler().gpt_threads('stacking')
 
     # get path to graph
     rootpath = importlib.util.find_spec('ost').submodule_search_locations[0]
     if pattern:
         graph = opj(rootpath, 'graphs', 'S1_TS', '1_BS_Stacking_HAalpha.xml')
         command = '{} {} -x -q {} -Pfilelist={} -PbandPattern=\'{}.*\' \
-               -Poutput={}'.format(gpt_file, graph, 2 * os.cpu_count(),
+               -Poutput={}'.format(gpt_file, graph, threads,
                                    filelist, pattern, out_stack
                                    )
     else:
         graph = opj(rootpath, 'graphs', 'S1_TS', '1_BS_Stacking.xml')
         command = '{} {} -x -q {} -Pfilelist={} -Ppol={} \
-               -Poutput={}'.format(gpt_file, graph, 2 * os.cpu_count(),
+               -Poutput={}'.format(gpt_file, graph, threads,
                                    filelist, polarisation, out_stack
                                    )
 
@@ -68,6 +76,8 @@ def mt_speckle_filter(
     '''
     # get gpt file
     gpt_file = h.gpt_path()
+    # gpt threads according to the resources of the job
+    threads = get_scheduler().gpt_threads('mt_speckle')
     if speckle_dict is None:
         speckle_dict = DEFAULT_MT_SPECKLE_DICT
 
@@ -86,7 +96,7 @@ def mt_speckle_filter(
                ' -PtargetWindowSizeStr={}'
                ' -PwindowSize={}'
                ' -t "{}" "{}"'.format(
-        gpt_file, 2 * os.cpu_count(),
+        gpt_file, threads,
         speckle_dict['estimate_ENL'],
         speckle_dict['pan_size'],
         speckle_dict['damping'],
@@ -121,17 +131,33 @@ def ard_to_ts(
         ard_params,
         pol,
         product_suffix='TC',
-        no_data=0.0
+        no_data=0.0,
+        append=False,
+        max_workers=None
 ):
+    '''Creates the time-series of a track in one polarisation
+
+    With append, new dates are added to an already processed
+    time-series, without processing its dates again (only for the
+    native processing of backscatter and polarimetric time-series).
+    The dates of GPT stacks are exported by max_workers processes.
+    With the datacube option of the ARD parameters, all dates are
+    written into a chunked datacube as well (see
+    ost.multitemporal.datacube).
+    '''
     # get the track directory
     track_dir = opj(processing_dir, track)
+    native = product_suffix != 'coh' and ard_params.get(
+        'mt_speckle_native', MT_SPECKLE_NATIVE
+    )
 
     # check routine if timeseries has already been processed
     check_file = opj(track_dir,
                      'Timeseries',
                      '.{}.{}.processed'.format(product_suffix, pol)
                      )
-    if os.path.isfile(check_file):
+    processed = os.path.isfile(check_file)
+    if processed and not (append and native):
         logger.debug(
                      'INFO: Timeseries of {} for {} in {} polarisation already'
                      ' processed'.format(track, product_suffix, pol)
@@ -161,6 +187,68 @@ def ard_to_ts(
     out_dir = opj(processing_dir, '{}'.format(track), 'Timeseries')
     os.makedirs(out_dir, exist_ok=True)
 
+    if native:
+        # filter and export the dates block-wise, without any GPT stack
+        outfiles = _get_native_ts(
+            list_of_dims=list_of_files,
+            out_dir=out_dir,
+            polarization=pol,
+            product_suffix=product_suffix,
+            extent=extent,
+            mt_speckle_filter=ard_params['mt_speckle_filter'],
+            to_db=to_db,
+            out_dtype=ard_params['dtype_output'],
+            min=mm_dict[stretch]['min'],
+            max=mm_dict[stretch]['max'],
+            no_data=no_data,
+            append=append and processed
+        )
+    else:
+        outfiles = _get_gpt_ts(
+            list_of_files=list_of_files,
+            out_dir=out_dir,
+            track=track,
+            ard_params=ard_params,
+            pol=pol,
+            product_suffix=product_suffix,
+            extent=extent,
+            to_db=to_db,
+            min=mm_dict[stretch]['min'],
+            max=mm_dict[stretch]['max'],
+            no_data=no_data,
+            max_workers=max_workers
+        )
+
+    with open(str(check_file), 'w') as file:
+        file.write('passed all tests \n')
+    # build vrt of timeseries
+    vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
+    gdal.BuildVRT(opj(out_dir, 'Timeseries.{}.{}.vrt'.format(product_suffix, pol)),
+                  outfiles,
+                  options=vrt_options
+                  )
+    if ard_params.get('datacube', TIMESERIES_DATACUBE):
+        # the time profiles of all dates within single chunks
+        datacube.files_to_datacube(
+            outfiles, datacube.datacube_file(out_dir, product_suffix, pol),
+            variable='{}_{}'.format(product_suffix, pol)
+        )
+
+
+def _get_gpt_ts(
+        list_of_files,
+        out_dir,
+        track,
+        ard_params,
+        pol,
+        product_suffix='TC',
+        extent=None,
+        to_db=False,
+        min=0.000001,
+        max=1,
+        no_data=0.0,
+        max_workers=None
+):
     with TemporaryDirectory() as temp_dir:
         # create namespaces
         temp_stack = opj(
@@ -214,8 +302,9 @@ def ard_to_ts(
                 extent=extent,
                 to_db=to_db,
                 out_dtype=ard_params['dtype_output'],
-                min=mm_dict[stretch]['min'],
-                max=mm_dict[stretch]['max']
+                min=min,
+                max=max,
+                max_workers=max_workers
             )
         else:
             outfiles = _get_regular_ts(
@@ -226,140 +315,259 @@ def ard_to_ts(
                 extent=extent,
                 to_db=to_db,
                 out_dtype=ard_params['dtype_output'],
-                min=mm_dict[stretch]['min'],
-                max=mm_dict[stretch]['max'],
-                no_data=no_data
+                min=min,
+                max=max,
+                no_data=no_data,
+                max_workers=max_workers
             )
-        with open(str(check_file), 'w') as file:
-            file.write('passed all tests \n')
-        # build vrt of timeseries
-        vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
-        gdal.BuildVRT(opj(out_dir, 'Timeseries.{}.{}.vrt'.format(product_suffix, pol)),
-                      outfiles,
-                      options=vrt_options
-                      )
+    return outfiles
 
 
-def _get_regular_ts(
-        in_stack,
+def _existing_ts(out_dir, product_suffix, polarization):
+    '''Files of an existing time-series by their date (YYYYMMDD)'''
+    return {
+        os.path.basename(file).split('.')[1]: file
+        for file in glob.glob(opj(
+            out_dir, '*.*.{}.{}.tif'.format(product_suffix, polarization)
+        ))
+    }
+
+
+def _renumber_ts(files):
+    '''Renames the files of a time-series to their new position
+
+    Args:
+        files: list of tuples of the current and the new file name
+    '''
+    moves = [(old, new) for old, new in files if old != new]
+    # via temporary names, since old and new names may overlap
+    for old, new in moves:
+        os.rename(old, '{}.renumber'.format(old))
+    for old, new in moves:
+        logger.debug('Renaming %s to %s', old, new)
+        os.rename('{}.renumber'.format(old), new)
+
+
+def _get_native_ts(
+        list_of_dims,
         out_dir,
         polarization,
         product_suffix='TC',
         extent=None,
+        mt_speckle_filter=True,
         to_db=False,
         out_dtype='float32',
         min=0.000001,
         max=1,
-        no_data=0.0
+        no_data=0.0,
+        append=False
 ):
-    # get the dates of the files
-    dates = [datetime.datetime.strptime(x.split('_')[-1][:-4], '%d%b%Y')
-             for x in glob.glob(opj('{}.data'.format(in_stack), '*img'))]
-    # sort them
-    dates.sort()
-    # write them back to string for following loop
-    sorted_date = [datetime.datetime.strftime(ts, "%d%b%Y")
-                   for ts in dates]
-
-    i, outfiles = 1, []
-    for date in sorted_date:
-        # restructure date to YYMMDD
-        in_date = datetime.datetime.strptime(date, '%d%b%Y')
-        out_date = datetime.datetime.strftime(in_date, '%Y%m%d')
-
-        infile = glob.glob(opj('{}.data'.format(in_stack),
-                               '*{}*{}*img'.format(polarization, date))
-                           )[0]
-        # create outfile
-        outfile = opj(
-            out_dir, '{}.{}.{}.{}.tif'.format(i, out_date, product_suffix, polarization)
+    # the band of the polarisation for every date, sorted by date
+    dates = []
+    for dim_file in list_of_dims:
+        infile = mt_speckle.ard_band(dim_file, polarization)
+        if infile is None:
+            logger.debug('No %s band in %s', polarization, dim_file)
+            continue
+        date = datetime.datetime.strftime(
+            mt_speckle.acquisition_date(dim_file), '%Y%m%d'
         )
-        logger.debug('Writing date %s to file %s', out_date, outfile)
+        dates.append((date, infile))
+    dates.sort()
 
-        ras.to_gtiff_clip_by_extend(
-            infile,
-            outfile,
-            extent,
+    # sum of ratios and number of dates of the filter for later appends
+    stats_file = opj(
+        out_dir, '.{}.{}.mt_stats.tif'.format(product_suffix, polarization)
+    )
+    existing = {}
+    if append:
+        existing = _existing_ts(out_dir, product_suffix, polarization)
+    if not existing and os.path.isfile(stats_file):
+        os.remove(stats_file)
+
+    # new position of all dates within the time-series
+    all_dates = sorted(set(existing) | set(date for date, _ in dates))
+    outfiles = {
+        date: opj(out_dir, '{}.{}.{}.{}.tif'.format(
+            i, date, product_suffix, polarization
+        ))
+        for i, date in enumerate(all_dates, start=1)
+    }
+
+    new_dates = [(date, infile) for date, infile in dates
+                 if date not in existing]
+    if existing and not new_dates:
+        logger.debug('No new dates for the %s time-series in %s',
+                     polarization, out_dir)
+        return [outfiles[date] for date in all_dates]
+
+    grid = None
+    if existing:
+        # new dates go onto the grid of the existing time-series
+        grid = existing[sorted(existing)[0]]
+        if mt_speckle_filter and not os.path.isfile(stats_file):
+            # the existing dates contribute to the filter of new ones
+            new_dates = [
+                (date, infile) for date, infile in dates if date in existing
+            ] + new_dates
+
+    logger.debug('Writing %s dates of the %s time-series to %s',
+                 len(new_dates), polarization, out_dir)
+
+    try:
+        mt_speckle.mt_speckle_to_gtiff(
+            [infile for _, infile in new_dates],
+            [None if date in existing else outfiles[date]
+             for date, _ in new_dates],
+            extent=extent,
+            apply_filter=mt_speckle_filter,
             to_db=to_db,
             out_dtype=out_dtype,
             min_value=min,
             max_value=max,
-            no_data=no_data
+            no_data=no_data,
+            grid=grid,
+            stats_file=stats_file
         )
-        if outfile is None or not os.path.isfile(outfile):
+    except Exception:
+        # leave the existing time-series as it was
+        for date, _ in new_dates:
+            if date not in existing and os.path.isfile(outfiles[date]):
+                os.remove(outfiles[date])
+        raise
+
+    # the existing dates move only now, so that they keep matching the
+    # VRT of the time-series if the filter fails
+    if existing:
+        _renumber_ts(
+            [(file, outfiles[date]) for date, file in existing.items()]
+        )
+    for date in all_dates:
+        if not os.path.isfile(outfiles[date]):
             raise RuntimeError(
-                'File %s was not created, something went wrong.', outfile
+                'File %s was not created, something went wrong.',
+                outfiles[date]
             )
-        # add ot a list for subsequent vrt creation
-        outfiles.append(outfile)
-        i += 1
 
-    return outfiles
+    return [outfiles[date] for date in all_dates]
 
 
-def _get_coh_ts(
+def _export_date(files, extent, export_args):
+    '''Clips and converts a single date of a stack to a GeoTIFF'''
+    infile, outfile = files
+    logger.debug('Writing %s to file %s', infile, outfile)
+    ras.to_gtiff_clip_by_extend(infile, outfile, extent, **export_args)
+    if not os.path.isfile(outfile):
+        raise RuntimeError(
+            'File %s was not created, something went wrong.', outfile
+        )
+    return outfile
+
+
+def _export_dates(files, extent, export_args, max_workers=None):
+    '''Exports the dates of a stack in parallel
+
+    Args:
+        files: list of tuples of input image and output GeoTIFF
+        extent: vector file of the common extent
+        export_args: keyword arguments of ras.to_gtiff_clip_by_extend
+        max_workers: number of processes (default: one per CPU)
+
+    Returns:
+        the list of GeoTIFFs, in the order of the files
+    '''
+    max_workers = max(1, min(max_workers or os.cpu_count(), len(files)))
+    # the processes share the memory budget
+    export_args = dict(
+        export_args, ram_budget=PROCESSING_RAM_BUDGET / max_workers
+    )
+
+    executor = Executor(executor='concurrent_processes',
+                        max_workers=max_workers)
+    for task in executor.as_completed(
+            func=_export_date,
+            iterable=files,
+            fargs=(extent, export_args)
+    ):
+        task.result()
+
+    return [outfile for _, outfile in files]
+
+
+def _get_regular_ts(
         in_stack,
         out_dir,
         polarization,
-        product_suffix='coh',
+        product_suffix='TC',
         extent=None,
         to_db=False,
         out_dtype='float32',
         min=0.000001,
-        max=1
+        max=1,
+        no_data=0.0,
+        max_workers=None
 ):
-    # get slave and master Date
-    master_dates = [datetime.datetime.strptime(
-        os.path.basename(x).split('_')[3].split('.')[0],
-        '%d%b%Y') for x in glob.glob(
-        opj('{}.data'.format(in_stack), '*img'))]
-
-    slaves_dates = [datetime.datetime.strptime(
-        os.path.basename(x).split('_')[4].split('.')[0],
-        '%d%b%Y') for x in glob.glob(
-        opj('{}.data'.format(in_stack), '*img'))]
-    # sort them
-    master_dates.sort()
-    slaves_dates.sort()
-    # write them back to string for following loop
-    sorted_master_dates = [datetime.datetime.strftime(
-        ts, "%d%b%Y") for ts in master_dates]
-    sorted_slave_dates = [datetime.datetime.strftime(
-        ts, "%d%b%Y") for ts in slaves_dates]
-
-    i, outfiles = 1, []
-    for mst, slv in zip(sorted_master_dates, sorted_slave_dates):
-        in_master = datetime.datetime.strptime(mst, '%d%b%Y')
-        in_slave = datetime.datetime.strptime(slv, '%d%b%Y')
-
-        out_master = datetime.datetime.strftime(in_master, '%Y%m%d')
-        out_slave = datetime.datetime.strftime(in_slave, '%Y%m%d')
-        infile = glob.glob(opj('{}.data'.format(in_stack),
-                               '*{}*{}_{}*img'.format(polarization, mst, slv)))[0]
-
-        outfile = opj(
-            out_dir,
-            '{}.{}.{}.{}.{}.tif'.format(i,
-                                        out_master,
-                                        out_slave,
-                                        product_suffix,
-                                        polarization
-                                        )
-        )
-        logger.debug('Writing to file %s', outfile)
-        ras.to_gtiff_clip_by_extend(
-            infile,
-            outfile,
-            extent,
-            to_db=to_db,
-            out_dtype=out_dtype,
-            min_value=min,
-            max_value=max,
-            no_data=0.0,
-            description=True
+    # map the dates to the files of the stack, all at once
+    images = {}
+    for image in sorted(glob.glob(opj('{}.data'.format(in_stack), '*img'))):
+        date = datetime.datetime.strptime(
+            os.path.basename(image).split('_')[-1][:-4], '%d%b%Y'
         )
-        # add ot a list for suBSequent vrt creation
-        outfiles.append(outfile)
-        i += 1
+        if polarization in os.path.basename(image):
+            images.setdefault(date, image)
+
+    files = [
+        (images[date], opj(out_dir, '{}.{}.{}.{}.tif'.format(
+            i, datetime.datetime.strftime(date, '%Y%m%d'),
+            product_suffix, polarization
+        )))
+        for i, date in enumerate(sorted(images), start=1)
+    ]
+
+    return _export_dates(
+        files, extent,
+        dict(to_db=to_db, out_dtype=out_dtype, min_value=min,
+             max_value=max, no_data=no_data),
+        max_workers
+    )
 
-    return outfiles
+
+def _get_coh_ts(
+        in_stack,
+        out_dir,
+        polarization,
+        product_suffix='coh',
+        extent=None,
+        to_db=False,
+        out_dtype='float32',
+        min=0.000001,
+        max=1,
+        max_workers=None
+):
+    # map the master and slave dates to the files of the stack, all at once
+    images = {}
+    for image in sorted(glob.glob(opj('{}.data'.format(in_stack), '*img'))):
+        master, slave = os.path.basename(image)[:-4].split('_')[3:5]
+        if polarization in os.path.basename(image):
+            images.setdefault((
+                datetime.datetime.strptime(master, '%d%b%Y'),
+                datetime.datetime.strptime(slave, '%d%b%Y')
+            ), image)
+
+    files = [
+        (images[(master, slave)], opj(out_dir, '{}.{}.{}.{}.{}.tif'.format(
+            i,
+            datetime.datetime.strftime(master, '%Y%m%d'),
+            datetime.datetime.strftime(slave, '%Y%m%d'),
+            product_suffix,
+            polarization
+        )))
+        for i, (master, slave) in enumerate(sorted(images), start=1)
+    ]
+
+    return _export_dates(
+        files, extent,
+        dict(to_db=to_db, out_dtype=out_dtype, min_value=min,
+             max_value=max, no_data=0.0, description=True),
+        max_workers
+    )
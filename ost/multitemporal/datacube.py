@@ -0,0 +1,276 @@
+'''
+Chunked datacubes of time-series.
+
+The per-date GeoTIFFs of a time-series are glued together by a VRT, so
+that every read of the time profiles of a block (e.g. for the timescan
+metrics) opens and seeks within the files of all dates. A datacube holds
+all dates of a time-series in a single Zarr store, chunked along the
+spatial axes only, i.e. every chunk contains the full time profile of a
+tile of the image and is read in one go.
+
+The store follows the conventions of xarray (dimension names in the
+_ARRAY_DIMENSIONS attributes, CF-like time units), so that it can be
+opened with xarray.open_zarr as well, with the dates as time coordinate
+and the pixel centres as x and y coordinates.
+'''
+
+import os
+import glob
+import shutil
+import logging
+import datetime
+from contextlib import ExitStack
+from re import findall
+
+import numpy as np
+import rasterio
+import zarr
+from affine import Affine
+from rasterio.crs import CRS
+
+from ost.helpers import raster as ras
+from ost.settings import PROCESSING_RAM_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# chunk size in pixels along the spatial axes, all dates are in a chunk
+CHUNK_SIZE = 256
+
+
+def layer_key(file):
+    '''Date (YYYYMMDD) of a time-series layer, taken from its file name
+
+    For coherence layers, this is the first of both dates.
+    '''
+    date = findall(r'\D(\d{8})\D', '.{}'.format(os.path.basename(file)))
+    return date[0] if date else os.path.basename(file)
+
+
+def datacube_file(timeseries_dir, product_suffix='TC', polarization='VV'):
+    '''Path of the datacube of a time-series directory'''
+    return os.path.join(
+        timeseries_dir,
+        'Timeseries.{}.{}.zarr'.format(product_suffix, polarization)
+    )
+
+
+def is_datacube(path):
+    return str(path).rstrip('/').endswith('.zarr')
+
+
+class Datacube():
+    '''Read access to a datacube, in the manner of a rasterio dataset
+
+    Provides the attributes and the read method of a rasterio dataset
+    that are needed by ost.helpers.raster.plan_windows and
+    process_blocks, so that a datacube can replace a stack of GeoTIFFs
+    (see ost.helpers.raster.open_raster).
+
+    Reads are thread-safe, i.e. several threads can share a Datacube.
+
+    Args:
+        path: path of the Zarr store
+    '''
+
+    def __init__(self, path):
+        self.name = str(path)
+        self._group = zarr.open_group(self.name, mode='r')
+        attrs = self._group.attrs.asdict()
+        self._data = self._group[attrs['variable']]
+
+        self.count, self.height, self.width = self._data.shape
+        self.indexes = list(range(1, self.count + 1))
+        self.dtypes = [str(self._data.dtype)] * self.count
+        self.block_shapes = [tuple(self._data.chunks[1:])] * self.count
+        self.dates = list(attrs['dates'])
+        self.descriptions = list(attrs['layers'])
+        self.nodata = attrs['nodata']
+        self.crs = CRS.from_wkt(attrs['crs']) if attrs['crs'] else None
+        self.transform = Affine(*attrs['transform'])
+
+    @property
+    def profile(self):
+        return {
+            'driver': 'Zarr', 'dtype': self.dtypes[0],
+            'nodata': self.nodata, 'width': self.width,
+            'height': self.height, 'count': self.count, 'crs': self.crs,
+            'transform': self.transform, 'tiled': True,
+            'blockysize': self.block_shapes[0][0],
+            'blockxsize': self.block_shapes[0][1]
+        }
+
+    def read(self, indexes=None, window=None):
+        '''Reads layers (1-based, as rasterio bands) within a window
+
+        Returns:
+            2D array for a single index, 3D array (layers, rows, cols)
+            otherwise
+        '''
+        if window is None:
+            rows, cols = slice(0, self.height), slice(0, self.width)
+        else:
+            rows, cols = window.toslices()
+
+        if indexes is None:
+            return self._data[:, rows, cols]
+        if isinstance(indexes, int):
+            return self._data[indexes - 1, rows, cols]
+        return self._data.get_orthogonal_selection(
+            (np.array(indexes) - 1, rows, cols)
+        )
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _time_coordinate(dates):
+    # days since the epoch, as understood by xarray
+    epoch = datetime.datetime(1970, 1, 1)
+    return np.array([
+        (datetime.datetime.strptime(date, '%Y%m%d') - epoch).days
+        if len(date) == 8 and date.isdigit() else -1
+        for date in dates
+    ], dtype='int32')
+
+
+def files_to_datacube(
+        files,
+        outfile,
+        variable='data',
+        chunk_size=CHUNK_SIZE,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Writes single band rasters on a common grid into a datacube
+
+    The datacube is written to a temporary store, which replaces an
+    existing one only once complete.
+
+    Args:
+        files: rasters of all dates, sorted by date
+        outfile: path of the Zarr store
+        variable: name of the data variable of the store
+        chunk_size: chunk size in pixels along the spatial axes
+        ram_budget: memory budget in MB for the block of all dates
+                    that is read at once
+    '''
+    if not files:
+        raise ValueError('No files for the datacube {}.'.format(outfile))
+
+    part = '{}.part'.format(outfile)
+    if os.path.isdir(part):
+        shutil.rmtree(part)
+
+    with ExitStack() as stack:
+        sources = [
+            stack.enter_context(rasterio.open(file)) for file in files
+        ]
+        src = sources[0]
+        for other in sources[1:]:
+            if (other.width, other.height, other.transform) != (
+                    src.width, src.height, src.transform
+            ):
+                raise ValueError(
+                    'The grid of {} differs from the grid of {}.'.format(
+                        other.name, src.name
+                    )
+                )
+
+        dates = [layer_key(file) for file in files]
+        group = zarr.open_group(part, mode='w')
+        data = group.create_dataset(
+            variable, shape=(len(files), src.height, src.width),
+            chunks=(len(files), chunk_size, chunk_size),
+            dtype=src.dtypes[0], fill_value=src.nodata
+        )
+        data.attrs['_ARRAY_DIMENSIONS'] = ['time', 'y', 'x']
+
+        time = group.create_dataset(
+            'time', data=_time_coordinate(dates), chunks=(len(files),)
+        )
+        time.attrs.update({'_ARRAY_DIMENSIONS': ['time'],
+                           'units': 'days since 1970-01-01',
+                           'calendar': 'proleptic_gregorian'})
+
+        # coordinates of the pixel centres
+        transform = src.transform
+        for name, size, scale, offset in [
+            ('y', src.height, transform.e, transform.f),
+            ('x', src.width, transform.a, transform.c)
+        ]:
+            coordinate = group.create_dataset(
+                name, data=offset + (np.arange(size) + 0.5) * scale,
+                chunks=(size,)
+            )
+            coordinate.attrs['_ARRAY_DIMENSIONS'] = [name]
+
+        group.attrs.update({
+            'variable': variable,
+            'dates': dates,
+            'layers': [os.path.basename(file)[:-4] for file in files],
+            'nodata': src.nodata,
+            'crs': src.crs.to_wkt() if src.crs else None,
+            'transform': list(transform)[:6]
+        })
+
+        # whole chunks of all dates at once
+        with Datacube(part) as cube:
+            windows = ras.plan_windows(
+                cube, ram_budget=ram_budget, overhead=2
+            )
+        for window in windows:
+            rows, cols = window.toslices()
+            data[:, rows, cols] = np.stack([
+                source.read(1, window=window) for source in sources
+            ])
+
+    if os.path.isdir(outfile):
+        shutil.rmtree(outfile)
+    os.replace(part, outfile)
+    logger.debug('Wrote datacube %s of %s dates.', outfile, len(files))
+
+
+def timeseries_to_datacube(
+        timeseries_dir,
+        product_suffix='TC',
+        polarization='VV',
+        outfile=None,
+        chunk_size=CHUNK_SIZE,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Converts the time-series of a Timeseries directory to a datacube
+
+    Args:
+        timeseries_dir: Timeseries directory of a track or burst
+        product_suffix: product of the time-series (e.g. TC or coh)
+        polarization: polarisation (or polarimetric band) of the
+                      time-series
+        outfile: path of the Zarr store (default:
+                 Timeseries.{product_suffix}.{polarization}.zarr
+                 within the timeseries_dir)
+        chunk_size: chunk size in pixels along the spatial axes
+        ram_budget: memory budget in MB
+
+    Returns:
+        path of the datacube
+    '''
+    files = sorted(
+        glob.glob(os.path.join(timeseries_dir, '*.{}.{}.tif'.format(
+            product_suffix, polarization
+        ))),
+        key=lambda file: int(os.path.basename(file).split('.')[0])
+    )
+    outfile = outfile or datacube_file(
+        timeseries_dir, product_suffix, polarization
+    )
+    files_to_datacube(
+        files, outfile,
+        variable='{}_{}'.format(product_suffix, polarization),
+        chunk_size=chunk_size, ram_budget=ram_budget
+    )
+    return outfile
@@ -0,0 +1,349 @@
+'''
+Multi-temporal speckle filtering of ARD time-series in numpy.
+
+Instead of stacking all dates with GPT into one BEAM-DIMAP product,
+filtering that stack with GPT's Multi-Temporal-Speckle-Filter and finally
+exporting every band of the filtered stack, the per-date ARD rasters are
+read block-wise onto a common grid, filtered in memory and written as
+per-date GeoTIFFs directly.
+
+The filter follows Quegan & Yu (2001): every date is replaced by its
+local mean times the average ratio of all dates to their local means,
+i.e. the speckle is reduced by the number of dates while the spatial
+resolution is largely preserved. The local means are estimated within a
+boxcar of filter_x_size x filter_y_size pixels.
+'''
+
+import os
+import glob
+import logging
+import datetime
+from contextlib import ExitStack
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from ost.helpers import raster as ras
+from ost.config.speckle_config import DEFAULT_MT_SPECKLE_DICT
+from ost.settings import PROCESSING_RAM_BUDGET
+
+logger = logging.getLogger(__name__)
+
+
+def acquisition_date(dim_file):
+    '''Acquisition date of a BEAM-DIMAP ARD product
+
+    Taken from the product's metadata, and from the YYYYMMDD prefix of
+    the file name if the metadata do not contain the start time.
+    '''
+    try:
+        start = ET.parse(dim_file).getroot().findtext(
+            './/PRODUCT_SCENE_RASTER_START_TIME'
+        )
+        return datetime.datetime.strptime(start.split()[0], '%d-%b-%Y')
+    except (ET.ParseError, OSError, AttributeError, ValueError):
+        return datetime.datetime.strptime(
+            os.path.basename(dim_file)[:8], '%Y%m%d'
+        )
+
+
+def ard_band(dim_file, band):
+    '''ENVI image of a polarisation or polarimetric band of an ARD product
+
+    Returns:
+        path to the .img file or None, if the product lacks the band
+    '''
+    data_dir = '{}.data'.format(dim_file[:-4])
+    if band in ['Alpha', 'Anisotropy', 'Entropy']:
+        pattern = '{}*.img'.format(band)
+    else:
+        pattern = '*ma0*{}*.img'.format(band)
+
+    images = sorted(glob.glob(os.path.join(data_dir, pattern)))
+    return images[0] if images else None
+
+
+def _box_sum(array, size_y, size_x):
+    '''Sums within a moving window over the last two axes
+
+    Only windows that lie fully within the array are summed up, i.e. the
+    result is smaller by size - 1 along both axes.
+    '''
+    summed = np.cumsum(np.cumsum(array, axis=-2, dtype='float64'), axis=-1)
+    summed = np.pad(
+        summed, [(0, 0)] * (array.ndim - 2) + [(1, 0), (1, 0)],
+        mode='constant'
+    )
+    return (
+        summed[..., size_y:, size_x:] - summed[..., :-size_y, size_x:]
+        - summed[..., size_y:, :-size_x] + summed[..., :-size_y, :-size_x]
+    )
+
+
+def _quegan_ratios(stack, size_y, size_x, no_data):
+    '''Local means and ratios of all dates to their local means'''
+    if not size_y % 2 or not size_x % 2:
+        raise ValueError('The filter window needs an odd size.')
+    halo_y, halo_x = size_y // 2, size_x // 2
+    rows, cols = stack.shape[-2:]
+
+    valid = (stack != no_data) & np.isfinite(stack)
+    values = np.where(valid, stack, 0)
+
+    # local means of the valid pixels
+    counts = _box_sum(valid, size_y, size_x)
+    means = np.divide(
+        _box_sum(values, size_y, size_x), counts,
+        out=np.zeros(counts.shape), where=counts > 0
+    )
+
+    # ratios of the valid dates to their local means
+    core = values[:, halo_y:rows - halo_y, halo_x:cols - halo_x]
+    core_valid = valid[:, halo_y:rows - halo_y, halo_x:cols - halo_x]
+    ratios = np.divide(
+        core, means, out=np.zeros(means.shape),
+        where=core_valid & (means > 0)
+    )
+    return means, core_valid, ratios
+
+
+def _apply_ratios(means, valid, ratio_sum, dates, no_data):
+    '''Local means times the average ratio of all dates'''
+    avg_ratio = np.divide(
+        ratio_sum, dates, out=np.zeros(ratio_sum.shape), where=dates > 0
+    )
+    filtered = means * avg_ratio
+    filtered[~valid] = no_data
+    return filtered.astype('float32')
+
+
+def quegan_filter(stack, size_y=3, size_x=3, no_data=0.0):
+    '''Quegan multi-temporal speckle filter of a block of a time-series
+
+    No data pixels are neither part of the local means nor of the
+    average ratio, so that dates with a smaller coverage do not darken
+    the others.
+
+    Args:
+        stack: 3D array (dates, rows, cols), that includes an overlap of
+               size // 2 pixels on each side (filled with no_data
+               outside of the image)
+        size_y: number of rows of the local mean window (odd)
+        size_x: number of columns of the local mean window (odd)
+        no_data: no data value of the stack
+
+    Returns:
+        filtered float32 array (dates, rows - size_y + 1,
+        cols - size_x + 1), i.e. without the overlap
+    '''
+    means, valid, ratios = _quegan_ratios(stack, size_y, size_x, no_data)
+    return _apply_ratios(
+        means, valid, ratios.sum(axis=0), valid.sum(axis=0), no_data
+    )
+
+
+def _read_with_halo(src, window, halo_y, halo_x, no_data):
+    # the window including its overlap
+    row_start = max(window.row_off - halo_y, 0)
+    col_start = max(window.col_off - halo_x, 0)
+    row_stop = min(window.row_off + window.height + halo_y, src.height)
+    col_stop = min(window.col_off + window.width + halo_x, src.width)
+    array = src.read(1, window=Window(
+        col_start, row_start, col_stop - col_start, row_stop - row_start
+    )).astype('float32')
+
+    # outside of the grid there is no data
+    pad = (
+        (halo_y - (window.row_off - row_start),
+         halo_y - (row_stop - window.row_off - window.height)),
+        (halo_x - (window.col_off - col_start),
+         halo_x - (col_stop - window.col_off - window.width))
+    )
+    return np.pad(array, pad, mode='constant', constant_values=no_data)
+
+
+def _common_grid(infile, extent, grid=None):
+    '''Grid of the first date cropped to the extent, or of a given raster'''
+    features = ras.read_features(extent)
+    if grid:
+        with rasterio.open(grid) as src:
+            return src.crs, src.transform, src.width, src.height, features
+
+    with rasterio.open(infile) as src:
+        if features:
+            window = geometry_window(src, features)
+        else:
+            window = Window(0, 0, src.width, src.height)
+
+        window = Window(int(window.col_off), int(window.row_off),
+                        int(window.width), int(window.height))
+        return (src.crs, src.window_transform(window), int(window.width),
+                int(window.height), features)
+
+
+def mt_speckle_to_gtiff(
+        infiles,
+        outfiles,
+        extent=None,
+        speckle_dict=None,
+        apply_filter=True,
+        to_db=False,
+        out_dtype='float32',
+        min_value=0.000001,
+        max_value=1,
+        no_data=0.0,
+        grid=None,
+        stats_file=None,
+        ram_budget=PROCESSING_RAM_BUDGET
+):
+    '''Filters a time-series block-wise and writes the per-date GeoTIFFs
+
+    All dates are read onto the grid of the first date (bilinear
+    resampling, as for GPT's stacking), cropped to and masked by the
+    extent. The blocks are read with an overlap of half the filter
+    window, so that the result is the same as for the full images in
+    memory.
+
+    The per-pixel sum of the ratios and the number of dates can be kept
+    in a stats_file. If it exists, the filter includes the dates of
+    the previous runs, so that new dates can be appended to a
+    time-series without reading the already filtered dates again.
+
+    Args:
+        infiles: per-date rasters (e.g. the .img files of the ARD
+                 products), sorted by date
+        outfiles: per-date output GeoTIFFs, None for dates that only
+                  contribute to the filter of the others
+        extent: vector file of the common extent of the time-series
+        speckle_dict: filter parameters, of which filter_x_size and
+                      filter_y_size define the local mean window
+                      (default: DEFAULT_MT_SPECKLE_DICT)
+        apply_filter: if False, the dates are exported without filtering
+        to_db: convert the filtered backscatter to dB
+        out_dtype: datatype of the GeoTIFFs (float32, uint16 or uint8)
+        min_value: minimum value for scaling to integers
+        max_value: maximum value for scaling to integers
+        no_data: no data value of the in- and outputs
+        grid: raster defining the output grid (default: the grid of
+              the first date, cropped to the extent)
+        stats_file: GeoTIFF of the sum of ratios and number of dates
+                    of the filter, read if it exists and updated
+        ram_budget: memory budget in MB for a single block of all dates
+    '''
+    if len(infiles) != len(outfiles):
+        raise ValueError('Need one output file per input file.')
+
+    speckle_dict = speckle_dict or DEFAULT_MT_SPECKLE_DICT
+    if apply_filter:
+        size_y = int(speckle_dict['filter_y_size'])
+        size_x = int(speckle_dict['filter_x_size'])
+    else:
+        size_y, size_x = 1, 1
+    halo_y, halo_x = size_y // 2, size_x // 2
+
+    crs, transform, width, height, features = _common_grid(
+        infiles[0], extent, grid
+    )
+    # the extent is rasterized once for all blocks
+    inside = None
+    if features:
+        inside = geometry_mask(features, out_shape=(height, width),
+                               transform=transform, invert=True)
+
+    meta = {'count': 1, 'dtype': out_dtype, 'crs': crs,
+            'transform': transform, 'width': width, 'height': height,
+            'nodata': no_data}
+    meta.update(ras.gtiff_profile(out_dtype, width, height))
+
+    with ExitStack() as stack:
+        sources = [
+            stack.enter_context(WarpedVRT(
+                stack.enter_context(rasterio.open(infile)),
+                crs=crs, transform=transform, width=width, height=height,
+                resampling=Resampling.bilinear,
+                src_nodata=no_data, nodata=no_data
+            ))
+            for infile in infiles
+        ]
+        dsts = [
+            stack.enter_context(rasterio.open(outfile, 'w', **meta))
+            if outfile else None for outfile in outfiles
+        ]
+
+        stats, prior = None, False
+        if apply_filter and stats_file:
+            prior = os.path.isfile(stats_file)
+            stats = stack.enter_context(
+                rasterio.open(stats_file, 'r+') if prior else
+                rasterio.open(stats_file, 'w', **dict(
+                    meta, count=2, dtype='float32', nodata=None,
+                    **ras.gtiff_profile('float32', width, height)
+                ))
+            )
+
+        for window in ras.plan_windows(
+                sources[0], ram_budget=ram_budget, count=len(infiles),
+                dtype='float32', overhead=6
+        ):
+            block = np.stack([
+                _read_with_halo(src, window, halo_y, halo_x, no_data)
+                for src in sources
+            ])
+            if apply_filter:
+                means, block_valid, ratios = _quegan_ratios(
+                    block, size_y, size_x, no_data
+                )
+                ratio_sum = ratios.sum(axis=0)
+                dates = block_valid.sum(axis=0).astype('float64')
+                if prior:
+                    previous = stats.read(window=window)
+                    ratio_sum += previous[0]
+                    dates += previous[1]
+                if stats is not None:
+                    stats.write(
+                        np.stack([ratio_sum, dates]).astype('float32'),
+                        window=window
+                    )
+                block = _apply_ratios(
+                    means, block_valid, ratio_sum, dates, no_data
+                )
+
+            valid = block != no_data
+            if inside is not None:
+                valid &= inside[
+                    window.row_off:window.row_off + window.height,
+                    window.col_off:window.col_off + window.width
+                ]
+
+            for array, mask, dst in zip(block, valid, dsts):
+                if dst is None:
+                    continue
+                if to_db:
+                    array = ras.convert_to_db(array)
+                if out_dtype in ['uint8', 'uint16']:
+                    array = ras.scale_to_int(
+                        array, min_value, max_value, out_dtype
+                    )
+                dst.write(
+                    np.where(mask, array, no_data).astype(out_dtype),
+                    window=window, indexes=1
+                )
+
+        for outfile, dst in zip(outfiles, dsts):
+            if dst is None:
+                continue
+            name = os.path.basename(outfile)[:-4]
+            dst.update_tags(1, BAND_NAME=name)
+            dst.set_band_description(1, name)
+
+    for outfile in outfiles:
+        if outfile:
+            ras.finalize_gtiff(outfile)
+
+    logger.debug('Wrote %s filtered dates of the time-series.',
+                 len([outfile for outfile in outfiles if outfile]))
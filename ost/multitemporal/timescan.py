@@ -3,7 +3,9 @@ import shutil
 import numpy as np
 import logging
 import itertools
+from re import findall
 from os.path import join as opj
+from xml.etree import ElementTree as ET
 from scipy import stats
 
 from datetime import datetime
@@ -14,6 +16,8 @@ import rasterio
 import gdal
 
 from ost.helpers import raster as ras
+from ost.multitemporal import datacube
+from ost.settings import PROCESSING_RAM_BUDGET
 
 logger = logging.getLogger(__name__)
 
@@ -136,6 +140,485 @@ def nan_percentile(arr, q):
     return result
 
 
+def _take_along_time(sorted_stack, index):
+    """Pick one layer per pixel out of a time-sorted 3D stack"""
+    return np.take_along_axis(sorted_stack, index[np.newaxis], axis=0)[0]
+
+
+def _sorted_percentile(sorted_stack, valid_obs, q):
+    """Linear-interpolated percentile from an already sorted stack
+
+    NaNs have to be sorted to the end of the time axis (as np.sort does),
+    so that the first valid_obs layers of each pixel hold its valid values.
+    Pixels without any valid observation are returned as NaN.
+    """
+    k_arr = (valid_obs - 1) * (q / 100.0)
+    f_arr = np.clip(np.floor(k_arr), 0, None).astype(np.intp)
+    c_arr = np.clip(np.ceil(k_arr), 0, None).astype(np.intp)
+
+    floor_val = _take_along_time(sorted_stack, f_arr)
+    ceil_val = _take_along_time(sorted_stack, c_arr)
+    quant_arr = np.where(
+        f_arr == c_arr,
+        floor_val,
+        floor_val * (c_arr - k_arr) + ceil_val * (k_arr - f_arr)
+    )
+    quant_arr[valid_obs == 0] = np.nan
+    return quant_arr
+
+
+def _welford_moments(stack):
+    """Mean, population std and non-zero count in one pass over the layers
+
+    Uses Welford's online update so that we never hold more than a
+    couple of 2D accumulators next to the stack, independent of the
+    number of layers. NaNs are ignored for mean and std, while the count
+    follows np.count_nonzero, i.e. every value different from 0.
+    """
+    shape = stack.shape[1:]
+    valid_obs = np.zeros(shape, dtype=np.float64)
+    nonzero = np.zeros(shape, dtype=np.int64)
+    mean = np.zeros(shape, dtype=np.float64)
+    m2 = np.zeros(shape, dtype=np.float64)
+
+    for layer in stack:
+        valid = np.isfinite(layer)
+        nonzero += layer != 0
+        valid_obs += valid
+        delta = np.where(valid, layer - mean, 0)
+        mean += np.divide(delta, valid_obs, out=np.zeros(shape),
+                          where=valid_obs > 0)
+        m2 += delta * np.where(valid, layer - mean, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean[valid_obs == 0] = np.nan
+        std = np.sqrt(m2 / valid_obs)
+    return mean, std, nonzero
+
+
+def calc_metrics(stack, metrics):
+    """Calculate all requested timescan metrics of a 3D block at once
+
+    The stack is sorted only once along the time axis and all order
+    statistics (min, max, median and percentiles) are derived from that
+    sorted view, while avg, std, cov and count come out of a single
+    streaming pass (see _welford_moments).
+
+    :param stack: 3D array (time, rows, cols), NaN marks missing values
+    :param metrics: list of metric names (e.g. avg, std, p95)
+    :return: dictionary of 2D float arrays per requested metric
+    """
+    arr = {}
+    order_metrics = [metric for metric in metrics
+                     if metric in ['min', 'max', 'median', 'p95', 'p5']]
+    moment_metrics = [metric for metric in metrics
+                      if metric in ['avg', 'std', 'cov', 'count']]
+
+    if order_metrics:
+        # NaNs are sorted to the end of the time axis
+        sorted_stack = np.sort(stack, axis=0)
+        valid_obs = np.sum(np.isfinite(sorted_stack), axis=0)
+        percentiles = {'min': 0, 'median': 50, 'max': 100,
+                       'p95': 95, 'p5': 5}
+        for metric in order_metrics:
+            arr[metric] = np.nan_to_num(
+                _sorted_percentile(
+                    sorted_stack, valid_obs, percentiles[metric]
+                )
+            )
+        del sorted_stack
+
+    if moment_metrics:
+        mean, std, nonzero = _welford_moments(stack)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moments = {
+                'avg': mean,
+                'std': std,
+                'cov': std / mean,
+                'count': nonzero
+            }
+        for metric in moment_metrics:
+            arr[metric] = np.nan_to_num(moments[metric])
+
+    return arr
+
+
+# scaling factors in case we have to rescale to integer
+METRIC_MINIMUMS = {'avg': -30,
+                   'max': -30,
+                   'min': -30,
+                   'median': -30,
+                   'p95': -30,
+                   'p5': -30,
+                   'std': 0.00001,
+                   'cov': 0.00001,
+                   'count': 0
+                   }
+METRIC_MAXIMUMS = {'avg': 5,
+                   'max': 5,
+                   'min': 5,
+                   'median': 5,
+                   'p95': 5,
+                   'p5': 5,
+                   'std': 15,
+                   'cov': 1,
+                   'count': 64000
+                   }
+
+
+def _prepare_block(
+        stack,
+        dtype,
+        rescale_to_datatype=False,
+        to_power=False,
+        outlier_removal=False
+):
+    """Bring a block of the time-series stack into the metrics' domain"""
+
+    if rescale_to_datatype is True and dtype != 'float32':
+        stack = ras.rescale_to_float(stack, dtype)
+
+    # transform to power
+    if to_power is True:
+        stack = ras.convert_to_power(stack)
+
+    # outlier removal (only applies if there are more than 5 bands)
+    if outlier_removal is True and stack.shape[0] >= 5:
+        stack = remove_outliers(stack)
+
+    # masked values (e.g. from outlier removal) become NaN
+    if isinstance(stack, np.ma.MaskedArray):
+        stack = stack.astype(np.float32).filled(np.nan)
+    return stack
+
+
+def _finalize_metrics(
+        arr,
+        metrics,
+        dtype,
+        rescale_to_datatype=False,
+        to_power=False
+):
+    """Bring the metrics of a block back into the output domain"""
+
+    # the metrics to be re-turned to dB, in case to_power is True
+    metrics_to_convert = ['avg', 'min', 'max', 'p95', 'p5', 'median']
+
+    # do the back conversions
+    for metric in metrics:
+        if to_power is True and metric in metrics_to_convert:
+            arr[metric] = ras.convert_to_db(arr[metric])
+
+        if rescale_to_datatype is True and dtype != 'float32':
+            arr[metric] = ras.scale_to_int(
+                arr[metric],
+                METRIC_MINIMUMS[metric],
+                METRIC_MAXIMUMS[metric],
+                dtype
+            )
+        arr[metric] = np.float32(arr[metric])
+    return arr
+
+
+def _metrics_block(
+        stack,
+        metrics,
+        dtype,
+        rescale_to_datatype=False,
+        to_power=False,
+        outlier_removal=False,
+        design_matrix=None
+):
+    """Turn one block of the time-series stack into the output metrics"""
+
+    stack = _prepare_block(
+        stack, dtype, rescale_to_datatype, to_power, outlier_removal
+    )
+
+    # get stats
+    arr = calc_metrics(stack, metrics)
+
+    if design_matrix is not None:
+        stack_size = (stack.shape[1], stack.shape[2])
+        if to_power is True:
+            y = ras.convert_to_db(stack).reshape(stack.shape[0], -1)
+        else:
+            y = stack.reshape(stack.shape[0], -1)
+
+        coeffs, residuals, _, _ = np.linalg.lstsq(
+            design_matrix.T, y, rcond=None
+        )
+        arr['amplitude'] = np.hypot(coeffs[1], coeffs[2]).reshape(stack_size)
+        arr['phase'] = np.arctan2(coeffs[2], coeffs[1]).reshape(stack_size)
+        arr['residuals'] = np.sqrt(
+            np.divide(residuals, stack.shape[0])
+        ).reshape(stack_size)
+
+    return _finalize_metrics(
+        arr, metrics, dtype, rescale_to_datatype, to_power
+    )
+
+
+# per-pixel sufficient statistics of incremental timescans
+STATS_BANDS = ['n', 'sum', 'sumsq', 'min', 'max', 'nonzero']
+
+# bins of the per-pixel histograms (quantile sketches), and their range
+# per product: backscatter is binned in dB of its linear values, the
+# other products on their own linear scale
+SKETCH_BINS = 32
+SKETCH_RANGES = {
+    'bs': (-35., 10., 'dB'),
+    'coh': (0., 1., 'linear'),
+    'Alpha': (0., 90., 'linear'),
+    'Entropy': (0., 1., 'linear'),
+    'Anisotropy': (0., 1., 'linear')
+}
+
+ORDER_METRICS = {'median': 50, 'p95': 95, 'p5': 5}
+
+
+def _sketch_bins(stack, product='bs'):
+    """Histogram bin of every value (see SKETCH_RANGES)"""
+    low, high, scale = SKETCH_RANGES[product]
+    if scale == 'dB':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stack = 10 * np.log10(stack)
+    bins = np.floor((stack - low) / (high - low) * SKETCH_BINS)
+    return np.clip(np.nan_to_num(bins, nan=0, neginf=0), 0, SKETCH_BINS - 1)
+
+
+def _stats_block(
+        stack,
+        dtype,
+        rescale_to_datatype=False,
+        to_power=False,
+        sketch=False,
+        product='bs'
+):
+    """Sufficient statistics (and quantile sketch) of a block"""
+    stack = _prepare_block(stack, dtype, rescale_to_datatype, to_power)
+    valid = np.isfinite(stack)
+    values = np.where(valid, stack, 0).astype(np.float64)
+
+    stats = np.stack([
+        valid.sum(axis=0),
+        values.sum(axis=0),
+        (values ** 2).sum(axis=0),
+        np.where(valid, stack, np.inf).min(axis=0),
+        np.where(valid, stack, -np.inf).max(axis=0),
+        (stack != 0).sum(axis=0)
+    ]).astype(np.float64)
+
+    hist = None
+    if sketch:
+        bins = _sketch_bins(stack, product)
+        hist = np.stack([
+            ((bins == b) & valid).sum(axis=0) for b in range(SKETCH_BINS)
+        ]).astype(np.uint16)
+    return stats, hist
+
+
+def merge_stats(stats, other):
+    """Combines the statistics of two sets of layers of the same pixels"""
+    merged = stats + other
+    merged[3] = np.minimum(stats[3], other[3])
+    merged[4] = np.maximum(stats[4], other[4])
+    return merged
+
+
+def _sketch_order_statistic(hist, cumulative, rank, product='bs'):
+    """Approximate k-th smallest value (0-based) from the histograms"""
+    index = np.minimum((cumulative <= rank).sum(axis=0), SKETCH_BINS - 1)
+    before = np.where(
+        index > 0,
+        _take_along_time(cumulative, np.maximum(index - 1, 0)), 0
+    )
+    count = _take_along_time(hist, index)
+    # the values are assumed to be spread evenly within their bin
+    fraction = np.clip((rank - before + 0.5) / np.maximum(count, 1), 0, 1)
+
+    low, high, scale = SKETCH_RANGES[product]
+    value = low + (index + fraction) * (high - low) / SKETCH_BINS
+    return 10 ** (value / 10) if scale == 'dB' else value
+
+
+def _sketch_percentile(hist, stats, q, product='bs'):
+    """Approximate percentile from the histogram of each pixel
+
+    As for the exact percentiles, the value is linearly interpolated
+    between the two closest order statistics.
+    """
+    n = stats[0]
+    k_arr = np.clip((n - 1) * (q / 100.0), 0, None)
+    f_arr, c_arr = np.floor(k_arr), np.ceil(k_arr)
+
+    cumulative = np.cumsum(hist, axis=0)
+    floor_val = _sketch_order_statistic(hist, cumulative, f_arr, product)
+    ceil_val = _sketch_order_statistic(hist, cumulative, c_arr, product)
+    value = floor_val * (1 - (k_arr - f_arr)) + ceil_val * (k_arr - f_arr)
+
+    # the exact extremes bound the approximation
+    value = np.clip(value, stats[3], stats[4])
+    value[n == 0] = np.nan
+    return value
+
+
+def metrics_from_stats(stats, metrics, hist=None, product='bs'):
+    """Timescan metrics from sufficient statistics
+
+    avg, std, cov, count, min and max are exact, the percentiles
+    (median, p5 and p95) are approximated from the quantile sketch.
+
+    :param stats: 3D array of the statistics (see STATS_BANDS)
+    :param metrics: list of metric names
+    :param hist: 3D array of per-pixel histograms (see SKETCH_BINS)
+    :param product: product of the stack, for the range of the histograms
+                    (see SKETCH_RANGES)
+    :return: dictionary of 2D float arrays per requested metric
+    """
+    n, total, sumsq, minimum, maximum, nonzero = stats
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        std = np.sqrt(np.clip(sumsq / n - mean ** 2, 0, None))
+        moments = {
+            'avg': mean,
+            'std': std,
+            'cov': std / mean,
+            'count': nonzero,
+            'min': np.where(n > 0, minimum, np.nan),
+            'max': np.where(n > 0, maximum, np.nan)
+        }
+
+    arr = {}
+    for metric in metrics:
+        if metric in ORDER_METRICS:
+            value = _sketch_percentile(
+                hist, stats, ORDER_METRICS[metric], product
+            )
+        else:
+            value = moments[metric]
+        arr[metric] = np.nan_to_num(value)
+    return arr
+
+
+def _layer_keys(stack):
+    """Keys of the layers of a stack, i.e. the dates of a time-series"""
+    if stack.endswith('.vrt'):
+        root = ET.parse(stack).getroot()
+        keys = []
+        for band in root.findall('VRTRasterBand'):
+            source = os.path.basename(band.findtext('.//SourceFilename'))
+            date = findall(r'\D(\d{8})\D', '.{}'.format(source))
+            keys.append(date[0] if date else source)
+        return keys
+
+    with ras.open_raster(stack) as src:
+        if isinstance(src, datacube.Datacube):
+            return src.dates
+        return [str(index) for index in src.indexes]
+
+
+def _incremental_metrics(
+        stack,
+        out_prefix,
+        metrics,
+        metric_dict,
+        rescale_to_datatype=False,
+        to_power=False,
+        max_workers=os.cpu_count(),
+        product='bs'
+):
+    """Update the persisted statistics with the new layers of a stack
+
+    The statistics are kept next to the metrics, in hidden files named
+    after the out_prefix (.stats.tif and .sketch.tif), together with the
+    keys of the layers they include.
+    """
+    dirname, basename = os.path.split(out_prefix)
+    stats_file = opj(dirname, '.{}.stats.tif'.format(basename))
+    sketch_file = opj(dirname, '.{}.sketch.tif'.format(basename))
+    sketch = any(metric in ORDER_METRICS for metric in metrics)
+
+    keys = _layer_keys(stack)
+    known = []
+    if os.path.isfile(stats_file) and (
+            not sketch or os.path.isfile(sketch_file)
+    ):
+        with rasterio.open(stats_file) as src:
+            known = src.tags().get('LAYERS', '').split(',')
+
+    if set(known) - set(keys):
+        # layers have been removed, so we start over
+        known = []
+    new = [index for index, key in enumerate(keys, start=1)
+           if key not in known]
+    logger.debug('Updating timescan statistics of %s with %s new layers',
+                 out_prefix, len(new))
+
+    with ras.open_raster(stack) as src:
+        meta, dtype = src.profile, src.dtypes[0]
+        windows = ras.plan_windows(
+            src, ram_budget=PROCESSING_RAM_BUDGET / (2 * max_workers),
+            count=max(len(new), 1) + 3 * len(STATS_BANDS) + 2 * SKETCH_BINS
+        )
+
+    # the updated statistics replace the previous ones only once complete
+    files, previous = {}, {}
+    meta.update(dtype='float64', nodata=None, count=len(STATS_BANDS))
+    meta.update(ras.gtiff_profile('float64', meta['width'], meta['height']))
+    files[stats_file] = rasterio.open(
+        '{}.part'.format(stats_file), 'w', **meta
+    )
+    if sketch:
+        meta.update(dtype='uint16', count=SKETCH_BINS)
+        meta.update(ras.gtiff_profile(
+            'uint16', meta['width'], meta['height']
+        ))
+        files[sketch_file] = rasterio.open(
+            '{}.part'.format(sketch_file), 'w', **meta
+        )
+    if known:
+        previous = {file: rasterio.open(file) for file in files}
+
+    if new:
+        blocks = ras.process_blocks(
+            stack, _stats_block, windows=windows,
+            fargs=(dtype, rescale_to_datatype, to_power, sketch, product),
+            max_workers=max_workers, indexes=new
+        )
+    else:
+        blocks = ((window, (None, None)) for window in windows)
+
+    try:
+        for window, (block_stats, hist) in blocks:
+            if known:
+                old = previous[stats_file].read(window=window)
+                block_stats = old if block_stats is None else \
+                    merge_stats(old, block_stats)
+                if sketch:
+                    old = previous[sketch_file].read(window=window)
+                    hist = old if hist is None else old + hist
+            files[stats_file].write(block_stats, window=window)
+            if sketch:
+                files[sketch_file].write(hist, window=window)
+
+            arr = _finalize_metrics(
+                metrics_from_stats(block_stats, metrics, hist, product),
+                metrics, dtype, rescale_to_datatype, to_power
+            )
+            for metric in metrics:
+                metric_dict[metric].write(
+                    arr[metric], window=window, indexes=1
+                )
+        files[stats_file].update_tags(LAYERS=','.join(keys))
+    finally:
+        for file in list(files.values()) + list(previous.values()):
+            file.close()
+
+    for file in files:
+        os.replace('{}.part'.format(file), file)
+
+
 def mt_metrics(
         stack,
         out_prefix,
@@ -143,155 +626,125 @@ def mt_metrics(
         rescale_to_datatype=False,
         to_power=False,
         outlier_removal=False,
-        datelist=None
+        datelist=None,
+        max_workers=os.cpu_count(),
+        incremental=False,
+        product='bs'
 ):
-    # from datetime import datetime
-    with rasterio.open(stack) as src:
-        harmonics = False
-        if 'harmonics' in metrics:
-            logger.debug('INFO: Calculating harmonics')
-            if not datelist:
-                logger.debug(
-                    'WARNING: Harmonics need the datelist. '
-                    'Harmonics will not be calculated'
-                )
-            else:
-                harmonics = True
-                metrics.remove('harmonics')
-                metrics.extend(['amplitude', 'phase', 'residuals'])
+    """Calculate the timescan metrics of a time-series stack
+
+    Blocks are processed in parallel by max_workers threads (see
+    ost.helpers.raster.process_blocks) and written in block order.
+    The stack is either a multi-band raster (e.g. the vrt of a
+    time-series) or a datacube (see ost.multitemporal.datacube), of
+    which the blocks are read as whole chunks of all dates.
+
+    With incremental, the per-pixel sufficient statistics of the stack
+    are persisted next to the metrics, so that later runs only read the
+    layers added to the stack in the meantime. Percentiles are then
+    approximated from a per-pixel histogram. Harmonics and outlier
+    removal need the full stack and are not calculated incrementally.
+    The histogram range depends on the product of the stack, one of the
+    keys of SKETCH_RANGES (e.g. 'bs' for backscatter or 'coh').
+    """
+    harmonics = False
+    if 'harmonics' in metrics:
+        logger.debug('INFO: Calculating harmonics')
+        if not datelist:
+            logger.debug(
+                'WARNING: Harmonics need the datelist. '
+                'Harmonics will not be calculated'
+            )
+        else:
+            harmonics = True
+            metrics.remove('harmonics')
+            metrics.extend(['amplitude', 'phase', 'residuals'])
+
+    if 'percentiles' in metrics:
+        metrics.remove('percentiles')
+        metrics.extend(['p95', 'p5'])
+
+    design_matrix = None
+    if harmonics:
+        # construct independent variables
+        dates, sines, cosines = [], [], []
+        two_pi = np.multiply(2, np.pi)
+        for date in sorted(datelist):
+
+            delta = difference_in_years(
+                datetime.strptime('700101', "%y%m%d"),
+                datetime.strptime(date, "%y%m%d")
+            )
+            dates.append(delta)
+            sines.append(np.sin(np.multiply(two_pi, delta - 0.5)))
+            cosines.append(np.cos(np.multiply(two_pi, delta - 0.5)))
 
-        if 'percentiles' in metrics:
-            metrics.remove('percentiles')
-            metrics.extend(['p95', 'p5'])
+        design_matrix = np.array([dates, cosines, sines])
 
+    if incremental and product not in SKETCH_RANGES:
+        raise ValueError(
+            'No histogram range for incremental timescans of product {}, '
+            'needs to be one of {}.'.format(product, list(SKETCH_RANGES))
+        )
+
+    with ras.open_raster(stack) as src:
         # get metadata
         meta = src.profile
 
-        # update driver and reduced band count
-        meta.update({'driver': 'GTiff'})
-        meta.update({'count': 1})
-
-        # write all different output files into a dictionary
-        metric_dict = {}
-        for metric in metrics:
-            filename = '{}.{}.tif'.format(out_prefix, metric)
-            metric_dict[metric] = rasterio.open(
-                filename, 'w', **meta)
-
-        # scaling factors in case we have to rescale to integer
-        minimums = {'avg': -30,
-                    'max': -30,
-                    'min': -30,
-                    'std': 0.00001,
-                    'cov': 0.00001,
-                    'count': 0
-                    }
-        maximums = {'avg': 5,
-                    'max': 5,
-                    'min': 5,
-                    'std': 15,
-                    'cov': 1,
-                    'count': 64000
-                    }
-
-        if harmonics:
-            # construct independent variables
-            dates, sines, cosines = [], [], []
-            two_pi = np.multiply(2, np.pi)
-            for date in sorted(datelist):
-
-                delta = difference_in_years(
-                    datetime.strptime('700101', "%y%m%d"),
-                    datetime.strptime(date, "%y%m%d")
-                )
-                dates.append(delta)
-                sines.append(np.sin(np.multiply(two_pi, delta - 0.5)))
-                cosines.append(np.cos(np.multiply(two_pi, delta - 0.5)))
+    # update driver and reduced band count
+    meta.update({'driver': 'GTiff'})
+    meta.update({'count': 1})
+    meta.update(ras.gtiff_profile(meta['dtype'], meta['width'],
+                                  meta['height']))
 
-            arr = np.array([dates, cosines, sines])
+    # write all different output files into a dictionary
+    metric_dict = {}
+    for metric in metrics:
+        filename = '{}.{}.tif'.format(out_prefix, metric)
+        metric_dict[metric] = rasterio.open(
+            filename, 'w', **meta)
+
+    if incremental and (harmonics or outlier_removal):
+        logger.debug(
+            'Harmonics and outlier removal need the full stack, '
+            'calculating the timescan of %s from scratch.', stack
+        )
+        incremental = False
 
+    if incremental:
+        # update the persisted statistics with the new layers only
+        _incremental_metrics(
+            stack, out_prefix, metrics, metric_dict,
+            rescale_to_datatype, to_power, max_workers, product
+        )
+    else:
         # loop through blocks
-        for _, window in src.block_windows(1):
-            # read array with all bands
-            stack = src.read(range(1, src.count + 1), window=window)
-
-            if rescale_to_datatype is True and meta['dtype'] != 'float32':
-                stack = ras.rescale_to_float(stack, meta['dtype'])
-
-            # transform to power
-            if to_power is True:
-                stack = ras.convert_to_power(stack)
-
-            # outlier removal (only applies if there are more than 5 bands)
-            if outlier_removal is True and src.count >= 5:
-                stack = remove_outliers(stack)
-
-            # get stats
-            np.seterr(divide='ignore', invalid='ignore')
-            arr = {}
-            arr['p95'], arr['p5'] = (np.nan_to_num(nan_percentile(stack, [95, 5]))
-                                     if 'p95' in metrics else (False, False))
-            arr['median'] = (np.nan_to_num(np.nanmedian(stack, axis=0))
-                             if 'median' in metrics else False)
-            arr['avg'] = (np.nan_to_num(np.nanmean(stack, axis=0))
-                          if 'avg' in metrics else False)
-            arr['max'] = (np.nan_to_num(np.nanmax(stack, axis=0))
-                          if 'max' in metrics else False)
-            arr['min'] = (np.nan_to_num(np.nanmin(stack, axis=0))
-                          if 'min' in metrics else False)
-            arr['std'] = (np.nan_to_num(np.nanstd(stack, axis=0))
-                          if 'std' in metrics else False)
-            arr['cov'] = (np.nan_to_num(stats.variation(stack, axis=0,
-                                                        nan_policy='omit'))
-                          if 'cov' in metrics else False)
-            arr['count'] = (np.nan_to_num(np.count_nonzero(stack, axis=0))
-                          if 'count' in metrics else False)
-
-            if harmonics:
-                stack_size = (stack.shape[1], stack.shape[2])
-                if to_power is True:
-                    y = ras.convert_to_db(stack).reshape(stack.shape[0], -1)
-                else:
-                    y = stack.reshape(stack.shape[0], -1)
-
-                arr, residuals, _, _ = np.linalg.lstsq(arr.T, y)
-                arr['amplitude'] = np.hypot(arr[1], arr[2]).reshape(stack_size)
-                arr['phase'] = np.arctan2(arr[2], arr[1]).reshape(stack_size)
-                arr['residuals'] = np.sqrt(
-                    np.divide(residuals, stack.shape[0])
-                ).reshape(stack_size)
-
-            # the metrics to be re-turned to dB, in case to_power is True
-            metrics_to_convert = ['avg', 'min', 'max', 'p95', 'p5', 'median']
-
-            # do the back conversions and write to disk loop
+        for window, arr in ras.process_blocks(
+                stack,
+                _metrics_block,
+                fargs=(metrics, meta['dtype'], rescale_to_datatype,
+                       to_power, outlier_removal, design_matrix),
+                max_workers=max_workers
+        ):
+            # write to dest
             for metric in metrics:
-                if to_power is True and metric in metrics_to_convert:
-                    arr[metric] = ras.convert_to_db(arr[metric])
-
-                if rescale_to_datatype is True and meta['dtype'] != 'float32':
-                    arr[metric] = ras.scale_to_int(
-                        arr[metric],
-                        meta['dtype'],
-                        minimums[metric],
-                        maximums[metric]
-                    )
-                # write to dest
                 metric_dict[metric].write(
-                    np.float32(arr[metric]), window=window, indexes=1)
-                metric_dict[metric].update_tags(
-                    1,
-                    BAND_NAME='{}_{}'.format(os.path.basename(out_prefix), metric)
-                )
-                metric_dict[metric].set_band_description(
-                    1,
-                    '{}_{}'.format(os.path.basename(out_prefix), metric)
+                    arr[metric], window=window, indexes=1
                 )
 
-    # close the output files
+    # set band names and close the output files
     for metric in metrics:
+        metric_dict[metric].update_tags(
+            1,
+            BAND_NAME='{}_{}'.format(os.path.basename(out_prefix), metric)
+        )
+        metric_dict[metric].set_band_description(
+            1,
+            '{}_{}'.format(os.path.basename(out_prefix), metric)
+        )
         # close rio opening
         metric_dict[metric].close()
+        ras.finalize_gtiff('{}.{}.tif'.format(out_prefix, metric))
 
     dirname = os.path.dirname(out_prefix)
     check_file = opj(dirname, '.{}.processed'.format(os.path.basename(out_prefix)))
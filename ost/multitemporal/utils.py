@@ -91,18 +91,27 @@ def mt_extent(
     h.timer(start)
 
 
+def _ls_block(stack):
+    # get stats
+    arr_max = np.nanmax(stack, axis=0)
+    arr = arr_max / arr_max
+    return np.uint8(arr)
+
+
 def mt_layover(
         filelist,
         outfile,
         temp_dir,
         extent,
-        update_extent=False
+        update_extent=False,
+        max_workers=os.cpu_count()
 ):
     '''
     This function is usally used in the time-series workflow of OST. A list
     of the filepaths layover/shadow masks
     :param filelist - list of files
     :param out_dir - directory where the output file will be stored
+    :param max_workers - number of threads processing the blocks
     :return path to the multi-temporal layover/shadow mask file generated
     '''
 
@@ -122,26 +131,21 @@ def mt_layover(
     gdal.BuildVRT(opj(temp_dir, 'ls.vrt'), filelist, options=vrt_options)
 
     with rasterio.open(opj(temp_dir, 'ls.vrt')) as src:
-
         # get metadata
         meta = src.meta
-        # update driver and reduced band count
-        meta.update(driver='GTiff', count=1, dtype='uint8')
-
-        # create outfiles
-        with rasterio.open(ls_layer, 'w', **meta) as out_min:
-
-            # loop through blocks
-            for _, window in src.block_windows(1):
-
-                # read array with all bands
-                stack = src.read(range(1, src.count + 1), window=window)
-
-                # get stats
-                arr_max = np.nanmax(stack, axis=0)
-                arr = arr_max / arr_max
-
-                out_min.write(np.uint8(arr), window=window, indexes=1)
+    # update driver and reduced band count
+    meta.update(driver='GTiff', count=1, dtype='uint8')
+
+    # create outfiles
+    with rasterio.open(ls_layer, 'w', **meta) as out_min:
+
+        # loop through blocks
+        for window, arr in ras.process_blocks(
+                opj(temp_dir, 'ls.vrt'),
+                _ls_block,
+                max_workers=max_workers
+        ):
+            out_min.write(arr, window=window, indexes=1)
 
     ras.mask_by_shape(ls_layer, outfile, extent, to_db=False,
                       datatype='uint8', rescale=False, ndv=0)
@@ -463,7 +463,21 @@ class Sentinel1Batch(Sentinel1):
                 self.ard_parameters['type'], self.product_type
             )
 
-    def create_timeseries(self):
+    def create_timeseries(self, append=False):
+        '''Creates the time-series of all tracks
+
+        :param append: add new acquisitions to already processed
+                       time-series, instead of skipping them
+        '''
+        if append:
+            batch.ards_to_timeseries(self.inventory,
+                                     self.processing_dir,
+                                     self.ard_parameters,
+                                     max_workers=self.max_workers,
+                                     append=True
+                                     )
+            return
+
         nr_of_processed = len(
             glob.glob(opj(self.processing_dir, '*', 'Timeseries', '.processed'))
         )
@@ -473,7 +487,8 @@ class Sentinel1Batch(Sentinel1):
         while len(self.inventory.relativeorbit.unique()) > nr_of_processed:
             batch.ards_to_timeseries(self.inventory,
                                      self.processing_dir,
-                                     self.ard_parameters
+                                     self.ard_parameters,
+                                     max_workers=self.max_workers
                                      )
             nr_of_processed = len(
                 glob.glob(opj(self.processing_dir, '*',
@@ -484,7 +499,22 @@ class Sentinel1Batch(Sentinel1):
             if i == 5:
                 break
 
-    def create_timescan(self):
+    def create_timescan(self, incremental=False):
+        '''Creates the timescans of all tracks
+
+        :param incremental: update the persisted statistics of previous
+                            timescans with the new dates only
+        '''
+        if incremental:
+            batch.timeseries_to_timescan(
+                self.inventory,
+                self.processing_dir,
+                self.ard_parameters,
+                max_workers=self.max_workers,
+                incremental=True
+            )
+            return
+
         nr_of_processed = len(
             glob.glob(opj(
                 self.processing_dir, '*', 'Timescan', '.processed')
@@ -495,7 +525,8 @@ class Sentinel1Batch(Sentinel1):
             batch.timeseries_to_timescan(
                 self.inventory,
                 self.processing_dir,
-                self.ard_parameters
+                self.ard_parameters,
+                max_workers=self.max_workers
             )
             nr_of_processed = len(glob.glob(opj(
                 self.processing_dir, '*', 'Timescan', '.processed')))
@@ -538,7 +569,8 @@ class Sentinel1Batch(Sentinel1):
                 outfile,
                 download_dir=self.download_dir,
                 data_mount=self.data_mount,
-                uname=uname, pword=pword)
+                uname=uname, pword=pword,
+                max_workers=self.max_workers)
         else:
             outfile = opj(self.inventory_dir,
                           'bursts.full.shp'
@@ -550,7 +582,8 @@ class Sentinel1Batch(Sentinel1):
                 download_dir=self.download_dir,
                 data_mount=self.data_mount,
                 uname=uname,
-                pword=pword
+                pword=pword,
+                max_workers=self.max_workers
             )
 
         if refine:
@@ -9,8 +9,10 @@ from tempfile import TemporaryDirectory
 
 from ost import Sentinel1Scene
 from ost.helpers.utils import _create_processing_dict
+from ost.helpers.gpt_pool import GPTPool
+from ost.helpers.scheduler import get_scheduler
 from ost.multitemporal.utils import mt_extent, mt_layover
-from ost.multitemporal import timescan
+from ost.multitemporal import timescan, datacube
 from ost.multitemporal.ard_to_ts import ard_to_ts
 from ost.multitemporal.timescan import create_tscan_vrt
 from ost.mosaic import mosaic
@@ -25,11 +27,12 @@ def _to_ard_batch(
         ard_parameters,
         subset=None,
         polar='VV,VH,HH,HV',
-        max_workers=int(os.cpu_count()/2)
+        max_workers=None
 ):
     # we create a processing dictionary,
     # where all frames are grouped into acquisitions
     processing_dict = _create_processing_dict(inventory_df)
+    acquisitions = []
     for track, allScenes in processing_dict.items():
         for list_of_scenes in processing_dict[track]:
             # get acquisition date
@@ -44,28 +47,56 @@ def _to_ard_batch(
                              'already processed'.format(acquisition_date, track)
                              )
             else:
-                # get the paths to the file
-                for i in list_of_scenes:
-                    s1_process_scene = Sentinel1Scene(i)
-                    s1_process_scene.ard_parameters = ard_parameters
-                    scene_paths = ([Sentinel1Scene(i).get_path(download_dir)
-                                    for i in list_of_scenes
-                                    ])
-                    s1_process_scene.create_ard(
-                        filelist=scene_paths,
-                        out_dir=out_dir,
-                        out_prefix=s1_process_scene.start_date.replace('-', ''),
-                        subset=subset,
-                        polar=polar,
-                        max_workers=max_workers
-                    )
+                acquisitions.append((list_of_scenes, out_dir))
+
+    if not acquisitions:
+        return
+
+    max_workers = get_scheduler().max_jobs('grd_ard', max_workers)
+
+    # long-lived workers, so that each keeps its JVM for all acquisitions
+    with GPTPool(max_workers=min(max_workers, len(acquisitions))) as pool:
+        for task in pool.as_completed(
+                func=_execute_batch_ard,
+                iterable=acquisitions,
+                fargs=(download_dir, ard_parameters, subset, polar),
+                job_type='grd_ard'
+        ):
+            task.result()
+
+
+def _execute_batch_ard(
+        acquisition,
+        download_dir,
+        ard_parameters,
+        subset=None,
+        polar='VV,VH,HH,HV'
+):
+    list_of_scenes, out_dir = acquisition
+
+    # get the paths to the file
+    scene_paths = ([Sentinel1Scene(i).get_path(download_dir)
+                    for i in list_of_scenes
+                    ])
+    s1_process_scene = Sentinel1Scene(list_of_scenes[0])
+    s1_process_scene.ard_parameters = ard_parameters
+    s1_process_scene.create_ard(
+        filelist=scene_paths,
+        out_dir=out_dir,
+        out_prefix=s1_process_scene.start_date.replace('-', ''),
+        subset=subset,
+        polar=polar,
+        max_workers=1
+    )
 
 
 def ards_to_timeseries(
         inventory_df,
         processing_dir,
         ard_params=None,
-        product_suffix='TC'
+        product_suffix='TC',
+        max_workers=os.cpu_count(),
+        append=False
 ):
     for track in inventory_df.relativeorbit.unique():
         # get the burst directory
@@ -76,6 +107,10 @@ def ards_to_timeseries(
         list_of_scenes = [x for x in list_of_scenes if 'layover' not in x]
         extent = opj(track_dir, '{}.extent.shp'.format(track))
 
+        # new dates are appended within the existing extent
+        if append and os.path.isfile(extent):
+            continue
+
         logger.debug(
             'INFO: Creating common extent mask for track {}'.format(track)
         )
@@ -87,13 +122,15 @@ def ards_to_timeseries(
             # get the burst directory
             track_dir = opj(processing_dir, track)
 
+            # layover/shadow mask
+            out_ls = opj(track_dir, '{}.ls_mask.tif'.format(track))
+            if append and os.path.isfile(out_ls):
+                continue
+
             # get common burst extent
             list_of_scenes = glob.glob(opj(track_dir, '20*', '*data*', '*img'))
             list_of_layover = [x for x in list_of_scenes if 'layover' in x]
 
-            # layover/shadow mask
-            out_ls = opj(track_dir, '{}.ls_mask.tif'.format(track))
-
             logger.debug(
                 'INFO: Creating common Layover/Shadow mask '
                 'for track {}'.format(track)
@@ -104,7 +141,8 @@ def ards_to_timeseries(
                     out_ls,
                     temp_dir,
                     extent,
-                    ard_params['apply_ls_mask']
+                    ard_params['apply_ls_mask'],
+                    max_workers=max_workers
                 )
 
     for track in inventory_df.relativeorbit.unique():
@@ -126,14 +164,18 @@ def ards_to_timeseries(
                 track,
                 product_suffix=product_suffix,
                 ard_params=ard_params,
-                pol=pol
+                pol=pol,
+                append=append,
+                max_workers=max_workers
             )
 
 
 def timeseries_to_timescan(
         inventory_df,
         processing_dir,
-        ard_params=None
+        ard_params=None,
+        max_workers=os.cpu_count(),
+        incremental=False
 ):
     to_db = False
     # get the db scaling right
@@ -175,6 +217,16 @@ def timeseries_to_timescan(
             if not os.path.isfile(timeseries_vrt):
                 raise RuntimeError('VRT file for timeseries in track '
                                    '%s missing!', track)
+            # the datacube of the time-series is faster to read,
+            # as long as it is not older than the vrt
+            stack = timeseries_vrt
+            cube = datacube.datacube_file(
+                opj(track_dir, 'Timeseries'), 'TC', polar
+            )
+            if os.path.isdir(cube) and (
+                    os.path.getmtime(cube) >= os.path.getmtime(timeseries_vrt)
+            ):
+                stack = cube
             logger.debug(
                 'INFO: Processing Timescans of {} '
                 'for track {}.'.format(polar, track)
@@ -192,13 +244,15 @@ def timeseries_to_timescan(
             timescan_prefix = opj(timescan_dir, 'TC.{}'.format(polar))
             # run timescan
             timescan.mt_metrics(
-                timeseries_vrt,
+                stack,
                 timescan_prefix,
                 ard_params['metrics'],
                 rescale_to_datatype=dtype_conversion,
                 to_power=to_db,
                 outlier_removal=ard_params['remove_outliers'],
-                datelist=datelist
+                datelist=datelist,
+                max_workers=max_workers,
+                incremental=incremental
             )
 
 
@@ -207,7 +261,8 @@ def mosaic_timeseries(
         processing_dir,
         temp_dir,
         cut_to_aoi=False,
-        exec_file=None
+        exec_file=None,
+        max_workers=None
 ):
 
     logger.debug(' -----------------------------------')
@@ -218,7 +273,8 @@ def mosaic_timeseries(
     ts_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
     os.makedirs(ts_dir, exist_ok=True)
 
-    # loop through polarisations
+    # collect the layers of all polarisations
+    layers = {}
     for p in ['VV', 'VH', 'HH', 'HV']:
         tracks = inventory_df.relativeorbit.unique()
         nr_of_ts = len(glob.glob(opj(
@@ -227,7 +283,7 @@ def mosaic_timeseries(
         if not nr_of_ts >= 1:
             continue
 
-        outfiles = []
+        layers[p] = []
         for i in range(1, nr_of_ts + 1):
 
             filelist = glob.glob(opj(
@@ -240,7 +296,6 @@ def mosaic_timeseries(
             for file in filelist:
                 datelist.append(os.path.basename(file).split('.')[1])
 
-            filelist = ' '.join(filelist)
             start, end = sorted(datelist)[0], sorted(datelist)[-1]
 
             if start == end:
@@ -248,34 +303,24 @@ def mosaic_timeseries(
             else:
                 outfile = opj(ts_dir, '{}.{}-{}.BS.{}.tif'.format(i, start, end, p))
 
-            check_file = opj(
-                os.path.dirname(outfile),
-                '.{}.processed'.format(os.path.basename(outfile)[:-4])
-            )
-            outfiles.append(outfile)
-
-            if os.path.isfile(check_file):
-                logger.debug(
-                    'INFO: Mosaic layer {} already'
-                    ' processed.'.format(os.path.basename(outfile))
-                )
-                continue
+            layers[p].append((filelist, outfile))
 
-            logger.debug('INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-            mosaic.mosaic(
-                filelist,
-                outfile,
-                cut_to_aoi
-            )
+    # all layers are mosaicked concurrently
+    outfiles = mosaic.mosaic_layers(
+        list(itertools.chain(*layers.values())), cut_to_aoi,
+        max_workers=max_workers
+    )
 
+    for p in layers:
         if exec_file:
             logger.debug(' gdalbuildvrt ....command, outfiles')
             continue
 
-        # create vrt
+        # create vrt, once all layers are finished
         vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
         gdal.BuildVRT(opj(ts_dir, 'Timeseries.{}.vrt'.format(p)),
-                      outfiles,
+                      [outfile for _, outfile in layers[p]
+                       if outfile in outfiles],
                       options=vrt_options
                       )
 
@@ -284,6 +329,7 @@ def mosaic_timescan(
         processing_dir,
         ard_params,
         cut_to_aoi=False,
+        max_workers=None
 ):
     metrics = ard_params['metrics']
     if 'harmonics' in metrics:
@@ -297,7 +343,7 @@ def mosaic_timescan(
     # create out directory of not existent
     tscan_dir = opj(processing_dir, 'Mosaic', 'Timescan')
     os.makedirs(tscan_dir, exist_ok=True)
-    outfiles = []
+    layers = []
 
     # loop through all pontial proucts
     for polar, metric in itertools.product(['VV', 'HH', 'VH', 'HV'], metrics):
@@ -311,21 +357,9 @@ def mosaic_timescan(
         if not len(filelist) >= 2:
             continue
 
-        # get number
-        filelist = ' '.join(filelist)
         outfile = opj(tscan_dir, 'BS.{}.{}.tif'.format(polar, metric))
-        check_file = opj(
-            os.path.dirname(outfile),
-            '.{}.processed'.format(os.path.basename(outfile)[:-4])
-        )
-        if os.path.isfile(check_file):
-            logger.debug('INFO: Mosaic layer {} already '
-                         ' processed.'.format(os.path.basename(outfile))
-                         )
-            continue
-
-        logger.debug('INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-        mosaic.mosaic(filelist, outfile, cut_to_aoi)
-        outfiles.append(outfile)
+        layers.append((filelist, outfile))
 
+    # all metrics are mosaicked concurrently, before the vrt is built
+    mosaic.mosaic_layers(layers, cut_to_aoi, max_workers=max_workers)
     create_tscan_vrt(tscan_dir, ard_params)
@@ -9,14 +9,17 @@ import itertools
 from tempfile import TemporaryDirectory
 from retry import retry
 
-from godale import Executor
 
 import gdal
 
 from ost.helpers import vector as vec, raster as ras, utils as h
+from ost.helpers.gpt_pool import GPTPool
+from ost.helpers.scheduler import get_scheduler
 from ost.s1_core import timeseries
+from ost.mosaic import mosaic
 from ost.s1_to_ard import burst_to_ard
 from ost import Sentinel1Scene as S1Scene
+from ost.settings import GPT_FUSED_GRAPH
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +30,7 @@ def burst_to_ard_batch(
         processing_dir,
         ard_parameters,
         data_mount='/eodata',
-        max_workers=int(os.cpu_count()/2)
+        max_workers=None
 ):
     '''Handles the batch processing of a OST complinat burst inventory file
 
@@ -37,25 +40,25 @@ def burst_to_ard_batch(
         processing_dir (str):
         temp_dir (str):
         ard_parameters (dict):
+        max_workers (int): upper limit of concurrent bursts
+                           (default: as many as the resources allow)
 
     '''
-    if max_workers > os.cpu_count()/2:
-        max_workers = int(os.cpu_count()/2)
-    executor_type = 'concurrent_processes'
-    executor = Executor(executor=executor_type,
-                        max_workers=max_workers
-                        )
-    for task in executor.as_completed(
-            func=_execute_batch_burst_ard,
-            iterable=burst_inventory.iterrows(),
-            fargs=(processing_dir,
-                   download_dir,
-                   data_mount,
-                   ard_parameters,
-                   )
-
-    ):
-        task.result()
+    max_workers = get_scheduler().max_jobs('burst_ard', max_workers)
+
+    # long-lived workers, so that each keeps its JVM for all its bursts
+    with GPTPool(max_workers=max_workers) as pool:
+        for task in pool.as_completed(
+                func=_execute_batch_burst_ard,
+                iterable=burst_inventory.iterrows(),
+                fargs=(processing_dir,
+                       download_dir,
+                       data_mount,
+                       ard_parameters,
+                       ),
+                job_type='burst_ard'
+        ):
+            task.result()
 
 
 @retry(tries=3, delay=1, logger=logger)
@@ -116,6 +119,9 @@ def _execute_batch_burst_ard(
                 to_db=to_db,
                 ls_mask_create=ls_mask_create,
                 dem=dem,
+                fused_graph=ard_parameters.get(
+                    'fused_graph', GPT_FUSED_GRAPH
+                )
             )
         except Exception as e:
             raise e
@@ -570,9 +576,11 @@ def mosaic_timeseries(burst_inventory, processing_dir, temp_dir,
             length = length_of_burst
 
     # now we loop through each timestep and product
+    out_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
+    layers = {}
     for product in product_list:  # ****
         
-        list_of_files = []
+        layers[product] = []
         for i in range(length):
 
             filelist = glob.glob(
@@ -596,9 +604,6 @@ def mosaic_timeseries(burst_inventory, processing_dir, temp_dir,
                 start = sorted(datelist)[0]
                 end = sorted(datelist)[-1]
                 
-                out_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
-                os.makedirs(out_dir, exist_ok=True)
-                
                 if start == end:
                     outfile = opj(
                         out_dir, '{}.{}.{}.tif'.format(i + 1, start, product)
@@ -609,15 +614,17 @@ def mosaic_timeseries(burst_inventory, processing_dir, temp_dir,
                         '{}.{}-{}.{}.tif'.format(i + 1, start, end, product)
                     )
 
-                list_of_files.append(outfile)
-                filelist = ''.join(filelist)
-                # the command
-                command = ('otbcli_Mosaic -il {} -comp.feather large '
-                           '-tmpdir {} -progress 1 -out {} float'.format(
-                               filelist, temp_dir, outfile))
-                os.system(command)
+                layers[product].append((filelist, outfile))
+
+    # all layers are mosaicked concurrently
+    outfiles = mosaic.mosaic_layers(
+        list(itertools.chain(*layers.values())), harmonize=False
+    )
 
-        # create vrt
+    for product in product_list:
+        list_of_files = [outfile for _, outfile in layers[product]
+                         if outfile in outfiles]
+        # create vrt, once all layers are finished
         if list_of_files:
             vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
             gdal.BuildVRT(opj(out_dir, '{}.Timeseries.vrt'.format(product)),
@@ -636,22 +643,21 @@ def mosaic_timescan(burst_inventory,
     metrics = ard_parameters['metrics']
 
     os.makedirs(opj(processing_dir, 'Mosaic', 'Timescan'), exist_ok=True)
-    i, list_of_files = 0, []
+    i, layers = 0, []
     for product in itertools.product(product_list, metrics):   # ****
 
-        filelist = ''.join(glob.glob(
+        filelist = glob.glob(
             opj(processing_dir, '*', 'Timescan', '*{}.{}.tif'.format(
-                product[0], product[1]))))
+                product[0], product[1])))
 
         if filelist:
             i += 1
             outfile = opj(processing_dir, 'Mosaic', 'Timescan',
                           '{}.{}.{}.tif'.format(i, product[0], product[1]))
-            command = ('otbcli_Mosaic -il {} -comp.feather large -tmpdir {}'
-                       '-progress 1 -out {} float'.format(
-                               filelist, temp_dir, outfile))
-            os.system(command)
-            list_of_files.append(outfile)
+            layers.append((filelist, outfile))
+
+    # all layers are mosaicked concurrently
+    list_of_files = mosaic.mosaic_layers(layers, harmonize=False)
 
     # create vrt
     vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
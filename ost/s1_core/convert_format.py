@@ -12,7 +12,6 @@ from rasterio.enums import Resampling
 from godale._concurrent import Executor
 
 from ost.helpers import raster as ras
-from ost.settings import GTIFF_OST_PROFILE
 
 
 logger = logging.getLogger(__name__)
@@ -36,9 +35,12 @@ def execute_burst_to_tif(dim_file, out_path, driver='GTiff', to_db=False):
         out_profile.update(driver=driver,
                            count=3,
                            nodata=0.0,
-                           compress='Deflate',
                            dtype='float32'
                            )
+        if driver == 'GTiff':
+            out_profile.update(
+                ras.gtiff_profile('float32', co.width, co.height)
+            )
         with rasterio.open(out_tif, 'w', **out_profile) as dst:
             if co.shape != cr.shape:
                 logger.debug('dimensions do not match')
@@ -73,6 +75,8 @@ def execute_burst_to_tif(dim_file, out_path, driver='GTiff', to_db=False):
             for k, arr in [(1, co_array), (2, cr_array),
                            (3, ratio_array)]:
                 dst.write(arr[0, ], indexes=k)
+    if driver == 'GTiff':
+        ras.finalize_gtiff(out_tif)
     return out_tif
 
 
@@ -108,24 +112,18 @@ def ard_slc_to_rgb(
     )
     width = arr.shape[2]
     height = arr.shape[1]
-    blockxsize = GTIFF_OST_PROFILE["blockxsize"]
-    blockysize = GTIFF_OST_PROFILE["blockysize"]
-    if width < 256 or height < 256:
-        blockxsize = 64
-        blockysize = 64
     profile = out_tifs[0].profile
     profile.update(
-        GTIFF_OST_PROFILE,
+        ras.gtiff_profile(profile['dtype'], width, height),
         width=width,
         height=height,
         transform=out_trans,
-        blockxsize=blockxsize,
-        blockysize=blockysize,
         count=3
     )
     arr = np.where(arr == out_tifs[0].nodata, 0, arr)
     with rasterio.open(outfile, "w", **profile) as dst:
         dst.write(arr)
+    ras.finalize_gtiff(outfile)
     return outfile
 
 
@@ -17,13 +17,15 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 import requests
+from shapely.geometry import Polygon
 from shapely.wkt import loads
 
-from godale import Executor
-
-from ost.settings import SNAP_S1_RESAMPLING_METHODS
-from ost.helpers import scihub, raster as ras
+from ost.settings import SNAP_S1_RESAMPLING_METHODS, GPT_FUSED_GRAPH
+from ost.helpers import scihub, scene_index, raster as ras
 from ost.helpers.utils import execute_ard
+from ost.helpers.gpt_pool import GPTPool
+from ost.helpers.scheduler import get_scheduler
+from ost.helpers.metadata import MetadataStore, stored_bursts
 from ost.s1_to_ard.grd_to_ard import grd_to_ard
 from ost.s1_core.convert_format import ard_to_rgb, ard_to_thumbnail, \
     ard_slc_to_rgb, ard_slc_to_thumbnail
@@ -31,6 +33,42 @@ from ost.helpers.bursts import get_bursts_by_polygon
 
 logger = logging.getLogger(__name__)
 
+# columns of the burst database of a scene
+BURST_COLUMNS = ['SceneID', 'Track', 'Date', 'SwathID', 'AnxTime',
+                 'BurstNr', 'geometry']
+
+
+def _grid_corners(lines, pixels, coords, pixel, burst_lines):
+    '''Coordinates of the geolocation grid at a pixel for burst lines
+
+    Lines that are not within the grid are looked up one line before,
+    missing corners are NaN.
+    '''
+    corners = np.full((len(burst_lines), 2), np.nan, dtype=np.float32)
+    at_pixel = np.flatnonzero(pixels == pixel)
+    if not len(at_pixel):
+        return corners
+
+    # the last point of every line, as for a dict by line
+    grid_lines, index = np.unique(lines[at_pixel][::-1], return_index=True)
+    grid_coords = coords[at_pixel][::-1][index]
+
+    # the line itself takes precedence over the line before
+    for line in [burst_lines - 1, burst_lines]:
+        position = np.minimum(np.searchsorted(grid_lines, line),
+                              len(grid_lines) - 1)
+        found = grid_lines[position] == line
+        corners[found] = grid_coords[position[found]]
+    return corners
+
+
+def _concat_bursts(gdfs, crs=None):
+    '''Burst databases of all annotation files, in one GeoDataFrame'''
+    if not gdfs:
+        return gpd.GeoDataFrame(columns=BURST_COLUMNS, crs=crs)
+    gdf = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=crs)
+    return gdf.drop_duplicates(['AnxTime'], keep='first')
+
 
 class Sentinel1Scene:
 
@@ -195,6 +233,9 @@ class Sentinel1Scene:
         return path
 
     def get_path(self, download_dir=None, data_mount='/eodata'):
+        if scene_index.enabled():
+            return self._indexed_path(download_dir, data_mount)
+
         if download_dir:
             if os.path.isfile(self._download_path(download_dir) + '.downloaded'):
                 path = self._download_path(download_dir)
@@ -216,6 +257,27 @@ class Sentinel1Scene:
                 path = None
         return path
 
+    def _indexed_path(self, download_dir=None, data_mount='/eodata'):
+        # same order of precedence as the probes of get_path
+        locations = []
+        if download_dir:
+            locations.append((download_dir, 'download', None))
+        if data_mount:
+            # only the day directory of the scene is indexed on the mounts
+            date = (self.year, self.month, self.day)
+            locations += [
+                (data_mount, 'creodias', (self.product_type,) + date),
+                (data_mount, 'onda', (self.onda_class,) + date)
+            ]
+
+        for root, layout, day in locations:
+            path = scene_index.scene_index(root, layout).get(
+                self.scene_id, day
+            )
+            if path:
+                return path
+        return None
+
     # scihub related
     def scihub_uuid(self, opener):
         # construct the basic the url
@@ -361,102 +423,75 @@ class Sentinel1Scene:
         annotation file and extracts relevant information for burst
         identification as a GeoPandas GeoDataFrame.
 
+        The geolocation grid is read into arrays in one pass, and the
+        corners of all bursts are looked up at once.
+
         Much of the code is taken from RapidSAR
         package (once upon a time on github).
         '''
-        column_names = ['SceneID', 'Track', 'Date', 'SwathID', 'AnxTime',
-                        'BurstNr', 'geometry']
-        gdf = gpd.GeoDataFrame(columns=column_names)
         track = self.rel_orbit
         acq_date = self.start_date
         # pol = root.find('adsHeader').find('polarisation').text
         swath = et_root.find('adsHeader').find('swath').text
-        lines_per_burst = np.int(et_root.find('swathTiming').find(
+        lines_per_burst = int(et_root.find('swathTiming').find(
             'linesPerBurst').text)
-        pixels_per_burst = np.int(et_root.find('swathTiming').find(
+        pixels_per_burst = int(et_root.find('swathTiming').find(
             'samplesPerBurst').text)
         burstlist = et_root.find('swathTiming').find('burstList')
         geolocation_grid = et_root.find('geolocationGrid')[0]
-        first = {}
-        last = {}
-
-        # Get burst corner geolocation info
-        for geo_point in geolocation_grid:
-            if geo_point.find('pixel').text == '0':
-                first[geo_point.find('line').text] = np.float32(
-                    [geo_point.find('latitude').text,
-                     geo_point.find('longitude').text])
-            elif geo_point.find('pixel').text == str(pixels_per_burst-1):
-                last[geo_point.find('line').text] = np.float32(
-                    [geo_point.find('latitude').text,
-                     geo_point.find('longitude').text])
-        for i, b in enumerate(burstlist):
-            firstline = str(i*lines_per_burst)
-            lastline = str((i+1)*lines_per_burst)
-            azi_anx_time = np.float32(b.find('azimuthAnxTime').text)
-            orbit_time = 12*24*60*60/175
-
-            if azi_anx_time > orbit_time:
-                azi_anx_time = np.mod(azi_anx_time, orbit_time)
-
-            azi_anx_time = np.int32(np.round(azi_anx_time*10))
-#           burstid = 'T{}_{}_{}'.format(track, swath, burstid)
-#           first and lastline sometimes shifts by 1 for some reason?
-            try:
-                firstthis = first[firstline]
-            except:
-                firstline = str(int(firstline)-1)
-                try:
-                    firstthis = first[firstline]
-                except:
-                    logger.debug('First line not found in annotation file')
-                    firstthis = []
-            try:
-                lastthis = last[lastline]
-            except:
-                lastline = str(int(lastline)-1)
-                try:
-                    lastthis = last[lastline]
-                except:
-                    logger.debug('Last line not found in annotation file')
-                    lastthis = []
-            corners = np.zeros([4, 2], dtype=np.float32)
-
-            # Had missing info for 1 burst in a file, hence the check
-            if len(firstthis) > 0 and len(lastthis) > 0:
-                corners[0] = first[firstline]
-                corners[1] = last[firstline]
-                corners[3] = first[lastline]
-                corners[2] = last[lastline]
-
-            wkt = 'POLYGON (({} {},{} {},{} {},{} {},{} {}))'.format(
-                np.around(float(corners[0, 1]), 3),
-                np.around(float(corners[0, 0]), 3),
-                np.around(float(corners[3, 1]), 3),
-                np.around(float(corners[3, 0]), 3),
-                np.around(float(corners[2, 1]), 3),
-                np.around(float(corners[2, 0]), 3),
-                np.around(float(corners[1, 1]), 3),
-                np.around(float(corners[1, 0]), 3),
-                np.around(float(corners[0, 1]), 3),
-                np.around(float(corners[0, 0]), 3))
-
-            geo_dict = {'SceneID': self.scene_id, 'Track': track,
-                        'Date': acq_date, 'SwathID': swath,
-                        'AnxTime': azi_anx_time, 'BurstNr': i+1,
-                        'geometry': loads(wkt)}
-            gdf = gdf.append(geo_dict, ignore_index=True)
-
-        return gdf
-
-    def _scihub_annotation_get(self, uname=None, pword=None):
 
-        # define column names fro BUrst DF
-        column_names = ['SceneID', 'Track', 'Date', 'SwathID',
-                        'AnxTime', 'BurstNr', 'geometry']
+        # all points of the geolocation grid
+        lines, pixels, lats, lons = (
+            np.array([element.text for element in geolocation_grid.iter(tag)],
+                     dtype=np.float64)
+            for tag in ['line', 'pixel', 'latitude', 'longitude']
+        )
+        coords = np.stack([lats, lons], axis=1).astype(np.float32)
 
-        gdf_final = gpd.GeoDataFrame(columns=column_names)
+        # azimuth anx time of all bursts, in tenth of seconds
+        azi_anx_time = np.array(
+            [burst.find('azimuthAnxTime').text for burst in burstlist],
+            dtype=np.float32
+        )
+        orbit_time = 12*24*60*60/175
+        azi_anx_time = np.where(azi_anx_time > orbit_time,
+                                np.mod(azi_anx_time, orbit_time),
+                                azi_anx_time)
+        azi_anx_time = np.round(azi_anx_time*10).astype(np.int32)
+
+        # Get burst corner geolocation info,
+        # first and lastline sometimes shifts by 1 for some reason
+        burst_nr = np.arange(len(azi_anx_time))
+        first = _grid_corners(lines, pixels, coords, 0,
+                              burst_nr*lines_per_burst)
+        last = _grid_corners(lines, pixels, coords, pixels_per_burst-1,
+                             (burst_nr+1)*lines_per_burst)
+        first_col = _grid_corners(lines, pixels, coords, pixels_per_burst-1,
+                                  burst_nr*lines_per_burst)
+        last_col = _grid_corners(lines, pixels, coords, 0,
+                                 (burst_nr+1)*lines_per_burst)
+
+        # Had missing info for 1 burst in a file, hence the check
+        corners = np.stack([first, first_col, last, last_col], axis=1)
+        missing = np.isnan(corners).any(axis=(1, 2))
+        if missing.any():
+            logger.debug('Corners of %s bursts not found in annotation file',
+                         missing.sum())
+        corners[missing] = 0
+        corners = np.around(corners.astype(np.float64), 3)
+
+        # rings as lon/lat, in the order of the corners 0, 3, 2, 1, 0
+        rings = corners[:, [0, 3, 2, 1, 0]][:, :, ::-1]
+        return gpd.GeoDataFrame({
+            'SceneID': self.scene_id, 'Track': track, 'Date': acq_date,
+            'SwathID': swath, 'AnxTime': azi_anx_time, 'BurstNr': burst_nr+1,
+            'geometry': [Polygon(ring) for ring in rings]
+        })
+
+    @stored_bursts
+    def _scihub_annotation_get(self, uname=None, pword=None):
 
+        gdfs = []
         base_url = 'https://scihub.copernicus.eu/apihub/'
 
         # get connected to scihub
@@ -485,20 +520,13 @@ class Sentinel1Scene:
                 et_root = ET.fromstring(response)
 
                 # parse the xml page from the response
-                gdf = self._burst_database(et_root)
-
-                gdf_final = gdf_final.append(gdf)
+                gdfs.append(self._burst_database(et_root))
 
-        return gdf_final.drop_duplicates(['AnxTime'], keep='first')
+        return _concat_bursts(gdfs)
 
+    @stored_bursts
     def _zip_annotation_get(self, download_dir, data_mount='/eodata'):
 
-        column_names = ['SceneID', 'Track', 'Date', 'SwathID', 'AnxTime',
-                        'BurstNr', 'geometry']
-        # crs for empty dataframe
-        crs = {'init': 'epsg:4326'}
-        gdf_final = gpd.GeoDataFrame(columns=column_names, crs=crs)
-
         file = self.get_path(download_dir, data_mount)
 
         # extract info from archive
@@ -507,29 +535,26 @@ class Sentinel1Scene:
         xml_files = fnmatch.filter(namelist, "*/annotation/s*.xml")
 
         # loop through xml annotation files
+        gdfs = []
         for xml_file in xml_files:
             xml_string = archive.open(xml_file)
-            gdf = self._burst_database(ET.parse(xml_string))
-            gdf_final = gdf_final.append(gdf)
+            gdfs.append(self._burst_database(ET.parse(xml_string)))
 
-        return gdf_final.drop_duplicates(['AnxTime'], keep='first')
+        return _concat_bursts(gdfs, crs='epsg:4326')
 
+    @stored_bursts
     def _safe_annotation_get(self, download_dir, data_mount='/eodata'):
 
-        column_names = ['SceneID', 'Track', 'Date', 'SwathID',
-                        'AnxTime', 'BurstNr', 'geometry']
-        gdf_final = gpd.GeoDataFrame(columns=column_names)
-
+        gdfs = []
         for anno_file in glob.glob(
                 '{}/annotation/*xml'.format(
                     self.get_path(download_dir=download_dir,
                                   data_mount=data_mount))):
 
             # parse the xml page from the response
-            gdf = self._burst_database(ET.parse(anno_file))
-            gdf_final = gdf_final.append(gdf)
+            gdfs.append(self._burst_database(ET.parse(anno_file)))
 
-        return gdf_final.drop_duplicates(['AnxTime'], keep='first')
+        return _concat_bursts(gdfs)
 
     # other data providers
     def asf_url(self):
@@ -662,7 +687,7 @@ class Sentinel1Scene:
             temp_dir=None,
             subset=None,
             polar='VV,VH,HH,HV',
-            max_workers=int(os.cpu_count()/2),
+            max_workers=None,
             overwrite=False
     ):
         out_paths = []
@@ -723,7 +748,10 @@ class Sentinel1Scene:
                         self.ard_parameters['to_db'],
                         self.ard_parameters['border_noise'],
                         subset=subset,
-                        polarisation=polar
+                        polarisation=polar,
+                        fused_graph=self.ard_parameters.get(
+                            'fused_graph', GPT_FUSED_GRAPH
+                        )
                     )
                     if return_code != 0:
                         raise RuntimeError(
@@ -771,43 +799,29 @@ class Sentinel1Scene:
                 master_annotation=master_bursts,
                 out_poly=processing_poly
             )
-            exception_flag = True
-            exception_counter = 0
-            with TemporaryDirectory(dir=temp_dir) as temp:
-                while exception_flag is True:
-                    executor_type = 'concurrent_processes'
-                    executor = Executor(executor=executor_type,
-                                        max_workers=max_workers
-                                        )
-                    if exception_counter > 3 or exception_flag is False:
-                        break
-                    for swath, b in bursts_dict.items():
-                        if b != []:
-                            try:
-                                for task in executor.as_completed(
-                                        func=execute_ard,
-                                        iterable=b,
-                                        fargs=(swath,
-                                               master_file,
-                                               out_dir,
-                                               out_prefix,
-                                               temp,
-                                               self.ard_parameters
-                                               )
-
-                                ):
-                                    return_code, out_file = task.result()
-                                    out_paths.append(out_file)
-                            except Exception as e:
-                                logger.debug(e)
-                                max_workers = int(max_workers/2)
-                                exception_flag = True
-                                exception_counter += 1
-                            else:
-                                exception_flag = False
-                        else:
-                            exception_flag = False
-                            continue
+            max_workers = get_scheduler().max_jobs('burst_ard', max_workers)
+            with TemporaryDirectory(dir=temp_dir) as temp, \
+                    GPTPool(max_workers=max_workers) as pool:
+                for swath, b in bursts_dict.items():
+                    if b == []:
+                        continue
+                    # bursts are admitted as long as the resources
+                    # allow and failed ones are resubmitted
+                    for task in pool.as_completed(
+                            func=execute_ard,
+                            iterable=b,
+                            fargs=(swath,
+                                   master_file,
+                                   out_dir,
+                                   out_prefix,
+                                   temp,
+                                   self.ard_parameters
+                                   ),
+                            job_type='burst_ard',
+                            retries=3
+                    ):
+                        return_code, out_file = task.result()
+                        out_paths.append(out_file)
                 self.ard_dimap = out_paths
         else:
             raise RuntimeError('ERROR: create_ard needs S1 SLC or GRD')
@@ -864,6 +878,11 @@ class Sentinel1Scene:
 
     # other functions
     def _get_center_lat(self, scene_path=None):
+        store = MetadataStore()
+        stored = store.get_footprint(self.scene_id)
+        if stored is not None:
+            return stored[1]
+
         if scene_path.endswith('.zip'):
             zip_archive = zipfile.ZipFile(scene_path)
             manifest = zip_archive.read('{}.SAFE/manifest.safe'
@@ -895,4 +914,12 @@ class Sentinel1Scene:
         sums = 0
         for i, coords in enumerate(coordinates):
             sums = sums + float(coords.split(',')[0])
-        return sums / (i + 1)
+        center_lat = sums / (i + 1)
+
+        # the coordinates are given as lat,lon
+        footprint = Polygon([
+            (float(coords.split(',')[1]), float(coords.split(',')[0]))
+            for coords in coordinates
+        ])
+        store.put_footprint(self.scene_id, footprint, center_lat)
+        return center_lat
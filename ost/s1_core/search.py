@@ -295,7 +295,8 @@ def check_availability(inventory_gdf, download_dir, data_mount):
     '''
     
     from ost import Sentinel1Scene
-    # add download path, or set to None if not found
+    # add download path, or set to None if not found, looked up in the
+    # scene indices of both locations (see ost.helpers.scene_index)
     inventory_gdf['download_path'] = inventory_gdf.identifier.apply(
         lambda row: Sentinel1Scene(row).get_path(download_dir, data_mount)
     )
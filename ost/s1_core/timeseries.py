@@ -14,6 +14,7 @@ import numpy as np
 from scipy import stats
 
 from ost.helpers import utils as h, raster as ras, vector as vec
+from ost.helpers.scheduler import get_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +35,8 @@ def create_grd_stack(
 
     # get gpt file
     gpt_file = h.gpt_path()
+    # gpt threads according to the resources of the job
+    threads = get_scheduler().gpt_threads('stacking')
 
     # get path to graph
     rootpath = imp.find_module('ost')[1]
@@ -44,12 +47,12 @@ def create_grd_stack(
     if pattern:
         graph = opj(rootpath, 'graphs', 'S1_TS', '1_BS_Stacking_HAalpha.xml')
         command = '{} {} -x -q {} -Pfilelist={} -PbandPattern=\'{}.*\'\
-               -Poutput={}'.format(gpt_file, graph, 2 * os.cpu_count(),
+               -Poutput={}'.format(gpt_file, graph, threads,
                                    filelist, pattern, out_stack)
     else:
         graph = opj(rootpath, 'graphs', 'S1_TS', '1_BS_Stacking.xml')
         command = '{} {} -x -q {} -Pfilelist={} -Ppol={} \
-               -Poutput={}'.format(gpt_file, graph, 2 * os.cpu_count(),
+               -Poutput={}'.format(gpt_file, graph, threads,
                                    filelist, polarisation, out_stack)
 
     return_code = h.run_command(command, logfile)
@@ -75,6 +78,8 @@ def mt_speckle_filter(
 
     # get gpt file
     gpt_file = h.gpt_path()
+    # gpt threads according to the resources of the job
+    threads = get_scheduler().gpt_threads('mt_speckle')
 
     # get path to graph
     rootpath = imp.find_module('ost')[1]
@@ -82,7 +87,7 @@ def mt_speckle_filter(
 
     logger.debug("INFO: Applying the multi-temporal speckle-filtering")
     command = '{} {} -x -q {} -Pinput={} \
-                   -Poutput={}'.format(gpt_file, graph, 2 * os.cpu_count(),
+                   -Poutput={}'.format(gpt_file, graph, threads,
                                        in_stack, out_stack)
 
     return_code = h.run_command(command, logfile)
@@ -9,11 +9,15 @@ import warnings
 from rasterio.errors import NotGeoreferencedWarning
 
 from ost.helpers import utils as h
+from ost.helpers.cache import cached_step
+from ost.helpers.graph import Graph
+from ost.helpers.scheduler import get_scheduler
 from ost.settings import SNAP_S1_RESAMPLING_METHODS, OST_ROOT
 
 logger = logging.getLogger(__name__)
 
 
+@cached_step('burst_import')
 def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV'):
     '''A wrapper of SNAP import of a single Sentinel-1 SLC burst
 
@@ -109,6 +113,7 @@ def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False):
     return return_code
 
 
+@cached_step('burst_calibration')
 def _calibration(infile,
                  outfile,
                  logfile,
@@ -539,6 +544,136 @@ def _terrain_correction_deg(infile, outfile, logfile, resolution=0.001,
     return return_code
 
 
+def _terrain_correction_parameters(resolution, dem='SRTM 1sec HGT'):
+    # same parameters as for _terrain_correction
+    return {
+        'demResamplingMethod': 'BILINEAR_INTERPOLATION',
+        'imgResamplingMethod': 'BILINEAR_INTERPOLATION',
+        'nodataValueAtSea': False,
+        'pixelSpacingInMeter': resolution,
+        'demName': dem
+    }
+
+
+def _fused_graph(
+        infile,
+        out_bs,
+        logfile,
+        graph_file,
+        swath,
+        burst,
+        resolution=20,
+        product_type='GTCgamma',
+        speckle_filter=False,
+        to_db=False,
+        out_ls=None,
+        out_ha_alpha=None,
+        pol_speckle_filter=False,
+        dem='SRTM 1sec HGT',
+        region=''
+):
+    '''Runs the whole burst to ARD chain as one SNAP graph
+
+    This function chains burst import, calibration, speckle filtering,
+    dB conversion and terrain correction into a single graph, with
+    the Layover/Shadow mask and the H-A-alpha decomposition as optional
+    branches that are written as additional outputs. Like this, gpt is
+    only started once per burst and no intermediate product is written
+    to disk.
+
+    Args:
+        infile: string or os.path object for
+                an original Sentinel-1 SLC product in zip or SAFE format
+        out_bs: string or os.path object for the geocoded backscatter
+        logfile: string or os.path object for the file
+                 where SNAP'S STDOUT/STDERR is written to
+        graph_file: string or os.path object for the generated graph
+        swath (str): the corresponding IW subswath of the burst
+        burst (str): the burst number as in the Sentinel-1 annotation file
+        out_ls: output of the Layover/Shadow mask (default: None, no mask)
+        out_ha_alpha: output of the geocoded H-A-alpha decomposition
+                      (default: None, no decomposition)
+        region: burst WKT used for faster calibration
+
+    '''
+    graph_dir = opj(OST_ROOT, 'graphs', 'S1_SLC2ARD')
+    calibration_graphs = {
+        'RTC': 'S1_SLC_TNR_Calbeta_Deb_ML_TF_SUB.xml',
+        'GTCgamma': 'S1_SLC_TNR_CalGamma_Deb_SUB.xml',
+        'GTCsigma': 'S1_SLC_TNR_CalSigma_Deb_SUB.xml'
+    }
+    if product_type not in calibration_graphs:
+        logger.debug('ERROR: Wrong product type selected.')
+        sys.exit(121)
+
+    graph = Graph()
+    imported = graph.add_template(
+        opj(graph_dir, 'S1_SLC_BurstSplit_AO.xml'), graph.add_read(infile),
+        dict(swath=swath, burst=burst, polar='VV,VH,HH,HV')
+    )
+
+    if out_ha_alpha:
+        if pol_speckle_filter:
+            ha_graph = 'S1_SLC_Deb_Spk_Halpha.xml'
+        else:
+            ha_graph = 'S1_SLC_Deb_Halpha.xml'
+        node = graph.add_template(opj(graph_dir, ha_graph), imported)
+        node = graph.add_node(
+            'Terrain-Correction', sources=node,
+            parameters=_terrain_correction_parameters(resolution, dem)
+        )
+        graph.add_write(node, out_ha_alpha)
+
+    node = graph.add_template(
+        opj(graph_dir, calibration_graphs[product_type]), imported,
+        dict(dem=dem, dem_file='', dem_nodata=0.0,
+             resampling=SNAP_S1_RESAMPLING_METHODS[2], region=region)
+    )
+
+    if speckle_filter:
+        node = graph.add_node(
+            'Speckle-Filter', sources=node,
+            parameters={'filter': 'Refined Lee', 'estimateENL': True}
+        )
+
+    if to_db:
+        node = graph.add_node('LinearToFromdB', sources=node)
+
+    if out_ls:
+        ls_node = graph.add_template(
+            opj(graph_dir, 'S1_SLC_LS_TC.xml'), node,
+            dict(dem=dem, resol=resolution)
+        )
+        graph.add_write(ls_node, out_ls)
+
+    tc_node = graph.add_node(
+        'Terrain-Correction', sources=node,
+        parameters=_terrain_correction_parameters(resolution, dem)
+    )
+    graph.add_write(tc_node, out_bs)
+    graph.write(graph_file)
+
+    # get gpt file
+    gpt_file = h.gpt_path()
+
+    logger.debug('INFO: Processing Burst {} from Swath {} of scene {} '
+                 'as single graph'.format(burst, swath,
+                                          os.path.basename(infile))
+                 )
+    command = '{} {} -x -q {}'.format(
+        gpt_file, graph_file, get_scheduler().gpt_threads('burst_ard')
+    )
+    return_code = h.run_command(command, logfile)
+
+    if return_code == 0:
+        logger.debug('INFO: Succesfully processed burst')
+    else:
+        logger.debug('ERROR: Graph processing exited with an error. \
+                See {} for Snap Error output'.format(logfile))
+
+    return return_code
+
+
 def burst_to_ard(
         master_file,
         swath,
@@ -555,7 +690,8 @@ def burst_to_ard(
         speckle_filter=False,
         to_db=False,
         ls_mask_create=False,
-        dem='SRTM 1sec HGT'
+        dem='SRTM 1sec HGT',
+        fused_graph=False
 ):
     '''The main routine to turn a burst into an ARD product
 
@@ -580,6 +716,8 @@ def burst_to_ard(
         ls_mask (bool):
         dem (str):
         remove_slave_import (bool):
+        fused_graph (bool): run all steps as one SNAP graph, without
+                            intermediate products on disk
 
     '''
     if len(master_file) != 1 and isinstance(master_file, list) \
@@ -604,6 +742,60 @@ def burst_to_ard(
                      )
         return return_code
 
+    if fused_graph:
+        # temporary and final products of all outputs
+        outputs = [(
+            opj(temp_dir, '{}_{}_BS'.format(out_prefix, master_burst_id)),
+            out_ard_path, True
+        )]
+        if ls_mask_create:
+            outputs.append((
+                opj(temp_dir, '{}_{}_LS'.format(out_prefix, master_burst_id)),
+                opj(out_dir, '{}_{}_LS'.format(out_prefix, master_burst_id)),
+                False
+            ))
+        if polarimetry:
+            outputs.append((
+                opj(temp_dir, '{}_ha_alpha'.format(master_burst_id)),
+                opj(out_dir, '{}_ha_alpha'.format(master_burst_id)),
+                True
+            ))
+
+        return_code = _fused_graph(
+            master_file,
+            outputs[0][0],
+            opj(out_dir, '{}_ard.err_log'.format(master_burst_id)),
+            opj(temp_dir, '{}_ard.xml'.format(master_burst_id)),
+            swath,
+            master_burst_nr,
+            resolution,
+            product_type,
+            speckle_filter,
+            to_db,
+            out_ls=outputs[1][0] if ls_mask_create else None,
+            out_ha_alpha=outputs[-1][0] if polarimetry else None,
+            pol_speckle_filter=pol_speckle_filter,
+            dem=dem,
+            region=master_burst_poly
+        )
+        if return_code != 0:
+            h.remove_folder_content(temp_dir)
+            return return_code
+
+        for out_temp, out_final, test_stats in outputs:
+            # last check on the output files
+            return_code = h.check_out_dimap(out_temp, test_stats=test_stats)
+            if return_code != 0:
+                h.remove_folder_content(temp_dir)
+                return return_code
+            h.move_dimap(out_temp, out_final)
+
+        # write file, so we know this burst has been succesfully processed
+        check_file = opj(out_dir, '.processed')
+        with open(str(check_file), 'w') as file:
+            file.write('passed all tests \n')
+        return return_code
+
     if not os.path.exists('{}.dim'.format(master_import)):
         import_log = opj(out_dir, '{}_import.err_log'.format(master_burst_id))
         return_code = _import(master_file, master_import, import_log,
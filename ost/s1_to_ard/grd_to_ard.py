@@ -15,10 +15,14 @@ Functions:
     _grd_remove_border:
         creates a string in the Open Search format that is added to the
         base scihub url
+    _grd_remove_border_pols:
+        removes the border noise of all polarisations concurrently
     _grd_backscatter:
         applies the search and writes the reults in a Geopandas GeoDataFrame
     _grd_speckle_filter:
         applies the Lee-Sigma filter with SNAP standard parameters
+    _grd_fused_graph:
+        runs all processing steps as a single SNAP graph
     _grd_ls_mask:
         writes the search result into an ESRI Shapefile
     _grd_terrain_correction:
@@ -68,14 +72,19 @@ import rasterio
 import numpy as np
 import gdal
 import logging
+from godale import Executor
 
 from os.path import join as opj
 from ost.helpers import utils as h
+from ost.helpers.cache import cached_step, update_fingerprint
+from ost.helpers.graph import Graph
+from ost.helpers.scheduler import get_scheduler
 from ost.settings import OST_ROOT
 
 logger = logging.getLogger(__name__)
 
 
+@cached_step('grd_import')
 def _grd_frame_import(
         infile,
         outfile,
@@ -128,6 +137,7 @@ def _grd_frame_import(
     return return_code
 
 
+@cached_step('grd_import_subset')
 def _grd_frame_import_subset(
         infile,
         outfile,
@@ -311,6 +321,41 @@ def _grd_subset_georegion(infile, outfile, logfile, georegion):
     return return_code
 
 
+def _border_noise_columns(
+        band,
+        cols,
+        rows,
+        from_right=False,
+        max_width=3000,
+        chunk_size=500,
+        threshold=100,
+        buffer=150
+):
+    '''Number of columns to set to 0 on one side of a GRD band
+
+    The column means are calculated as one vectorized profile per chunk of
+    columns, starting from the image edge. The first column with a mean
+    above the threshold marks the start of valid data, so that only the
+    chunks up to that column need to be read.
+    '''
+    max_width = min(max_width, cols)
+    for start in range(0, max_width, chunk_size):
+        size = min(chunk_size, max_width - start)
+        x_off = cols - start - size if from_right else start
+        col_means = np.mean(
+            band.ReadAsArray(x_off, 0, size, rows), axis=0, dtype=np.float64
+        )
+        # let the profile always start at the image edge
+        if from_right:
+            col_means = col_means[::-1]
+
+        valid_cols = np.flatnonzero(col_means > threshold)
+        if valid_cols.size > 0:
+            return min(start + valid_cols[0] + buffer, max_width)
+
+    return max_width
+
+
 def _grd_remove_border(infile):
     '''An OST function to remove GRD border noise from Sentinel-1 data
 
@@ -341,80 +386,44 @@ def _grd_remove_border(infile):
 
     # read raster file and get number of columns adn rows
     raster = gdal.Open(infile, gdal.GA_Update)
+    band = raster.GetRasterBand(1)
     cols = raster.RasterXSize
     rows = raster.RasterYSize
 
-    # create 3000xrows array for the left part of the image
-    array_left = np.array(raster.GetRasterBand(1).ReadAsArray(0,
-                                                              0, 3000, rows))
-
-    for x in range(3000):
-        # condition if more than 50 pixels within the line have values
-        # less than 500, delete the line
-        # if np.sum(np.where((array_left[:,x] < 200)
-        # & (array_left[:,x] > 0) , 1, 0)) <= 50:
-        if np.mean(array_left[:, x]) <= 100:
-            array_left[:, x].fill(0)
-        else:
-            z = x + 150
-            if z > 3000:
-                z = 3000
-            for y in range(x, z, 1):
-                array_left[:, y].fill(0)
-
-            cols_left = y
-            break
-
-    try:
-        cols_left
-    except NameError:
-        cols_left = 3000
-
-    # write array_left to disk
-    # logger.debug('INFO: Total amount of columns: {}'.format(cols_left))
-    # logger.debug('INFO: Number of colums set to 0 on the left side: '
-    #     '{}'.format(cols_left))
-    # raster.GetRasterBand(1).WriteArray(array_left[:, :+cols_left], 0, 0, 1)
-    raster.GetRasterBand(1).WriteArray(array_left[:, :+cols_left], 0, 0)
-
-    array_left = None
-
-    # create 2d array for the right part of the image (3000 columns and rows)
-    cols_last = cols - 3000
-    array_right = np.array(raster.GetRasterBand(1).ReadAsArray(cols_last,
-                                                               0, 3000, rows))
-
-    # loop through the array_right columns in opposite direction
-    for x in range(2999, 0, -1):
-
-        if np.mean(array_right[:, x]) <= 100:
-            array_right[:, x].fill(0)
-        else:
-            z = x - 150
-            if z < 0:
-                z = 0
-            for y in range(x, z, -1):
-                array_right[:, y].fill(0)
-
-            cols_right = y
-            break
-
-    try:
-        cols_right
-    except NameError:
-        cols_right = 0
-
-    #
-    col_right_start = cols - 3000 + cols_right
-    # logger.debug('INFO: Number of columns set to 0 on the'
-    #     'right side: {}'.format(3000 - cols_right))
-    # logger.debug('INFO: Amount of columns kept: {}'.format(col_right_start))
-    raster.GetRasterBand(1).WriteArray(array_right[:, cols_right:],
-                                       col_right_start, 0)
-    array_right = None
+    # left and right border
+    cols_left = _border_noise_columns(band, cols, rows)
+    cols_right = _border_noise_columns(band, cols, rows, from_right=True)
+
+    # only the border columns are written back
+    if cols_left > 0:
+        band.WriteArray(np.zeros((rows, cols_left), dtype=np.float32), 0, 0)
+    if cols_right > 0:
+        band.WriteArray(np.zeros((rows, cols_right), dtype=np.float32),
+                        cols - cols_right, 0)
+
+    band.FlushCache()
+    raster = None
     h.timer(currtime)
 
 
+def _grd_remove_border_pols(infiles, max_workers=None):
+    '''Removes the GRD border noise of all polarisations of a frame at once
+
+    Args:
+        infiles: list of ENVI style intensity files inside the *data folder
+        max_workers: number of threads (default: one per file)
+    '''
+    executor = Executor(executor='concurrent_threads',
+                        max_workers=max_workers or len(infiles)
+                        )
+    for task in executor.as_completed(
+            func=_grd_remove_border,
+            iterable=infiles
+    ):
+        task.result()
+
+
+@cached_step('grd_backscatter')
 def _grd_backscatter(
         infile,
         outfile,
@@ -787,6 +796,198 @@ def _grd_ls_mask(
     return return_code
 
 
+def _grd_fused_graph(
+        filelist,
+        outfile,
+        logfile,
+        graph_file,
+        resolution,
+        product_type='GTCgamma',
+        ls_outfile=None,
+        speckle_filter=False,
+        to_db=False,
+        border_noise=False,
+        dem='SRTM 1Sec HGT',
+        dem_file='',
+        resampling='BILINEAR_INTERPOLATION',
+        subset=None,
+        polarisation='VV,VH,HH,HV'
+):
+    '''Runs the whole GRD to ARD chain as one SNAP graph
+
+    This function chains import, (slice assembly,) border noise removal,
+    calibration, speckle filtering, layover/shadow mask, dB conversion and
+    terrain correction into a single graph, so that gpt is only started
+    once and no intermediate product is written to disk.
+
+    The graphs of the single steps are the same as for the step-wise
+    processing, except for the border noise removal, which uses SNAP's
+    Remove-GRD-Border-Noise operator instead of the OST routine.
+
+    Args:
+        filelist (list): one or more consecutive GRD scenes
+        outfile: string or os.path object for the output
+                 file written in BEAM-Dimap format
+        logfile: string or os.path object for the file
+                 where SNAP'S STDOUT/STDERR is written to
+        graph_file: string or os.path object for the generated graph
+        resolution (int): the resolution of the output product in meters
+        product_type (str): the product type of the output product
+                            i.e. RTC, GTCgamma or GTCsigma
+        ls_outfile: output of the Layover/Shadow mask
+                    (default: None, i.e. no mask is created)
+    '''
+
+    graph_dir = opj(OST_ROOT, 'graphs', 'S1_GRD2ARD')
+    backscatter_graphs = {
+        'RTC': '2_CalBeta_TF.xml',
+        'GTCgamma': '2_CalGamma.xml',
+        'GTCsigma': '2_CalSigma.xml'
+    }
+    if product_type not in backscatter_graphs:
+        logger.debug('ERROR: Wrong product type selected.')
+        sys.exit(103)
+
+    if dem_file != '':
+        with rasterio.open(dem_file, 'r') as dem_f:
+            dem_nodata = dem_f.nodata
+    else:
+        dem_nodata = 0.0
+
+    dem_params = dict(
+        dem=dem, dem_file=dem_file, dem_nodata=dem_nodata,
+        resampling=resampling
+    )
+
+    graph = Graph()
+
+    # import of all frames
+    imported = []
+    for file in filelist:
+        read = graph.add_read(file)
+        if subset is None:
+            imported.append(graph.add_template(
+                opj(graph_dir, '1_AO_TNR.xml'), read,
+                dict(polarisation=polarisation)
+            ))
+        else:
+            imported.append(graph.add_template(
+                opj(graph_dir, '1_AO_TNR_SUB.xml'), read,
+                dict(polarisation=polarisation, region=subset)
+            ))
+
+    node = imported[0]
+    if len(imported) > 1:
+        node = graph.add_node(
+            'SliceAssembly', sources=imported,
+            parameters={'selectedPolarisations': polarisation}
+        )
+
+    if border_noise and not subset:
+        node = graph.add_node(
+            'Remove-GRD-Border-Noise', sources=node,
+            parameters={'selectedPolarisations': None,
+                        'borderLimit': 500,
+                        'trimThreshold': 0.5}
+        )
+
+    node = graph.add_template(
+        opj(graph_dir, backscatter_graphs[product_type]), node, dem_params
+    )
+
+    if speckle_filter:
+        node = graph.add_node(
+            'Speckle-Filter', sources=node,
+            parameters={'filter': 'Refined Lee', 'estimateENL': True}
+        )
+
+    # the ls mask is a second output of the same graph
+    if ls_outfile:
+        ls_node = graph.add_template(
+            opj(graph_dir, '3_LSmap.xml'), node,
+            dict(dem_params, resol=resolution)
+        )
+        graph.add_write(ls_node, ls_outfile)
+
+    if to_db:
+        node = graph.add_node('LinearToFromdB', sources=node)
+
+    node = graph.add_template(
+        opj(graph_dir, '3_ML_TC.xml'), node,
+        dict(dem_params, resol=resolution, ml=int(int(resolution) / 10))
+    )
+    graph.add_write(node, outfile)
+    graph.write(graph_file)
+
+    logger.debug('INFO: Processing {} as single graph'.format(
+        ', '.join(os.path.basename(file) for file in filelist))
+    )
+
+    # get path to SNAP's command line executable gpt
+    gpt_file = h.gpt_path()
+    command = '{} {} -x -q {}'.format(
+        gpt_file, graph_file, get_scheduler().gpt_threads('grd_ard')
+    )
+
+    # run command and get return code
+    return_code = h.run_command(command, logfile)
+
+    # handle errors and logs
+    if return_code == 0:
+        logger.debug('INFO: Succesfully processed product')
+    else:
+        logger.debug('ERROR: Graph processing exited with an error. \
+                See {} for Snap Error output'.format(logfile))
+
+    return return_code
+
+
+def _move_ls_mask(infile, output_dir, out_prefix):
+    '''Checks the Layover/Shadow mask and moves it to the output_dir'''
+
+    # last check on ls data
+    return_code = h.check_out_dimap(infile, test_stats=False)
+    if return_code != 0:
+        return return_code
+
+    # move to final destination
+    out_ls_mask = opj(output_dir, '{}_LS'.format(out_prefix))
+
+    # delete original file sin case they exist
+    if os.path.exists(str(out_ls_mask) + '.dim'):
+        h.delete_dimap(out_ls_mask)
+
+    # move out of temp
+    shutil.move('{}.dim'.format(infile), '{}.dim'.format(out_ls_mask))
+    shutil.move('{}.data'.format(infile), '{}.data'.format(out_ls_mask))
+    return return_code
+
+
+def _move_final(infile, output_dir, out_prefix, product_type, temp_dir):
+    '''Checks the final product and moves it to the output_dir'''
+
+    # move to final destination
+    out_final = opj(output_dir, '{}_{}_TC'.format(out_prefix, product_type))
+
+    # remove file if exists
+    if os.path.exists(out_final + '.dim'):
+        h.delete_dimap(out_final)
+
+    return_code = h.check_out_dimap(infile)
+    if return_code != 0:
+        h.remove_folder_content(temp_dir)
+        return return_code
+
+    shutil.move('{}.dim'.format(infile), '{}.dim'.format(out_final))
+    shutil.move('{}.data'.format(infile), '{}.data'.format(out_final))
+
+    # write file, so we know this burst has been succesfully processed
+    check_file = opj(output_dir, '.processed')
+    with open(str(check_file), 'w') as file:
+        file.write('passed all tests \n')
+    return return_code
+
+
 def grd_to_ard(filelist,
                output_dir,
                out_prefix,
@@ -800,7 +1001,8 @@ def grd_to_ard(filelist,
                to_db,
                border_noise,
                subset=None,
-               polarisation='VV,VH,HH,HV'
+               polarisation='VV,VH,HH,HV',
+               fused_graph=False
                ):
     '''The main function for the grd to ard generation
 
@@ -822,6 +1024,8 @@ def grd_to_ard(filelist,
         resolution: the resolution of the output product in meters
         ls_mask: layover/shadow mask generation (Boolean)
         speckle_filter: speckle filtering (Boolean)
+        fused_graph: run all steps as one SNAP graph, without
+                     intermediate products on disk (Boolean)
 
     Returns:
         nothing
@@ -848,6 +1052,40 @@ def grd_to_ard(filelist,
     # Check out_prefix for empty spaces
     out_prefix = out_prefix.replace(' ', '_')
 
+    # all steps in one go
+    if fused_graph:
+        outfile = opj(temp_dir, '{}_{}_TC'.format(out_prefix, product_type))
+        ls_outfile = opj(temp_dir, '{}_ls_mask'.format(out_prefix))
+        return_code = _grd_fused_graph(
+            filelist,
+            outfile,
+            opj(output_dir, '{}_ARD.errLog'.format(out_prefix)),
+            opj(temp_dir, '{}_ARD.xml'.format(out_prefix)),
+            resolution,
+            product_type,
+            ls_outfile if ls_mask_create else None,
+            speckle_filter,
+            to_db,
+            border_noise,
+            dem,
+            dem_file,
+            resampling,
+            subset,
+            polarisation
+        )
+        if return_code != 0:
+            h.remove_folder_content(temp_dir)
+            return return_code
+
+        if ls_mask_create is True:
+            return_code = _move_ls_mask(ls_outfile, output_dir, out_prefix)
+            if return_code != 0:
+                h.remove_folder_content(temp_dir)
+                return return_code
+
+        return _move_final(outfile, output_dir, out_prefix, product_type,
+                           temp_dir)
+
     # slice assembly if more than one scene
     if len(filelist) > 1:
         for file in filelist:
@@ -907,6 +1145,7 @@ def grd_to_ard(filelist,
     # ---------------------------------------------------------------------
     # Remove the grd border noise from existent channels (OST routine)
     if border_noise and not subset:
+        infiles = []
         for polarisation in ['VV', 'VH', 'HH', 'HV']:
 
             infile = glob.glob(opj(
@@ -914,10 +1153,16 @@ def grd_to_ard(filelist,
                 'Intensity_{}.img'.format(polarisation)))
 
             if len(infile) == 1:
-                # run grd Border Remove
                 logger.debug('INFO: Remove border noise for {} band.'.format(
                     polarisation))
-                _grd_remove_border(infile[0])
+                infiles.append(infile[0])
+
+        # run grd Border Remove on all polarisations concurrently
+        if infiles:
+            _grd_remove_border_pols(infiles)
+            # the imported product changed, so it needs a new cache key
+            update_fingerprint(os.path.dirname(infiles[0])[:-5],
+                               'border_noise')
 
     # ----------------------
     # do the calibration
@@ -973,23 +1218,11 @@ def grd_to_ard(filelist,
             h.remove_folder_content(temp_dir)
             return return_code
 
-        # last check on ls data
-        return_code = h.check_out_dimap(outfile, test_stats=False)
+        return_code = _move_ls_mask(outfile, output_dir, out_prefix)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
             return return_code
 
-        # move to final destination
-        out_ls_mask = opj(output_dir, '{}_LS'.format(out_prefix))
-
-        # delete original file sin case they exist
-        if os.path.exists(str(out_ls_mask) + '.dim'):
-            h.delete_dimap(out_ls_mask)
-
-        # move out of temp
-        shutil.move('{}.dim'.format(outfile), '{}.dim'.format(out_ls_mask))
-        shutil.move('{}.data'.format(outfile), '{}.data'.format(out_ls_mask))
-
     # to db
     if to_db:
         logfile = opj(output_dir, '{}.linToDb.errLog'.format(out_prefix))
@@ -1024,27 +1257,5 @@ def grd_to_ard(filelist,
     # remove calibrated files
     h.delete_dimap(infile[:-4])
 
-    # move to final destination
-    out_final = opj(output_dir, '{}_{}_TC'.format(out_prefix, product_type))
-
-    # remove file if exists
-    if os.path.exists(out_final + '.dim'):
-        h.delete_dimap(out_final)
-
-    return_code = h.check_out_dimap(outfile)
-    if return_code != 0:
-        h.remove_folder_content(temp_dir)
-        return return_code
-
-    shutil.move('{}.dim'.format(outfile), '{}.dim'.format(out_final))
-    shutil.move('{}.data'.format(outfile), '{}.data'.format(out_final))
-
-    # write file, so we know this burst has been succesfully processed
-    if return_code == 0:
-        check_file = opj(output_dir, '.processed')
-        with open(str(check_file), 'w') as file:
-            file.write('passed all tests \n')
-        return return_code
-    else:
-        h.remove_folder_content(temp_dir)
-        h.remove_folder_content(output_dir)
+    return _move_final(outfile, output_dir, out_prefix, product_type,
+                       temp_dir)
@@ -167,6 +167,67 @@ HERBERT_USER = {'uname': 'herbert_thethird',
                 'asf_pword': 'q12w34er56ty7WER32P'
                 }
 
+# memory budget in MB for the block-wise numpy processing of raster stacks
+# (e.g. timescan metrics), shared by all worker threads
+PROCESSING_RAM_BUDGET = ENV.int('OST_PROCESSING_RAM_BUDGET', 4096)
+
+# persistent cache of intermediate GPT products (see ost.helpers.cache),
+# disabled as long as the maximum disk usage (in MB) is 0
+CACHE_DIR = ENV.str(
+    'OST_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.ost', 'cache')
+)
+CACHE_MAX_DISK_USAGE = ENV.int('OST_CACHE_MAX_DISK_USAGE', 0)
+
+# database of the bursts and footprints parsed from the scenes (see
+# ost.helpers.metadata), a file that persists and grows across projects,
+# e.g. ~/.ost/metadata.sqlite, disabled as long as the path is empty
+METADATA_STORE = ENV.str('OST_METADATA_STORE', '')
+
+# cached index of the scenes in download directories and on DIAS mounts
+# (see ost.helpers.scene_index), rescanned incrementally once older than
+# the maximum age in seconds; the index files persist across projects in
+# the directory, e.g. ~/.ost/scene_index, disabled as long as it is empty
+SCENE_INDEX_DIR = ENV.str('OST_SCENE_INDEX_DIR', '')
+SCENE_INDEX_MAX_AGE = ENV.int('OST_SCENE_INDEX_MAX_AGE', 10)
+
+# byte ranges of a product downloaded concurrently (see
+# ost.helpers.download), 1 downloads every product over a single stream
+DOWNLOAD_SEGMENTS = ENV.int('OST_DOWNLOAD_SEGMENTS', 4)
+
+# maximum concurrent connections per host over all downloads of a batch,
+# and for hosts not listed
+DOWNLOAD_HOST_CONNECTIONS = ENV.dict(
+    'OST_DOWNLOAD_HOST_CONNECTIONS',
+    {'datapool.asf.alaska.edu': 10, 'scihub.copernicus.eu': 2,
+     'peps.cnes.fr': 4}
+)
+DOWNLOAD_MAX_CONNECTIONS = ENV.int('OST_DOWNLOAD_MAX_CONNECTIONS', 4)
+
+# run the single ARD processing steps as one generated SNAP graph
+# (see ost.helpers.graph), unless set otherwise in the ARD parameters
+GPT_FUSED_GRAPH = ENV.bool('OST_GPT_FUSED_GRAPH', False)
+
+# memory budget in MB shared by all GPT jobs and pool workers (see
+# ost.helpers.scheduler), 0 uses 75% of the physical memory
+GPT_RAM_BUDGET = ENV.int('OST_GPT_RAM_BUDGET', 0)
+
+# cores and temporary disk space (MB) the resource scheduler may use
+# (see ost.helpers.scheduler), 0 uses all cores / 90% of free space
+SCHEDULER_CORES = ENV.int('OST_SCHEDULER_CORES', 0)
+SCHEDULER_DISK_BUDGET = ENV.int('OST_SCHEDULER_DISK_BUDGET', 0)
+
+# filter and export time-series block-wise in numpy (see
+# ost.multitemporal.mt_speckle) instead of via GPT stacks
+MT_SPECKLE_NATIVE = ENV.bool('OST_MT_SPECKLE_NATIVE', True)
+
+# mosaic with the native engine (see ost.mosaic.mosaic) instead of
+# OTB's otbcli_Mosaic, which is used only if installed
+MOSAIC_NATIVE = ENV.bool('OST_MOSAIC_NATIVE', True)
+
+# write every time-series into a chunked datacube as well (see
+# ost.multitemporal.datacube), from which the timescans are calculated
+TIMESERIES_DATACUBE = ENV.bool('OST_TIMESERIES_DATACUBE', False)
+
 GTIFF_OST_PROFILE = {
     "driver": "GTiff",
     "blockysize": 256,
@@ -176,6 +237,23 @@ GTIFF_OST_PROFILE = {
     "interleave": "band"
 }
 
+# cloud optimized GeoTIFFs, i.e. with internal overviews in front of the
+# image data, the predictor is chosen by datatype if set to auto
+COG_OST_PROFILE = dict(
+    GTIFF_OST_PROFILE,
+    blockysize=512,
+    blockxsize=512,
+    predictor="auto",
+    overviews=[2, 4, 8, 16, 32],
+    overview_resampling="average",
+    cog=True
+)
+
+OUTPUT_PROFILES = {"GTiff": GTIFF_OST_PROFILE, "COG": COG_OST_PROFILE}
+
+# profile of all GeoTIFFs written by OST (see ost.helpers.raster.gtiff_profile)
+OUTPUT_PROFILE = ENV.str('OST_OUTPUT_PROFILE', 'GTiff')
+
 SNAP_S1_RESAMPLING_METHODS = [
     'NEAREST_NEIGHBOUR',
     'BILINEAR_INTERPOLATION',
@@ -2,6 +2,7 @@ import os
 import pytest
 
 from ost import Sentinel1Scene
+from ost.helpers import metadata, scene_index
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 TESTDATA_DIR = os.path.join(SCRIPT_DIR, "testdata")
@@ -10,6 +11,17 @@ CACHE_DIR = os.path.join(TESTDATA_DIR, "cache")
 FAKE_GPT_DIR = os.path.join(TESTDATA_DIR, "helpers_data")
 
 
+@pytest.fixture(autouse=True)
+def isolated_stores(tmp_path, monkeypatch):
+    # the metadata store and scene index of a test never touch the ones
+    # configured for the user
+    monkeypatch.setattr(metadata, 'METADATA_STORE',
+                        str(tmp_path / 'metadata.sqlite'))
+    monkeypatch.setattr(scene_index, 'SCENE_INDEX_DIR',
+                        str(tmp_path / 'scene_index'))
+    monkeypatch.setattr(scene_index, '_INDICES', {})
+
+
 @pytest.fixture
 def s1_id():
     return 'S1A_IW_GRDH_1SDV_20191116T170638_20191116T170703_029939_036AAB_070F'
@@ -0,0 +1,192 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from ost.multitemporal import ard_to_ts, mt_speckle
+
+DATES = ['20200101', '20200113', '20200125', '20200206']
+
+
+def _ard_products(temp, dates):
+    # ARD products of which only the image of the VV band exists, the
+    # date is taken from the file name
+    rng = np.random.default_rng(9)
+    dims = []
+    for date in dates:
+        dim_file = os.path.join(temp, 'ard', '{}_BS.dim'.format(date))
+        data_dir = '{}.data'.format(dim_file[:-4])
+        os.makedirs(data_dir)
+        with rasterio.open(
+                os.path.join(data_dir, 'Gamma0_ma0_VV.img'), 'w',
+                driver='GTiff', width=60, height=50, count=1,
+                dtype='float32', crs='EPSG:32633', nodata=0,
+                transform=from_origin(400000, 5000000, 20, 20)
+        ) as dst:
+            dst.write(rng.gamma(1, 0.1, (50, 60)).astype('float32'), 1)
+        dims.append(dim_file)
+    return dims
+
+
+def _read(file):
+    with rasterio.open(file) as src:
+        return src.read(1)
+
+
+def _listing(out_dir):
+    # the GeoTIFFs of the dates, without the statistics of the filter
+    return sorted(file for file in os.listdir(out_dir)
+                  if file.endswith('.tif') and not file.startswith('.'))
+
+
+def test_renumber_ts():
+    with TemporaryDirectory() as temp:
+        files = []
+        for name in ['1.a', '2.b', '3.c']:
+            files.append(os.path.join(temp, name))
+            with open(files[-1], 'w') as file:
+                file.write(name)
+
+        # old and new names overlap
+        ard_to_ts._renumber_ts([(files[0], files[1]), (files[1], files[2]),
+                                (files[2], files[0])])
+        assert sorted(os.listdir(temp)) == ['1.a', '2.b', '3.c']
+        for new, old in zip(files, ['3.c', '1.a', '2.b']):
+            with open(new) as file:
+                assert file.read() == old
+
+        ard_to_ts._renumber_ts([(files[0], files[0]),
+                                (files[1], os.path.join(temp, '4.b'))])
+        assert sorted(os.listdir(temp)) == ['1.a', '3.c', '4.b']
+
+
+def test_native_ts_append():
+    with TemporaryDirectory() as temp:
+        dims = _ard_products(temp, DATES)
+        out_dir = os.path.join(temp, 'Timeseries')
+        os.makedirs(out_dir)
+
+        first = ard_to_ts._get_native_ts(
+            [dims[0], dims[2], dims[3]], out_dir, 'VV'
+        )
+        assert [os.path.basename(file) for file in first] == [
+            '1.20200101.TC.VV.tif', '2.20200125.TC.VV.tif',
+            '3.20200206.TC.VV.tif'
+        ]
+        filtered = _read(first[1])
+
+        # a date in between, and the dates of the time-series again
+        outfiles = ard_to_ts._get_native_ts(dims, out_dir, 'VV', append=True)
+        assert _listing(out_dir) == [
+            '{}.{}.TC.VV.tif'.format(i, date)
+            for i, date in enumerate(DATES, start=1)
+        ]
+        assert outfiles == [os.path.join(out_dir, file)
+                            for file in _listing(out_dir)]
+        # the existing dates are renumbered only
+        np.testing.assert_array_equal(_read(outfiles[2]), filtered)
+
+        # the new date is filtered with all dates
+        full_dir = os.path.join(temp, 'full')
+        os.makedirs(full_dir)
+        full = ard_to_ts._get_native_ts(dims, full_dir, 'VV')
+        np.testing.assert_allclose(_read(outfiles[1]), _read(full[1]),
+                                   rtol=1e-5)
+
+        # nothing to append
+        assert ard_to_ts._get_native_ts(
+            dims, out_dir, 'VV', append=True) == outfiles
+
+
+def test_native_ts_append_failure(monkeypatch):
+    with TemporaryDirectory() as temp:
+        dims = _ard_products(temp, DATES)
+        out_dir = os.path.join(temp, 'Timeseries')
+        os.makedirs(out_dir)
+        ard_to_ts._get_native_ts([dims[0], dims[2]], out_dir, 'VV')
+        before = _listing(out_dir)
+
+        def _fail(infiles, outfiles, **kwargs):
+            for outfile in outfiles:
+                if outfile:
+                    open(outfile, 'w').close()
+            raise RuntimeError('filter failed')
+
+        monkeypatch.setattr(mt_speckle, 'mt_speckle_to_gtiff', _fail)
+        with pytest.raises(RuntimeError):
+            ard_to_ts._get_native_ts(dims, out_dir, 'VV', append=True)
+        # the time-series is left as it was
+        assert _listing(out_dir) == before
+
+
+def _stack(temp, names):
+    # a GPT stack, of which only the names of the images matter
+    in_stack = os.path.join(temp, 'stack')
+    os.makedirs('{}.data'.format(in_stack))
+    for name in names:
+        open(os.path.join('{}.data'.format(in_stack), name), 'w').close()
+    return in_stack
+
+
+def _exported(monkeypatch):
+    # the input and output files of the export, in their order
+    exports = []
+
+    def _export_dates(files, extent, export_args, max_workers=None):
+        exports.extend(
+            (os.path.basename(infile), os.path.basename(outfile))
+            for infile, outfile in files
+        )
+        return [outfile for _, outfile in files]
+
+    monkeypatch.setattr(ard_to_ts, '_export_dates', _export_dates)
+    return exports
+
+
+def test_regular_ts_files(monkeypatch):
+    exports = _exported(monkeypatch)
+    with TemporaryDirectory() as temp:
+        in_stack = _stack(temp, [
+            'Gamma0_VV_mst_13Jan2020.img', 'Gamma0_VH_mst_13Jan2020.img',
+            'Gamma0_VV_slv1_01Feb2020.img', 'Gamma0_VH_slv1_01Feb2020.img',
+            'Gamma0_VV_slv2_25Dec2019.img', 'Gamma0_VH_slv2_25Dec2019.img'
+        ])
+        outfiles = ard_to_ts._get_regular_ts(in_stack, temp, 'VV')
+
+    # numbered by date, not by the names of the months
+    assert exports == [
+        ('Gamma0_VV_slv2_25Dec2019.img', '1.20191225.TC.VV.tif'),
+        ('Gamma0_VV_mst_13Jan2020.img', '2.20200113.TC.VV.tif'),
+        ('Gamma0_VV_slv1_01Feb2020.img', '3.20200201.TC.VV.tif')
+    ]
+    assert [os.path.basename(file) for file in outfiles] == \
+        [outfile for _, outfile in exports]
+
+
+def test_coh_ts_files(monkeypatch):
+    exports = _exported(monkeypatch)
+    with TemporaryDirectory() as temp:
+        # sorting the master and slave dates separately would pair the
+        # master of 13 January with the slave of 2 February
+        in_stack = _stack(temp, [
+            'coh_IW1_VV_13Jan2020_14Feb2020.img',
+            'coh_IW1_VH_13Jan2020_14Feb2020.img',
+            'coh_IW1_VV_01Feb2020_02Feb2020.img',
+            'coh_IW1_VH_01Feb2020_02Feb2020.img',
+            'coh_IW1_VV_25Dec2019_13Jan2020.img'
+        ])
+        outfiles = ard_to_ts._get_coh_ts(in_stack, temp, 'VV')
+
+    assert exports == [
+        ('coh_IW1_VV_25Dec2019_13Jan2020.img',
+         '1.20191225.20200113.coh.VV.tif'),
+        ('coh_IW1_VV_13Jan2020_14Feb2020.img',
+         '2.20200113.20200214.coh.VV.tif'),
+        ('coh_IW1_VV_01Feb2020_02Feb2020.img',
+         '3.20200201.20200202.coh.VV.tif')
+    ]
+    assert [os.path.basename(file) for file in outfiles] == \
+        [outfile for _, outfile in exports]
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from ost.helpers.bursts import cluster_anx_time
+
+
+def test_cluster_anx_time():
+    gdf = pd.DataFrame({
+        'Track': ['117'] * 7 + ['44'] * 2,
+        'SwathID': ['IW1'] * 5 + ['IW2'] * 2 + ['IW1'] * 2,
+        'AnxTime': [12345, 12346, 12346, 12373, 12401,
+                    12345, 12347, 12346, 12347],
+    })
+    snapped = cluster_anx_time(gdf)
+
+    # the most frequent value of a cluster within the track and swath
+    assert list(snapped[:5]) == [12346, 12346, 12346, 12373, 12401]
+    # gaps larger than the tolerance separate clusters
+    assert list(snapped[5:7]) == [12345, 12347]
+    # other tracks are clustered on their own, ties go to the smaller
+    assert list(snapped[7:]) == [12346, 12346]
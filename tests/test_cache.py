@@ -0,0 +1,65 @@
+import os
+from tempfile import TemporaryDirectory
+
+from ost.helpers import cache
+from ost.helpers.cache import ProductCache, cached_step, product_fingerprint
+
+
+def _fake_dimap(prefix, content='abc'):
+    name = os.path.basename(prefix)
+    os.makedirs('{}.data'.format(prefix), exist_ok=True)
+    with open('{}.dim'.format(prefix), 'w') as file:
+        file.write('<DATA_FILE_PATH href="{}.data/band.hdr" />'.format(name))
+    with open(os.path.join('{}.data'.format(prefix), 'band.img'), 'w') as file:
+        file.write(content)
+
+
+def test_cache_store_fetch_evict():
+    with TemporaryDirectory() as temp:
+        product_cache = ProductCache(os.path.join(temp, 'cache'), 1)
+        product = os.path.join(temp, 'first')
+        _fake_dimap(product)
+
+        key = product_cache.key('step', product, [1, 'VV'])
+        product_cache.store(key, product)
+
+        restored = os.path.join(temp, 'second')
+        assert product_cache.fetch(key, restored)
+        with open('{}.dim'.format(restored)) as file:
+            assert 'second.data/band.hdr' in file.read()
+        # the key travels with the restored product
+        assert product_fingerprint(restored) == key
+
+        # a large entry pushes the least recently used one out
+        big = os.path.join(temp, 'big')
+        _fake_dimap(big, content='x' * 1048576)
+        product_cache.store('big', big)
+        assert not product_cache.fetch(key, restored)
+
+
+def test_cached_step(monkeypatch):
+    calls = []
+
+    @cached_step('test')
+    def _step(infile, outfile, logfile, param):
+        calls.append(param)
+        _fake_dimap(outfile, content=str(param))
+        return 0
+
+    with TemporaryDirectory() as temp:
+        monkeypatch.setattr(cache, 'CACHE_DIR', os.path.join(temp, 'cache'))
+        monkeypatch.setattr(cache, 'CACHE_MAX_DISK_USAGE', 10)
+
+        infile = os.path.join(temp, 'input')
+        _fake_dimap(infile)
+
+        assert _step(infile, os.path.join(temp, 'out_a'), None, 1) == 0
+        assert _step(infile, os.path.join(temp, 'out_b'), None, 1) == 0
+        assert _step(infile, os.path.join(temp, 'out_c'), None, 2) == 0
+        assert calls == [1, 2]
+        assert os.path.isfile(os.path.join(temp, 'out_b.data', 'band.img'))
+
+        # in-place changes of the input invalidate the cached results
+        cache.update_fingerprint(infile, 'modified')
+        _step(infile, os.path.join(temp, 'out_d'), None, 1)
+        assert calls == [1, 2, 1]
@@ -0,0 +1,95 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from ost.multitemporal import datacube, timescan
+
+DATES = ['20200103', '20200115', '20200127', '20200208', '20200220']
+
+
+def _write_timeseries(timeseries_dir, stack):
+    for i, (date, array) in enumerate(zip(DATES, stack), start=1):
+        with rasterio.open(
+                os.path.join(timeseries_dir, '{}.{}.TC.VV.tif'.format(i, date)),
+                'w', driver='GTiff', width=stack.shape[2],
+                height=stack.shape[1], count=1, dtype='float32',
+                crs='EPSG:32633', nodata=0,
+                transform=from_origin(400000, 5000000, 20, 20)
+        ) as dst:
+            dst.write(array, 1)
+
+
+def test_timeseries_to_datacube():
+    stack = np.random.default_rng(3).gamma(
+        2, 0.05, (5, 70, 90)
+    ).astype('float32')
+    with TemporaryDirectory() as temp:
+        _write_timeseries(temp, stack)
+        cube_file = datacube.timeseries_to_datacube(
+            temp, 'TC', 'VV', chunk_size=32, ram_budget=0.01
+        )
+        assert cube_file == os.path.join(temp, 'Timeseries.TC.VV.zarr')
+
+        with datacube.Datacube(cube_file) as cube:
+            assert cube.dates == DATES
+            assert (cube.count, cube.height, cube.width) == (5, 70, 90)
+            # chunks hold the full time profile
+            assert cube._data.chunks == (5, 32, 32)
+            assert cube.block_shapes[0] == (32, 32)
+            assert cube.transform == from_origin(400000, 5000000, 20, 20)
+            assert cube.crs.to_epsg() == 32633
+
+            np.testing.assert_array_equal(cube.read(), stack)
+            window = Window(10, 20, 40, 30)
+            np.testing.assert_array_equal(
+                cube.read([2, 4], window=window),
+                stack[[1, 3], 20:50, 10:50]
+            )
+            np.testing.assert_array_equal(
+                cube.read(3, window=window), stack[2, 20:50, 10:50]
+            )
+
+
+def test_mt_metrics_from_datacube():
+    stack = np.random.default_rng(4).gamma(
+        2, 0.05, (5, 60, 50)
+    ).astype('float32')
+    metrics = ['avg', 'std', 'max', 'count']
+    with TemporaryDirectory() as temp:
+        _write_timeseries(temp, stack)
+        cube_file = datacube.timeseries_to_datacube(temp, chunk_size=16)
+
+        control = os.path.join(temp, 'stack.tif')
+        with rasterio.open(
+                control, 'w', driver='GTiff', width=50, height=60, count=5,
+                dtype='float32', crs='EPSG:32633',
+                transform=from_origin(400000, 5000000, 20, 20)
+        ) as dst:
+            dst.write(stack)
+
+        timescan.mt_metrics(cube_file, os.path.join(temp, 'cube'),
+                            list(metrics), max_workers=2)
+        timescan.mt_metrics(control, os.path.join(temp, 'control'),
+                            list(metrics), max_workers=2)
+        # the dates of the datacube are the keys of incremental updates
+        timescan.mt_metrics(cube_file, os.path.join(temp, 'incremental'),
+                            list(metrics), incremental=True)
+        with rasterio.open(
+                os.path.join(temp, '.incremental.stats.tif')
+        ) as src:
+            assert src.tags()['LAYERS'] == ','.join(DATES)
+
+        for metric in metrics:
+            results = []
+            for prefix in ['cube', 'control', 'incremental']:
+                with rasterio.open(os.path.join(
+                        temp, '{}.{}.tif'.format(prefix, metric)
+                )) as src:
+                    results.append(src.read(1))
+                    assert src.crs.to_epsg() == 32633
+            np.testing.assert_allclose(results[0], results[1], rtol=1e-6)
+            np.testing.assert_allclose(results[2], results[1], rtol=1e-5)
@@ -0,0 +1,250 @@
+import io
+import os
+import re
+import zipfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+
+import pytest
+import requests
+
+from ost.helpers import download
+
+
+def _product():
+    # a zip archive, as the products are
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('manifest.safe', os.urandom(299000))
+    return buffer.getvalue()
+
+
+CONTENT = _product()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    # a file server supporting Range requests, of which the first
+    # responses break off after a number of bytes
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.get('Range'))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self._respond(server)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _respond(self, server):
+        if self.path != '/product.zip':
+            self.send_error(404)
+            return
+        with server.lock:
+            error = server.errors > 0
+            server.errors -= error
+        if error:
+            self.send_error(503)
+            return
+
+        start, end = 0, len(CONTENT) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(CONTENT)))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(CONTENT)
+            ))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        body = CONTENT[start:end + 1]
+        with server.lock:
+            # not the probes of segmented downloads
+            breaks = server.breaks > 0 and len(body) > 1
+            server.breaks -= breaks
+        if breaks:
+            body = body[:len(body) // 3]
+        # slowly, so that connections overlap (without time.sleep,
+        # which the tests switch off for the download retries)
+        for i in range(0, len(body), 16384):
+            if i:
+                threading.Event().wait(server.delay)
+            self.wfile.write(body[i:i + 16384])
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def _server(breaks=0, delay=0, errors=0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    server.daemon_threads = True
+    server.requests, server.breaks, server.delay = [], breaks, delay
+    server.errors = errors
+    server.active, server.max_active = 0, 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, 'http://127.0.0.1:{}'.format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _read(filename):
+    with open(filename, 'rb') as file:
+        return file.read()
+
+
+def test_download_resumes(monkeypatch):
+    monkeypatch.setattr(download.time, 'sleep', lambda seconds: None)
+    with TemporaryDirectory() as temp, _server(breaks=2) as (server, url):
+        filename = os.path.join(temp, 'product.zip')
+        download.download('{}/product.zip'.format(url), filename,
+                          chunk_size=1000, progress=False, segments=1)
+
+        assert _read(filename) == CONTENT
+        assert not os.path.exists(download.part_file(filename))
+        # the broken downloads are continued where they stopped
+        assert len(server.requests) == 3 and server.requests[0] is None
+        size = len(CONTENT)
+        offsets = [int(request[6:-1]) for request in server.requests[1:]]
+        assert 0 < offsets[0] <= size // 3 < offsets[1]
+        assert offsets[1] <= size // 3 + (size - size // 3) // 3
+
+
+def test_download_part_file():
+    with TemporaryDirectory() as temp, _server() as (server, url):
+        filename = os.path.join(temp, 'product.zip')
+        # left over from an earlier run
+        with open(download.part_file(filename), 'wb') as file:
+            file.write(CONTENT[:250000])
+        download.download('{}/product.zip'.format(url), filename,
+                          progress=False, segments=1)
+        assert _read(filename) == CONTENT
+        assert server.requests == ['bytes=250000-']
+
+        # a complete .part file is only renamed
+        os.rename(filename, download.part_file(filename))
+        server.requests.clear()
+        download.download('{}/product.zip'.format(url), filename,
+                          progress=False, segments=1)
+        assert _read(filename) == CONTENT
+        assert server.requests == ['bytes={}-'.format(len(CONTENT))]
+
+        with pytest.raises(requests.HTTPError):
+            download.download('{}/missing.zip'.format(url),
+                              os.path.join(temp, 'missing.zip'))
+
+
+def test_download_product():
+    with TemporaryDirectory() as temp, _server() as (server, url):
+        filename = os.path.join(temp, 'product.zip')
+        marker = download.download_product(
+            '{}/product.zip'.format(url), filename
+        )
+        assert marker == '{}.downloaded'.format(filename)
+        assert os.path.isfile(marker) and _read(filename) == CONTENT
+
+        # products missing from the archive are returned by name
+        assert download.download_product(
+            '{}/missing.zip'.format(url), os.path.join(temp, 'missing.zip')
+        ) == 'missing.zip'
+
+
+def _segments(monkeypatch, host_connections=4):
+    monkeypatch.setattr(download, 'SEGMENT_MIN_SIZE', 50000)
+    monkeypatch.setattr(download, 'CHECKPOINT_SIZE', 10000)
+    monkeypatch.setattr(download, 'DOWNLOAD_HOST_CONNECTIONS',
+                        {'127.0.0.1': host_connections})
+    monkeypatch.setattr(download, '_HOST_SLOTS', {})
+    monkeypatch.setattr(download.time, 'sleep', lambda seconds: None)
+
+
+def _starts(requests):
+    return sorted(int(request[6:].split('-')[0]) for request in requests)
+
+
+def test_segmented_download(monkeypatch):
+    _segments(monkeypatch)
+    with TemporaryDirectory() as temp, _server(breaks=4) as (server, url):
+        filename = os.path.join(temp, 'product.zip')
+        # all segments break off, and are not retried
+        with pytest.raises(requests.RequestException):
+            download.download('{}/product.zip'.format(url), filename,
+                              chunk_size=1000, progress=False, segments=4,
+                              retries=0)
+        assert os.path.isfile(download.segments_file(filename))
+        assert os.path.getsize(download.part_file(filename)) == len(CONTENT)
+        size = len(CONTENT)
+        assert server.requests[0] == 'bytes=0-0'
+        assert _starts(server.requests[1:]) == [
+            size * i // 4 for i in range(4)
+        ]
+
+        # the next run continues the segments
+        server.requests.clear()
+        download.download('{}/product.zip'.format(url), filename,
+                          progress=False, segments=4)
+        assert _read(filename) == CONTENT
+        assert not os.path.exists(download.segments_file(filename))
+        assert not os.path.exists(download.part_file(filename))
+        starts = _starts(server.requests[1:])
+        assert len(starts) == 4
+        assert all(size * i // 4 < start < size * (i + 1) // 4
+                   for i, start in enumerate(starts))
+
+
+def test_segmented_download_probe(monkeypatch):
+    _segments(monkeypatch)
+    with TemporaryDirectory() as temp, _server(errors=2) as (server, url):
+        filename = os.path.join(temp, 'product.zip')
+        # server errors on the range request to the size are retried
+        download.download('{}/product.zip'.format(url), filename,
+                          progress=False, segments=4)
+        assert _read(filename) == CONTENT
+        assert server.requests[:3] == ['bytes=0-0'] * 3
+        assert len(server.requests) == 7
+
+        server.errors = 1
+        with pytest.raises(requests.HTTPError):
+            download.download('{}/product.zip'.format(url),
+                              os.path.join(temp, 'other.zip'),
+                              progress=False, segments=4, retries=0)
+
+
+def test_segmented_host_connections(monkeypatch):
+    _segments(monkeypatch, host_connections=2)
+    with TemporaryDirectory() as temp, _server(delay=0.01) as (server, url):
+        filenames = [os.path.join(temp, '{}.zip'.format(i)) for i in range(3)]
+        threads = [
+            threading.Thread(target=download.download, args=(
+                '{}/product.zip'.format(url), filename
+            ), kwargs={'progress': False, 'segments': 4})
+            for filename in filenames
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for filename in filenames:
+            assert _read(filename) == CONTENT
+        # 3 products of 4 segments over 2 connections
+        assert len(server.requests) == 15
+        assert server.max_active == 2
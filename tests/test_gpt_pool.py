@@ -0,0 +1,42 @@
+import os
+import shlex
+
+from ost.helpers import gpt_pool
+from ost.helpers.gpt_pool import GPTPool
+
+
+def _worker_state(item):
+    return os.getpid(), gpt_pool.in_worker(), os.environ['_JAVA_OPTIONS']
+
+
+def test_parse_gpt_args():
+    command = 'gpt Speckle-Filter -x -q 8 -PestimateENL=true ' \
+              '-Pfilter=\'Refined Lee\' -t \'/tmp/out\' \'/tmp/in.dim\''
+    graph, parameters, target, sources = gpt_pool._parse_gpt_args(
+        shlex.split(command)
+    )
+    assert graph == 'Speckle-Filter'
+    assert parameters == {'estimateENL': 'true', 'filter': 'Refined Lee'}
+    assert target == '/tmp/out'
+    assert sources == ['/tmp/in.dim']
+
+
+def test_gpt_pool_workers():
+    threads, memory = gpt_pool.worker_resources(2, ram_budget=4096)
+    assert memory == 2048
+    assert threads == max(1, os.cpu_count() // 2)
+
+    with GPTPool(max_workers=2, ram_budget=4096) as pool:
+        results = [
+            task.result()
+            for task in pool.as_completed(_worker_state, range(10))
+        ]
+
+    # jobs are run by the same long-lived workers
+    assert len(set(pid for pid, _, _ in results)) <= 2
+    assert all(in_worker for _, in_worker, _ in results)
+    assert all('-Xmx2048M' in options for _, _, options in results)
+
+    # the main process is not a worker and keeps its commands
+    assert not gpt_pool.in_worker()
+    assert gpt_pool.worker_command('gpt a.xml -q 16') == 'gpt a.xml -q 16'
@@ -0,0 +1,122 @@
+import os
+from tempfile import TemporaryDirectory
+from xml.etree import ElementTree as ET
+
+from ost.helpers.graph import Graph
+from ost.helpers.scheduler import get_scheduler
+from ost.s1_to_ard import burst_to_ard, grd_to_ard
+from ost.settings import OST_ROOT
+
+GRD_GRAPHS = os.path.join(OST_ROOT, 'graphs', 'S1_GRD2ARD')
+
+
+def test_graph_chains_templates():
+    graph = Graph()
+    imported = [
+        graph.add_template(
+            os.path.join(GRD_GRAPHS, '1_AO_TNR.xml'),
+            graph.add_read(file), dict(polarisation='VV,VH')
+        )
+        for file in ['first.zip', 'second.zip']
+    ]
+    node = graph.add_node('SliceAssembly', sources=imported)
+    node = graph.add_template(
+        os.path.join(GRD_GRAPHS, '3_ML_TC.xml'), node,
+        dict(resol=20, ml=2, dem='SRTM 1Sec HGT', dem_file='',
+             dem_nodata=0.0, resampling='BILINEAR_INTERPOLATION')
+    )
+    graph.add_write(node, 'out')
+
+    root = ET.fromstring(graph.to_string())
+    nodes = {n.get('id'): n for n in root.findall('node')}
+    assert len(nodes) == len(graph.node_ids) == 10
+
+    # all sources refer to nodes of the graph
+    for n in nodes.values():
+        for source in n.find('sources'):
+            assert source.get('refid') in nodes
+
+    # second template got its own ids and the second Read as source
+    assert imported == ['ThermalNoiseRemoval', 'ThermalNoiseRemoval(2)']
+    orbit = nodes['Apply-Orbit-File(2)']
+    assert orbit.find('sources')[0].get('refid') == 'Read(2)'
+    assert nodes['Read(2)'].findtext('parameters/file') == 'second.zip'
+
+    # multiple sources and filled in parameters
+    assert [s.tag for s in nodes['SliceAssembly'].find('sources')] == \
+        ['sourceProduct', 'sourceProduct.1']
+    assert nodes['Multilook'].findtext('parameters/nRgLooks') == '2'
+    assert nodes['Write'].find('sources')[0].get('refid') == \
+        'Terrain-Correction'
+
+
+def test_grd_fused_graph(monkeypatch):
+    commands = []
+    monkeypatch.setattr(grd_to_ard.h, 'gpt_path', lambda: 'gpt')
+    monkeypatch.setattr(grd_to_ard.h, 'run_command',
+                        lambda command, logfile: commands.append(command) or 0)
+
+    with TemporaryDirectory() as temp:
+        graph_file = os.path.join(temp, 'grd.xml')
+        return_code = grd_to_ard._grd_fused_graph(
+            ['first.zip', 'second.zip'], 'out', 'grd.err_log', graph_file,
+            20, ls_outfile='out_ls', speckle_filter=True, to_db=True
+        )
+        assert return_code == 0
+        # gpt gets the threads of the scheduler, as the step-wise jobs
+        assert commands == ['gpt {} -x -q {}'.format(
+            graph_file, get_scheduler().gpt_threads('grd_ard')
+        )]
+        root = ET.parse(graph_file).getroot()
+    writes = [n for n in root.findall('node')
+              if n.findtext('operator') == 'Write']
+    assert len(writes) == 2
+
+
+def test_burst_fused_graph(monkeypatch):
+    commands = []
+    monkeypatch.setattr(burst_to_ard.h, 'gpt_path', lambda: 'gpt')
+    monkeypatch.setattr(burst_to_ard.h, 'run_command',
+                        lambda command, logfile: commands.append(command) or 0)
+
+    with TemporaryDirectory() as temp:
+        graph_file = os.path.join(temp, 'burst.xml')
+        return_code = burst_to_ard._fused_graph(
+            'slc.zip', 'out_bs', 'burst.err_log', graph_file, 'IW1', 3,
+            resolution=20, product_type='GTCgamma', speckle_filter=True,
+            to_db=True, out_ls='out_ls', out_ha_alpha='out_ha_alpha',
+            pol_speckle_filter=True, region='POLYGON ((0 0, 1 0, 1 1, 0 0))'
+        )
+        assert return_code == 0
+        # gpt is started once, with the generated graph
+        assert commands == ['gpt {} -x -q {}'.format(
+            graph_file, get_scheduler().gpt_threads('burst_ard')
+        )]
+        root = ET.parse(graph_file).getroot()
+
+    nodes = {n.get('id'): n for n in root.findall('node')}
+    sources = {
+        node_id: [s.get('refid') for s in n.find('sources')]
+        for node_id, n in nodes.items()
+    }
+    for refs in sources.values():
+        assert all(ref in nodes for ref in refs)
+
+    assert nodes['Read'].findtext('parameters/file') == 'slc.zip'
+    assert nodes['TOPSAR-Split'].findtext('parameters/subswath') == 'IW1'
+    # the backscatter chain
+    assert sources['Speckle-Filter'] == ['Subset']
+    assert sources['LinearToFromdB'] == ['Speckle-Filter']
+    # H-A-alpha, the Layover/Shadow mask and the backscatter are written
+    writes = {
+        n.findtext('parameters/file'): sources[node_id][0]
+        for node_id, n in nodes.items() if n.findtext('operator') == 'Write'
+    }
+    assert set(writes) == {'out_bs', 'out_ls', 'out_ha_alpha'}
+    assert sources[writes['out_ha_alpha']] == ['Polarimetric-Decomposition']
+    assert sources['Polarimetric-Speckle-Filter'] == ['TOPSAR-Deburst']
+    assert sources[writes['out_ls']] == ['SAR-Simulation']
+    assert sources['SAR-Simulation'] == ['LinearToFromdB']
+    assert sources[writes['out_bs']] == ['LinearToFromdB']
+    assert nodes[writes['out_bs']].findtext(
+        'parameters/pixelSpacingInMeter') == '20'
@@ -5,6 +5,80 @@ from shapely.geometry import box
 from tempfile import TemporaryDirectory
 
 from ost.helpers.utils import _zip_s1_safe_dir
+from ost.s1_to_ard import grd_to_ard
+
+
+class _Band():
+    # the part of a gdal band used by the border noise removal
+    def __init__(self, array):
+        self.array = array
+        self.read_cols = 0
+
+    def ReadAsArray(self, x_off, y_off, x_size, y_size):
+        self.read_cols += x_size
+        return self.array[y_off:y_off + y_size, x_off:x_off + x_size].copy()
+
+    def WriteArray(self, array, x_off, y_off):
+        rows, cols = array.shape
+        self.array[y_off:y_off + rows, x_off:x_off + cols] = array
+
+    def FlushCache(self):
+        pass
+
+
+class _Raster():
+    def __init__(self, array):
+        self.RasterYSize, self.RasterXSize = array.shape
+        self.band = _Band(array)
+
+    def GetRasterBand(self, index):
+        return self.band
+
+
+def _border_noise(rows=40, cols=6000, left=200, right=300):
+    # valid data with zeros on the left and low noise on the right, with
+    # single bright pixels that do not make a column valid
+    array = np.full((rows, cols), 500, dtype=np.float32)
+    array[:, :left] = 0
+    array[:, cols - right:] = np.random.default_rng(4).uniform(
+        0, 100, (rows, right)
+    )
+    array[0, cols - right:] = 1000
+    return array
+
+
+def test_border_noise_columns():
+    band = _Band(_border_noise())
+    assert grd_to_ard._border_noise_columns(band, 6000, 40) == 350
+    assert grd_to_ard._border_noise_columns(
+        band, 6000, 40, from_right=True) == 450
+    # only the chunks up to the valid data are read
+    assert band.read_cols == 1000
+
+    # the first valid column is found across chunks as well
+    assert grd_to_ard._border_noise_columns(
+        band, 6000, 40, from_right=True, chunk_size=64) == 450
+
+    # no valid data within the border of a narrow image
+    band = _Band(np.zeros((40, 1000), dtype=np.float32))
+    assert grd_to_ard._border_noise_columns(band, 1000, 40) == 1000
+
+
+def test_grd_remove_border_pols(monkeypatch):
+    rasters = {'VV.img': _Raster(_border_noise()),
+               'VH.img': _Raster(_border_noise(left=0, right=2000))}
+    monkeypatch.setattr(grd_to_ard.gdal, 'Open',
+                        lambda infile, access: rasters[infile])
+    grd_to_ard._grd_remove_border_pols(list(rasters))
+
+    result = rasters['VV.img'].band.array
+    assert not result[:, :350].any() and not result[:, -450:].any()
+    assert (result[:, 350:-450] == 500).all()
+
+    # valid data right at the left edge keeps the buffer only
+    result = rasters['VH.img'].band.array
+    assert not result[:, :150].any() and not result[:, -2150:].any()
+    assert (result[:, 150:-2150] == 500).all()
 
 
 def test_ost_grd_to_ard(
@@ -0,0 +1,92 @@
+import os
+from tempfile import TemporaryDirectory
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from ost import Sentinel1Scene
+from ost.helpers import metadata
+from ost.helpers.metadata import MetadataStore, stored_bursts
+
+SCENE_ID = 'S1A_IW_SLC__1SDV_20190101T171515_20190101T171542_025287_02CC09_0A0B'
+
+MANIFEST = '''<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1"
+    xmlns:safe="http://www.esa.int/safe/sentinel-1.0"
+    xmlns:gml="http://www.opengis.net/gml">
+  <metadataSection><metadataObject><metadataWrap><xmlData>
+    <safe:frameSet><safe:frame><safe:footPrint>
+      <gml:coordinates>48.0,10.0 48.0,13.0 50.0,13.0 50.0,10.0</gml:coordinates>
+    </safe:footPrint></safe:frame></safe:frameSet>
+  </xmlData></metadataWrap></metadataObject></metadataSection>
+</xfdu:XFDU>'''
+
+
+def _bursts():
+    return gpd.GeoDataFrame({
+        'SceneID': SCENE_ID, 'Track': 117, 'Date': '20190101',
+        'SwathID': ['IW1', 'IW1', 'IW2'], 'AnxTime': [12345, 12372, 12400],
+        'BurstNr': [1, 2, 1],
+        'geometry': [box(10, 48, 11, 48.2), box(10, 48.2, 11, 48.4),
+                     box(11, 48, 12, 48.2)]
+    }, crs='epsg:4326')
+
+
+class _Scene():
+    scene_id = SCENE_ID
+
+    def __init__(self):
+        self.calls = 0
+
+    @stored_bursts
+    def annotation_get(self):
+        self.calls += 1
+        return _bursts()
+
+
+def test_metadata_store_bursts():
+    with TemporaryDirectory() as temp:
+        store = MetadataStore(os.path.join(temp, 'ost', 'metadata.sqlite'))
+        assert store.get_bursts(SCENE_ID) is None
+
+        store.put_bursts(SCENE_ID, _bursts())
+        # e.g. read by another process
+        gdf = MetadataStore(store.path).get_bursts(SCENE_ID)
+        assert gdf.crs.to_epsg() == 4326
+        assert list(gdf.columns) == list(_bursts().columns)
+        for column in ['SceneID', 'Track', 'Date', 'SwathID', 'AnxTime',
+                       'BurstNr']:
+            assert gdf[column].tolist() == _bursts()[column].tolist()
+        assert all(gdf.geom_equals(_bursts().geometry))
+
+        # a disabled store keeps nothing
+        assert MetadataStore('').get_bursts(SCENE_ID) is None
+
+
+def test_stored_bursts(monkeypatch):
+    with TemporaryDirectory() as temp:
+        monkeypatch.setattr(metadata, 'METADATA_STORE',
+                            os.path.join(temp, 'metadata.sqlite'))
+        scene = _Scene()
+        first = scene.annotation_get()
+        second = _Scene().annotation_get()
+        assert scene.calls == 1
+        assert second.AnxTime.tolist() == first.AnxTime.tolist()
+
+
+def test_center_lat_from_store(monkeypatch):
+    with TemporaryDirectory() as temp:
+        monkeypatch.setattr(metadata, 'METADATA_STORE',
+                            os.path.join(temp, 'metadata.sqlite'))
+        safe = os.path.join(temp, '{}.SAFE'.format(SCENE_ID))
+        os.makedirs(safe)
+        with open(os.path.join(safe, 'manifest.safe'), 'w') as file:
+            file.write(MANIFEST)
+
+        scene = Sentinel1Scene(SCENE_ID)
+        assert scene._get_center_lat(safe) == 49
+        # the manifest is not read again
+        os.remove(os.path.join(safe, 'manifest.safe'))
+        assert scene._get_center_lat(safe) == 49
+
+        footprint, _ = MetadataStore().get_footprint(SCENE_ID)
+        assert footprint.bounds == (10, 48, 13, 50)
@@ -0,0 +1,84 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from scipy import ndimage
+
+from ost.helpers import morphology
+
+
+STRUCTURES = [
+    np.ones((3, 3)),
+    np.ones((5, 3)),
+    np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]]),
+    np.array([[1, 0, 0], [0, 1, 1], [0, 0, 1]]),
+]
+
+
+def test_morphology_matches_scipy():
+    array = np.random.default_rng(3).random((60, 70)) > 0.3
+    for structure in STRUCTURES:
+        for operation in ['erosion', 'dilation', 'opening', 'closing']:
+            result = morphology.OPERATIONS[operation](array, structure)
+            control = getattr(ndimage, 'binary_{}'.format(operation))(
+                array, structure.astype(bool)
+            )
+            assert np.array_equal(result, control), operation
+
+
+def test_morphology_band_stack():
+    stack = np.random.default_rng(4).random((2, 30, 40)) > 0.2
+    eroded = morphology.binary_erosion(stack)
+    assert eroded.shape == stack.shape
+    assert np.array_equal(
+        eroded[1], ndimage.binary_erosion(stack[1], np.ones((3, 3)))
+    )
+
+
+def test_binary_morphology_raster_blockwise():
+    mask = np.random.default_rng(5).random((700, 650)) > 0.1
+    structure = np.ones((5, 5))
+    with TemporaryDirectory() as temp:
+        infile = os.path.join(temp, 'mask.tif')
+        outfile = os.path.join(temp, 'opened.tif')
+        with rasterio.open(
+                infile, 'w', driver='GTiff', width=650, height=700,
+                count=1, dtype='uint8'
+        ) as dst:
+            dst.write(mask.astype('uint8'), 1)
+
+        # a tiny budget forces many blocks
+        morphology.binary_morphology_raster(
+            infile, outfile, 'opening', structure, ram_budget=0.05
+        )
+        with rasterio.open(outfile) as src:
+            result = src.read(1).astype(bool)
+    assert np.array_equal(result, ndimage.binary_opening(mask, structure))
+
+
+def test_binary_morphology_raster_closing():
+    mask = np.random.default_rng(6).random((300, 250)) > 0.6
+    with TemporaryDirectory() as temp:
+        infile = os.path.join(temp, 'mask.tif')
+        outfile = os.path.join(temp, 'closed.tif')
+        with rasterio.open(
+                infile, 'w', driver='GTiff', width=250, height=300,
+                count=1, dtype='uint8'
+        ) as dst:
+            dst.write(mask.astype('uint8'), 1)
+
+        for structure in STRUCTURES + [np.ones((4, 2))]:
+            for iterations in [1, 2]:
+                control = ndimage.binary_closing(
+                    mask, structure.astype(bool), iterations
+                )
+                # many blocks and a single block
+                for ram_budget in [0.02, 100]:
+                    morphology.binary_morphology_raster(
+                        infile, outfile, 'closing', structure, iterations,
+                        ram_budget=ram_budget
+                    )
+                    with rasterio.open(outfile) as src:
+                        result = src.read(1).astype(bool)
+                    assert np.array_equal(result, control), structure
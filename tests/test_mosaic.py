@@ -0,0 +1,119 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from ost.mosaic import mosaic
+
+
+def _write(filename, array, left, top):
+    with rasterio.open(
+            filename, 'w', driver='GTiff', width=array.shape[1],
+            height=array.shape[0], count=1, dtype='float32',
+            crs='EPSG:32633', nodata=0,
+            transform=from_origin(left, top, 20, 20)
+    ) as dst:
+        dst.write(array.astype('float32'), 1)
+    return filename
+
+
+def _read(filename):
+    with rasterio.open(filename) as src:
+        return src.read(1), src.transform
+
+
+def test_harmonisation_coefficients():
+    means = np.array([[0, 1.0, 0], [2.0, 0, 0], [0, 0, 0]])
+    counts = np.array([[0, 10, 0], [10, 0, 0], [0, 0, 0]])
+    gains = mosaic.harmonisation_coefficients(means, counts, 'gain')
+    # the overlapping inputs are aligned and keep their level,
+    # the isolated one stays as it is
+    np.testing.assert_allclose(gains, [4 / 3, 2 / 3, 1], rtol=1e-4)
+
+    offsets = mosaic.harmonisation_coefficients(
+        means - 10, counts, 'offset'
+    )
+    np.testing.assert_allclose(offsets, [0.5, -0.5, 0], atol=1e-4)
+
+
+def test_mosaic_native_feathering():
+    with TemporaryDirectory() as temp:
+        # two images of 100 columns, overlapping by 40 columns
+        first = _write(os.path.join(temp, 'first.tif'),
+                       np.full((60, 100), 1.0), 400000, 5000000)
+        second = _write(os.path.join(temp, 'second.tif'),
+                        np.full((60, 100), 2.0), 401200, 5000000)
+        outfile = os.path.join(temp, 'mosaic.tif')
+        mosaic.mosaic_native([first, second], outfile, harmonize=False,
+                             feather=10)
+        result, transform = _read(outfile)
+
+        # tiny windows give the same mosaic
+        blockwise = os.path.join(temp, 'blockwise.tif')
+        mosaic.mosaic_native([first, second], blockwise, harmonize=False,
+                             feather=10, ram_budget=0.05)
+        np.testing.assert_allclose(_read(blockwise)[0], result, rtol=1e-6)
+
+    assert result.shape == (60, 160)
+    assert transform == from_origin(400000, 5000000, 20, 20)
+    assert np.all(result[:, :60] == 1) and np.all(result[:, 100:] == 2)
+    # the overlap blends smoothly from one image to the other
+    profile = result[30, 55:105]
+    assert np.all(np.diff(profile) >= 0)
+    assert np.all(result[:, 70:90] == 1.5)
+
+
+def test_mosaic_native_harmonisation_and_aoi():
+    field = np.random.default_rng(9).gamma(4, 0.05, (60, 160))
+    with TemporaryDirectory() as temp:
+        # the second image is twice as bright
+        first = _write(os.path.join(temp, 'first.tif'),
+                       field[:, :100], 400000, 5000000)
+        second = _write(os.path.join(temp, 'second.tif'),
+                        2 * field[:, 60:], 401200, 5000000)
+        outfile = os.path.join(temp, 'mosaic.tif')
+        aoi = {'type': 'Polygon', 'coordinates': [[
+            (400500, 4999900), (402500, 4999900), (402500, 4999300),
+            (400500, 4999300), (400500, 4999900)
+        ]]}
+        mosaic.mosaic_native([first, second], outfile, features=[aoi],
+                             features_crs='EPSG:32633', feather=10)
+        result, transform = _read(outfile)
+
+    # cut to the bounds of the AOI
+    assert transform == from_origin(400500, 4999900, 20, 20)
+    assert result.shape == (30, 100)
+    # both images are brought to a common level
+    np.testing.assert_allclose(
+        result, field[5:35, 25:125] * 4 / 3, rtol=1e-3
+    )
+
+
+def _fake_mosaic(filelist, outfile, cut_to_aoi=False, **kwargs):
+    # a layer fails without any input
+    if filelist:
+        with open(outfile, 'w') as file:
+            file.write(' '.join(filelist))
+        with open(mosaic.processed_file(outfile), 'w') as file:
+            file.write('passed all tests \n')
+
+
+def test_mosaic_layers(monkeypatch):
+    monkeypatch.setattr(mosaic, 'mosaic', _fake_mosaic)
+    with TemporaryDirectory() as temp:
+        layers = [([str(i)], os.path.join(temp, '{}.tif'.format(i)))
+                  for i in range(6)]
+        layers[4] = ([], layers[4][1])
+        # a finished layer is not mosaicked again
+        with open(mosaic.processed_file(layers[2][1]), 'w') as file:
+            file.write('passed all tests \n')
+        open(layers[2][1], 'w').close()
+
+        outfiles = mosaic.mosaic_layers(layers, max_workers=3)
+
+        assert outfiles == [outfile for i, (_, outfile) in enumerate(layers)
+                            if i != 4]
+        assert os.path.getsize(layers[2][1]) == 0
+        assert os.path.getsize(layers[5][1]) > 0
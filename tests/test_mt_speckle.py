@@ -0,0 +1,121 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from scipy import ndimage
+
+from ost.multitemporal import mt_speckle
+
+
+def _quegan_reference(stack, size):
+    # local means with scipy, outside of the image is no data
+    valid = (stack != 0).astype(float)
+    sums = ndimage.uniform_filter(stack, (1, size, size), mode='constant')
+    counts = ndimage.uniform_filter(valid, (1, size, size), mode='constant')
+    means = np.where(counts > 0, sums / np.where(counts > 0, counts, 1), 0)
+    ratios = np.where(valid > 0, stack / np.where(means > 0, means, 1), 0)
+    dates = valid.sum(axis=0)
+    avg_ratio = ratios.sum(axis=0) / np.maximum(dates, 1)
+    return np.where(valid > 0, means * avg_ratio, 0)
+
+
+def _time_series(dates=5, rows=90, cols=110):
+    # gamma distributed speckle on a constant backscatter, with gaps
+    stack = np.random.default_rng(6).gamma(1, 0.1, (dates, rows, cols))
+    stack[1, :20, :30] = 0
+    stack[3, 50:, 80:] = 0
+    return stack
+
+
+def test_quegan_filter_matches_scipy():
+    stack = _time_series()
+    for size in [3, 5]:
+        halo = size // 2
+        padded = np.pad(stack, ((0, 0), (halo, halo), (halo, halo)))
+        result = mt_speckle.quegan_filter(padded, size, size)
+        assert result.shape == stack.shape
+        np.testing.assert_allclose(
+            result, _quegan_reference(stack, size), rtol=1e-5, atol=1e-7
+        )
+
+    # the speckle is reduced, the backscatter is preserved
+    result = mt_speckle.quegan_filter(
+        np.pad(stack, ((0, 0), (2, 2), (2, 2))), 5, 5
+    )
+    assert result[0].std() < stack[0].std() / 2
+    assert abs(result[0].mean() - stack[0].mean()) < 0.01
+
+
+def test_mt_speckle_to_gtiff_blockwise():
+    stack = _time_series(4, 300, 260).astype('float32')
+    with TemporaryDirectory() as temp:
+        infiles, outfiles = [], []
+        for i, array in enumerate(stack):
+            infile = os.path.join(temp, 'date{}.tif'.format(i))
+            with rasterio.open(
+                    infile, 'w', driver='GTiff', width=260, height=300,
+                    count=1, dtype='float32', crs='EPSG:32633', nodata=0,
+                    transform=from_origin(400000, 5000000, 20, 20)
+            ) as dst:
+                dst.write(array, 1)
+            infiles.append(infile)
+            outfiles.append(os.path.join(temp, '{}.tif'.format(i + 1)))
+
+        # a tiny budget forces many blocks
+        mt_speckle.mt_speckle_to_gtiff(
+            infiles, outfiles, speckle_dict={'filter_x_size': 5,
+                                             'filter_y_size': 5},
+            ram_budget=0.1
+        )
+        result = []
+        for outfile in outfiles:
+            with rasterio.open(outfile) as src:
+                result.append(src.read(1))
+                assert src.nodata == 0
+
+    np.testing.assert_allclose(
+        np.array(result), _quegan_reference(stack.astype(float), 5),
+        rtol=1e-5, atol=1e-7
+    )
+
+
+def test_mt_speckle_to_gtiff_append():
+    stack = _time_series(4, 120, 100).astype('float32')
+    with TemporaryDirectory() as temp:
+        infiles = []
+        for i, array in enumerate(stack):
+            infile = os.path.join(temp, 'date{}.tif'.format(i))
+            with rasterio.open(
+                    infile, 'w', driver='GTiff', width=100, height=120,
+                    count=1, dtype='float32', crs='EPSG:32633', nodata=0,
+                    transform=from_origin(400000, 5000000, 20, 20)
+            ) as dst:
+                dst.write(array, 1)
+            infiles.append(infile)
+
+        speckle_dict = {'filter_x_size': 3, 'filter_y_size': 3}
+        stats_file = os.path.join(temp, '.stats.tif')
+        outfiles = [os.path.join(temp, '{}.tif'.format(i + 1))
+                    for i in range(4)]
+        mt_speckle.mt_speckle_to_gtiff(
+            infiles[:3], outfiles[:3], speckle_dict=speckle_dict,
+            stats_file=stats_file
+        )
+        # only the new date is read, on the grid of the time-series
+        mt_speckle.mt_speckle_to_gtiff(
+            infiles[3:], outfiles[3:], speckle_dict=speckle_dict,
+            grid=outfiles[0], stats_file=stats_file
+        )
+        with rasterio.open(outfiles[3]) as src:
+            appended = src.read(1)
+        with rasterio.open(stats_file) as src:
+            dates = src.read(2)
+
+    # the new date is filtered with all dates
+    np.testing.assert_allclose(
+        appended, _quegan_reference(stack.astype(float), 3)[3],
+        rtol=1e-5, atol=1e-7
+    )
+    assert dates.max() == 4
@@ -0,0 +1,115 @@
+import os
+from tempfile import TemporaryDirectory
+
+import fiona
+import numpy as np
+import rasterio
+import rasterio.mask
+from rasterio.transform import from_origin
+
+from ost.helpers import raster
+from ost.helpers.raster import (
+    plan_windows, to_gtiff_clip_by_extend, convert_to_db, scale_to_int
+)
+
+
+def test_plan_windows_budget():
+    with TemporaryDirectory() as temp:
+        stack = os.path.join(temp, 'stack.tif')
+        with rasterio.open(
+                stack, 'w', driver='GTiff', width=1000, height=900,
+                count=100, dtype='float32', tiled=True,
+                blockxsize=128, blockysize=128
+        ):
+            pass
+
+        with rasterio.open(stack) as src:
+            # all fits into one window
+            assert len(plan_windows(src, ram_budget=4096)) == 1
+
+            for ram_budget in [100, 1]:
+                windows = plan_windows(src, ram_budget=ram_budget)
+                # windows cover the full raster
+                assert sum(w.width * w.height for w in windows) == 1000 * 900
+                # and stay within budget
+                for window in windows:
+                    window_bytes = window.width * window.height * 100 * 4 * 4
+                    assert window_bytes <= ram_budget * 1048576
+
+
+def test_to_gtiff_clip_by_extend_streaming():
+    rng = np.random.default_rng(9)
+    image = rng.gamma(1, 0.1, (1, 400, 300)).astype('float32')
+    image[0, 300:, :50] = 0
+    polygon = [(400500, 4999500), (405000, 4999000), (405500, 4993000),
+               (401000, 4992500), (400500, 4999500)]
+    with TemporaryDirectory() as temp:
+        infile = os.path.join(temp, 'Gamma0_VV.img')
+        outfile = os.path.join(temp, 'clipped.tif')
+        extent = os.path.join(temp, 'extent.shp')
+        with rasterio.open(
+                infile, 'w', driver='GTiff', width=300, height=400, count=1,
+                dtype='float32', crs='EPSG:32633', nodata=0,
+                transform=from_origin(400000, 5000000, 20, 20)
+        ) as dst:
+            dst.write(image)
+        with fiona.open(
+                extent, 'w', driver='ESRI Shapefile', crs='EPSG:32633',
+                schema={'geometry': 'Polygon', 'properties': {}}
+        ) as dst:
+            dst.write({'geometry': {'type': 'Polygon',
+                                    'coordinates': [polygon]},
+                       'properties': {}})
+
+        # a tiny budget forces many blocks
+        to_gtiff_clip_by_extend(
+            infile, outfile, extent, to_db=True, out_dtype='uint16',
+            min_value=-30, max_value=5, ram_budget=0.05
+        )
+
+        with rasterio.open(infile) as src:
+            with fiona.open(extent) as file:
+                features = [feature['geometry'] for feature in file]
+            control, transform = rasterio.mask.mask(src, features, crop=True)
+        with rasterio.open(outfile) as src:
+            assert src.transform == transform
+            assert src.descriptions == ('Gamma0_VV',)
+            result = src.read()
+
+    valid = control != 0
+    control = scale_to_int(convert_to_db(control), -30, 5, 'uint16')
+    assert np.array_equal(result, np.where(valid, control, 0))
+
+
+def test_gtiff_profile():
+    options = raster.gtiff_profile('float32', 1000, 900, profile='COG')
+    assert options['predictor'] == 3
+    assert options['blockxsize'] == 512
+    assert 'overviews' not in options
+
+    # integers get the horizontal predictor, small images smaller blocks
+    options = raster.gtiff_profile('uint8', 100, 300, profile='COG')
+    assert options['predictor'] == 2
+    assert (options['blockxsize'], options['blockysize']) == (64, 256)
+
+
+def test_to_gtiff_clip_by_extend_cog(monkeypatch):
+    monkeypatch.setattr(raster, 'OUTPUT_PROFILE', 'COG')
+    image = np.random.default_rng(10).gamma(1, 0.1, (1, 600, 1100))
+    with TemporaryDirectory() as temp:
+        infile = os.path.join(temp, 'Gamma0_VV.img')
+        outfile = os.path.join(temp, 'cog.tif')
+        with rasterio.open(
+                infile, 'w', driver='GTiff', width=1100, height=600, count=1,
+                dtype='float32', crs='EPSG:32633', nodata=0,
+                transform=from_origin(400000, 5000000, 20, 20)
+        ) as dst:
+            dst.write(image.astype('float32'))
+
+        to_gtiff_clip_by_extend(infile, outfile, None)
+        with rasterio.open(outfile) as src:
+            assert src.overviews(1) == [2]
+            assert src.compression.value == 'DEFLATE'
+            assert src.block_shapes[0] == (512, 512)
+            assert src.descriptions == ('Gamma0_VV',)
+            assert np.allclose(src.read(), image)
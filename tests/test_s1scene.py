@@ -1,4 +1,9 @@
+import os
+import xml.etree.ElementTree as ET
+from tempfile import TemporaryDirectory
+
 from ost import Sentinel1Scene
+from ost.helpers.metadata import MetadataStore
 
 
 def test_s1scene_metadata(s1_id):
@@ -18,3 +23,64 @@ def test_s1scene_metadata(s1_id):
         'Relative_Orbit': '117'
     }
     assert s1_info == control
+
+
+def _annotation(bursts=3, lines_per_burst=1500, samples=20000):
+    # a geolocation grid with points at the burst edges, of which one
+    # is off by a line (as in real annotation files)
+    points = []
+    for i in range(bursts + 1):
+        line = i * lines_per_burst - (1 if i == 2 else 0)
+        for pixel in [0, 10000, samples - 1]:
+            points.append(
+                '<geolocationGridPoint><line>{}</line><pixel>{}</pixel>'
+                '<latitude>{}</latitude><longitude>{}</longitude>'
+                '</geolocationGridPoint>'.format(
+                    line, pixel, 45 + i * 0.2, 10 + pixel / 20000
+                )
+            )
+    burst_list = ''.join(
+        '<burst><azimuthAnxTime>{}</azimuthAnxTime></burst>'.format(
+            1234.5 + i * 2.75
+        ) for i in range(bursts)
+    )
+    return ET.fromstring(
+        '<product><adsHeader><swath>IW2</swath></adsHeader><swathTiming>'
+        '<linesPerBurst>{}</linesPerBurst>'
+        '<samplesPerBurst>{}</samplesPerBurst>'
+        '<burstList>{}</burstList></swathTiming><geolocationGrid>'
+        '<geolocationGridPointList>{}</geolocationGridPointList>'
+        '</geolocationGrid></product>'.format(
+            lines_per_burst, samples, burst_list, ''.join(points)
+        )
+    )
+
+
+def test_s1scene_burst_database(s1_slc_ost_master):
+    _, s1 = s1_slc_ost_master
+    gdf = s1._burst_database(_annotation())
+
+    assert list(gdf.columns) == ['SceneID', 'Track', 'Date', 'SwathID',
+                                 'AnxTime', 'BurstNr', 'geometry']
+    assert list(gdf.BurstNr) == [1, 2, 3]
+    assert list(gdf.AnxTime) == [12345, 12372, 12400]
+    assert set(gdf.SwathID) == {'IW2'}
+    # the corners of the second burst are found one line before
+    assert gdf.geometry.iloc[1].bounds == (10.0, 45.2, 11.0, 45.4)
+    assert gdf.geometry.iloc[2].bounds == (10.0, 45.4, 11.0, 45.6)
+
+
+def test_s1scene_burst_database_store(s1_slc_ost_master):
+    scene_id, s1 = s1_slc_ost_master
+    gdf = s1._burst_database(_annotation())
+    with TemporaryDirectory() as temp:
+        store = MetadataStore(os.path.join(temp, 'metadata.sqlite'))
+        store.put_bursts(scene_id, gdf)
+        stored = store.get_bursts(scene_id)
+
+    # same types, e.g. for the burst ids in output file names
+    assert stored.drop(columns='geometry').dtypes.to_dict() == \
+        gdf.drop(columns='geometry').dtypes.to_dict()
+    assert stored.drop(columns='geometry').equals(gdf.drop(columns='geometry'))
+    assert str(stored.AnxTime.iloc[0]) == '12345'
+    assert all(a.equals(b) for a, b in zip(stored.geometry, gdf.geometry))
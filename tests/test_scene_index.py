@@ -0,0 +1,137 @@
+import os
+from tempfile import TemporaryDirectory
+
+from ost import Sentinel1Scene
+from ost.helpers import scene_index
+from ost.helpers.scene_index import SceneIndex
+
+SCENE_IDS = [
+    'S1A_IW_SLC__1SDV_20190101T171515_20190101T171542_025287_02CC09_0A0B',
+    'S1A_IW_SLC__1SDV_20190113T171514_20190113T171541_025462_02D252_C063',
+    'S1B_IW_GRDH_1SDV_20180813T054020_20180813T054045_012240_0168D6_B775'
+]
+
+
+def _download(download_dir, scene_id, marker=True):
+    scene = Sentinel1Scene(scene_id)
+    path = scene._download_path(download_dir, mkdir=True)
+    open(path, 'w').close()
+    if marker:
+        open('{}.downloaded'.format(path), 'w').close()
+    return path
+
+
+def _age(root):
+    # older than the timestamp resolution of any file system
+    for path, _, _ in os.walk(root):
+        os.utime(path, (0, 0))
+
+
+def test_scene_index_refresh(monkeypatch):
+    with TemporaryDirectory() as temp:
+        download_dir = os.path.join(temp, 'download')
+        index_dir = os.path.join(temp, 'index')
+        first = _download(download_dir, SCENE_IDS[0])
+        # not yet completely downloaded
+        _download(download_dir, SCENE_IDS[2], marker=False)
+        _age(download_dir)
+
+        index = SceneIndex(download_dir, index_dir=index_dir, max_age=3600)
+        assert index.get(SCENE_IDS[0]) == first
+        assert SCENE_IDS[2] not in index
+        assert len(index) == 1
+
+        second = _download(download_dir, SCENE_IDS[1])
+        # the index is not rescanned before its maximum age
+        assert SCENE_IDS[1] not in index
+
+        listed = []
+        scandir = os.scandir
+
+        def _scandir(path):
+            listed.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, 'scandir', _scandir)
+        index.invalidate()
+        assert index.get(SCENE_IDS[1]) == second
+        # only the changed directories are listed
+        month = os.path.join(download_dir, 'SAR', 'SLC', '2019', '01')
+        assert listed == [month, os.path.join(month, '13')]
+
+        # the index is cached on disk
+        _age(download_dir)
+        index.refresh()
+        listed.clear()
+        cached = SceneIndex(download_dir, index_dir=index_dir)
+        assert cached.get(SCENE_IDS[0]) == first
+        assert listed == []
+
+
+def test_get_path_from_index(monkeypatch):
+    with TemporaryDirectory() as temp:
+        download_dir = os.path.join(temp, 'download')
+        data_mount = os.path.join(temp, 'eodata')
+
+        downloaded = _download(download_dir, SCENE_IDS[0])
+        creodias = Sentinel1Scene(SCENE_IDS[1])._creodias_path(data_mount)
+        os.makedirs(creodias)
+        open(os.path.join(creodias, 'manifest.safe'), 'w').close()
+
+        # the same paths as probed without the index
+        monkeypatch.setattr(scene_index, 'SCENE_INDEX_DIR', '')
+        probed = [Sentinel1Scene(scene_id).get_path(download_dir, data_mount)
+                  for scene_id in SCENE_IDS]
+        monkeypatch.setattr(scene_index, 'SCENE_INDEX_DIR',
+                            os.path.join(temp, 'index'))
+        assert [Sentinel1Scene(scene_id).get_path(download_dir, data_mount)
+                for scene_id in SCENE_IDS] == probed
+
+        assert Sentinel1Scene(SCENE_IDS[0]).get_path(
+            download_dir, data_mount) == downloaded
+        assert Sentinel1Scene(SCENE_IDS[1]).get_path(
+            download_dir, data_mount) == creodias
+        assert Sentinel1Scene(SCENE_IDS[2]).get_path(
+            download_dir, data_mount) is None
+        # scenes on the data mount are not in the download directory
+        assert Sentinel1Scene(SCENE_IDS[1]).get_path(
+            download_dir, data_mount=None) is None
+
+
+def test_scene_index_lazy(monkeypatch):
+    with TemporaryDirectory() as temp:
+        data_mount = os.path.join(temp, 'eodata')
+        scenes = [Sentinel1Scene(scene_id) for scene_id in SCENE_IDS]
+        for scene in scenes:
+            os.makedirs(scene._creodias_path(data_mount))
+        # completed only after the listing of its day
+        for scene in scenes[1:]:
+            open(os.path.join(scene._creodias_path(data_mount),
+                              'manifest.safe'), 'w').close()
+
+        listed = []
+        scandir = os.scandir
+
+        def _scandir(path):
+            listed.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, 'scandir', _scandir)
+        index = SceneIndex(data_mount, 'creodias', max_age=3600)
+        day = ('SLC', '2019', '01', '01')
+        assert index.get(SCENE_IDS[0], day) is None
+        # only the day directory of the scene is listed, and only once
+        assert listed == [os.path.join(index.base, *day)]
+        open(os.path.join(scenes[0]._creodias_path(data_mount),
+                          'manifest.safe'), 'w').close()
+        assert index.get(SCENE_IDS[0], day) == \
+            scenes[0]._creodias_path(data_mount)
+        assert index.get(SCENE_IDS[1], day) is None
+        assert len(listed) == 1 and len(index) == 1
+
+        # missing days are not listed again either
+        assert index.get(SCENE_IDS[0], ('SLC', '2019', '01', '02')) is None
+        assert len(listed) == 1
+        assert index.get(SCENE_IDS[1], ('SLC', '2019', '01', '13')) == \
+            scenes[1]._creodias_path(data_mount)
+        assert len(listed) == 2 and index.index_file is None
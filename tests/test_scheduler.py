@@ -0,0 +1,69 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ost.helpers.scheduler import ResourceScheduler
+
+JOB_RESOURCES = {
+    'small': {'cores': 1, 'memory': 1000, 'disk': 0},
+    'large': {'cores': 4, 'memory': 3000, 'disk': 5000},
+    'default': {'cores': 1, 'memory': 100, 'disk': 0}
+}
+
+
+def test_max_jobs_and_threads():
+    scheduler = ResourceScheduler(
+        cores=16, memory=8000, disk=10000, job_resources=JOB_RESOURCES
+    )
+    # memory is the limit for small jobs, disk for large ones
+    assert scheduler.max_jobs('small') == 8
+    assert scheduler.max_jobs('large') == 2
+    assert scheduler.max_jobs('small', max_workers=3) == 3
+    assert scheduler.gpt_threads('large') == 16
+    assert scheduler.gpt_threads('large', jobs=2) == 8
+    assert scheduler.gpt_threads('small', jobs=64) == 1
+
+
+def test_backpressure_and_retries():
+    scheduler = ResourceScheduler(
+        cores=16, memory=3500, disk=10000, job_resources=JOB_RESOURCES
+    )
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0, 'failed': set()}
+
+    def _job(item):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.01)
+        with lock:
+            state['running'] -= 1
+            # every odd item fails once
+            if item % 2 and item not in state['failed']:
+                state['failed'].add(item)
+                raise RuntimeError(item)
+        return item
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [
+            task.result() for task in scheduler.as_completed(
+                executor.submit, _job, range(10), job_type='small', retries=1
+            )
+        ]
+
+    # only 3 jobs fit into the memory at once, despite 8 threads
+    assert state['max_running'] == 3
+    assert sorted(results) == list(range(10))
+    assert scheduler._running == 0
+
+    # without retries, the failure is passed on
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        state['failed'] = set()
+        with pytest.raises(RuntimeError):
+            for task in scheduler.as_completed(
+                    executor.submit, _job, [1], job_type='small'
+            ):
+                task.result()
+    assert scheduler._running == 0
@@ -0,0 +1,137 @@
+import os
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pytest
+import rasterio
+from scipy import stats
+
+from ost.multitemporal import timescan
+from ost.multitemporal.timescan import calc_metrics
+
+
+def test_calc_metrics_matches_numpy():
+    rng = np.random.default_rng(42)
+    stack = rng.normal(-15, 3, size=(25, 20, 30)).astype('float32')
+    stack[rng.random(stack.shape) < 0.2] = np.nan
+    stack[:, 0, 0] = np.nan
+
+    metrics = ['avg', 'std', 'min', 'max', 'median', 'p95', 'p5', 'cov', 'count']
+    arr = calc_metrics(stack, metrics)
+
+    control = {
+        'avg': np.nanmean(stack, axis=0),
+        'std': np.nanstd(stack, axis=0),
+        'min': np.nanmin(stack, axis=0),
+        'max': np.nanmax(stack, axis=0),
+        'median': np.nanmedian(stack, axis=0),
+        'p95': np.nanpercentile(stack, 95, axis=0),
+        'p5': np.nanpercentile(stack, 5, axis=0),
+        'cov': stats.variation(stack, axis=0, nan_policy='omit'),
+        'count': np.count_nonzero(stack, axis=0)
+    }
+    for metric in metrics:
+        assert np.allclose(
+            arr[metric], np.nan_to_num(control[metric]), rtol=1e-4, atol=1e-4
+        ), metric
+
+    # pixels without any valid observation end up as 0
+    assert arr['avg'][0, 0] == 0
+    assert arr['p95'][0, 0] == 0
+
+
+def test_calc_metrics_only_requested():
+    stack = np.ones((5, 4, 4), dtype='float32')
+    arr = calc_metrics(stack, ['max', 'count'])
+    assert sorted(arr.keys()) == ['count', 'max']
+    assert np.all(arr['count'] == 5)
+
+
+def test_metrics_from_merged_stats():
+    rng = np.random.default_rng(7)
+    stack = rng.gamma(2, 0.05, size=(30, 20, 25))
+    stack[rng.random(stack.shape) < 0.1] = np.nan
+
+    # statistics of two parts of the time-series, merged
+    first, first_hist = timescan._stats_block(stack[:18], 'float32',
+                                              sketch=True)
+    second, second_hist = timescan._stats_block(stack[18:], 'float32',
+                                                sketch=True)
+    stats = timescan.merge_stats(first, second)
+    hist = first_hist + second_hist
+
+    metrics = ['avg', 'std', 'cov', 'min', 'max', 'count',
+               'median', 'p5', 'p95']
+    arr = timescan.metrics_from_stats(stats, metrics, hist)
+    control = calc_metrics(stack, metrics)
+    for metric in ['avg', 'std', 'cov', 'min', 'max', 'count']:
+        assert np.allclose(arr[metric], control[metric], rtol=1e-6), metric
+
+    # percentiles are approximated within a histogram bin (in dB)
+    low, high, _ = timescan.SKETCH_RANGES['bs']
+    bin_width = (high - low) / timescan.SKETCH_BINS
+    for metric in ['median', 'p5', 'p95']:
+        error = np.abs(
+            10 * np.log10(arr[metric]) - 10 * np.log10(control[metric])
+        )
+        assert error.max() < bin_width, metric
+
+
+def test_sketch_linear_product():
+    rng = np.random.default_rng(9)
+    stack = rng.beta(2, 3, size=(25, 20, 15))
+    stats, hist = timescan._stats_block(stack, 'float32', sketch=True,
+                                        product='coh')
+
+    metrics = ['median', 'p5', 'p95']
+    arr = timescan.metrics_from_stats(stats, metrics, hist, 'coh')
+    control = calc_metrics(stack, metrics)
+
+    # coherence is binned linearly over its range of 0 to 1
+    low, high, _ = timescan.SKETCH_RANGES['coh']
+    bin_width = (high - low) / timescan.SKETCH_BINS
+    for metric in metrics:
+        error = np.abs(arr[metric] - control[metric])
+        assert error.max() < bin_width, metric
+
+    with pytest.raises(ValueError):
+        timescan.mt_metrics('stack.vrt', 'TC.VV', list(metrics),
+                            incremental=True, product='sigma0')
+
+
+def test_mt_metrics_incremental():
+    rng = np.random.default_rng(8)
+    stack = rng.gamma(2, 0.05, size=(9, 40, 30)).astype('float32')
+    metrics = ['avg', 'std', 'max', 'count']
+    with TemporaryDirectory() as temp:
+
+        def _write_stack(layers):
+            filename = os.path.join(temp, 'stack{}.tif'.format(layers))
+            with rasterio.open(
+                    filename, 'w', driver='GTiff', width=30, height=40,
+                    count=layers, dtype='float32'
+            ) as dst:
+                dst.write(stack[:layers])
+            return filename
+
+        def _read_metrics(prefix):
+            result = {}
+            for metric in metrics:
+                with rasterio.open('{}.{}.tif'.format(prefix, metric)) as src:
+                    result[metric] = src.read(1)
+            return result
+
+        prefix = os.path.join(temp, 'TC.VV')
+        timescan.mt_metrics(_write_stack(6), prefix, list(metrics),
+                            incremental=True, max_workers=2)
+        # only the 3 new layers are read and added to the statistics
+        timescan.mt_metrics(_write_stack(9), prefix, list(metrics),
+                            incremental=True, max_workers=2)
+        incremental = _read_metrics(prefix)
+        with rasterio.open(os.path.join(temp, '.TC.VV.stats.tif')) as src:
+            assert src.tags()['LAYERS'] == ','.join(map(str, range(1, 10)))
+
+        control = os.path.join(temp, 'control')
+        timescan.mt_metrics(_write_stack(9), control, list(metrics))
+        for metric, array in _read_metrics(control).items():
+            assert np.allclose(incremental[metric], array, rtol=1e-5), metric